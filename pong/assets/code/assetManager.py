@@ -0,0 +1,178 @@
+# Fonts and sounds for the client, found relative to this package instead of the current directory.
+# Importing pygame and decoding the assets takes a noticeable part of a second, so preload() does it on a
+# background thread while the start screen waits for the user, and playGame only waits if it isn't done yet.
+# The assets can also come from a single bundle file built by buildBundle, which holds the font files as is and
+# the sounds already decoded to the mixer's sample format, so no WAV parsing or resampling happens at startup.
+#
+# Bundle layout, in network byte order:
+#   HEADER  magic b"PONGPACK", format version, mixer frequency, sample size, channels, entry count
+#   ENTRY   kind, name, data length, then that many bytes of data. One per font and sound
+import io
+import os
+import struct
+import threading
+
+ASSET_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))   # pong/assets
+DEFAULT_BUNDLE = os.path.join(ASSET_DIR, "assets.bundle")
+
+MIXER_FREQUENCY = 44100
+MIXER_SIZE = -16            # Signed 16 bit samples
+MIXER_CHANNELS = 2
+MIXER_BUFFER = 2048
+
+# Name -> (file, point size)
+FONTS = {
+    "score": ("fonts/pong-score.ttf", 32),
+    "win": ("fonts/visitor.ttf", 48),
+}
+# Name -> file
+SOUNDS = {
+    "point": "sounds/point.wav",
+    "bounce": "sounds/bounce.wav",
+}
+
+MAGIC = b"PONGPACK"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("!8sBiiBB")
+ENTRY = struct.Struct("!B16sI")
+
+KIND_FONT = 1
+KIND_SOUND = 2
+
+def assetPath(name: str) -> str:
+    # Purpose:      Finds an asset no matter which directory the client was started from
+    # Pre:          name is relative to pong/assets, like "fonts/visitor.ttf"
+    # Post:         Returns the absolute path
+# ============================================================================
+    return os.path.join(ASSET_DIR, *name.split("/"))
+
+def initMixer() -> None:
+    # Sets up the mixer with the format the bundle's sounds are stored in. Safe to call more than once
+    import pygame
+    pygame.mixer.pre_init(MIXER_FREQUENCY, MIXER_SIZE, MIXER_CHANNELS, MIXER_BUFFER)
+    if not pygame.mixer.get_init():
+        pygame.mixer.init()
+
+def buildBundle(path: str) -> None:
+    # Purpose:      Writes every font and sound into one bundle file
+    # Pre:          The mixer can be initialized, since the sounds are decoded through it
+    # Post:         path holds the bundle. Sounds are stored in whatever format the mixer ended up with
+# ============================================================================
+    import pygame
+    initMixer()
+    frequency, size, channels = pygame.mixer.get_init()
+
+    entries = []
+    for name, (file, _) in FONTS.items():
+        with open(assetPath(file), "rb") as fontFile:
+            entries.append((KIND_FONT, name, fontFile.read()))
+    for name, file in SOUNDS.items():
+        entries.append((KIND_SOUND, name, pygame.mixer.Sound(assetPath(file)).get_raw()))
+
+    with open(path, "wb") as bundle:
+        bundle.write(HEADER.pack(MAGIC, FORMAT_VERSION, frequency, size, channels, len(entries)))
+        for kind, name, data in entries:
+            bundle.write(ENTRY.pack(kind, name.encode(), len(data)))
+            bundle.write(data)
+
+def readBundle(path: str) -> tuple[tuple[int, int, int], dict[str, bytes], dict[str, bytes]]:
+    # Purpose:      Reads a bundle written by buildBundle
+    # Pre:          n/a
+    # Post:         Returns (mixer format of the sounds, font data by name, sound samples by name).
+    #                   Raises ValueError if path isn't a bundle of this version
+# ============================================================================
+    with open(path, "rb") as bundle:
+        data = bundle.read()
+    if len(data) < HEADER.size:
+        raise ValueError(f"{path} is too short to be an asset bundle")
+    magic, version, frequency, size, channels, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"{path} is not a version {FORMAT_VERSION} asset bundle")
+
+    fonts, sounds = {}, {}
+    offset = HEADER.size
+    for _ in range(count):
+        if offset + ENTRY.size > len(data):
+            raise ValueError(f"{path} is cut short")
+        kind, name, length = ENTRY.unpack_from(data, offset)
+        offset += ENTRY.size
+        if offset + length > len(data):
+            raise ValueError(f"{path} is cut short")
+        name = name.rstrip(b"\0").decode()
+        (fonts if kind == KIND_FONT else sounds)[name] = data[offset:offset + length]
+        offset += length
+    return (frequency, size, channels), fonts, sounds
+
+class AssetManager:
+    # Purpose:      Loads the client's fonts and sounds once, ahead of time if asked
+    # Pre:          bundlePath is a bundle from buildBundle, or None to read the asset files. A bundle that is
+    #                   missing, unreadable, or decoded for a different mixer format falls back to the files
+    # Post:         font(name) and sound(name) return the loaded objects, waiting for preload() if it is running
+    #                   and loading everything on the spot if it was never called
+# ============================================================================
+    def __init__(self, bundlePath: str | None = None) -> None:
+        self.bundlePath = bundlePath
+        self.fonts = {}
+        self.sounds = {}
+        self.error: Exception | None = None     # Whatever stopped the background load, raised on first use
+        self.loaded = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+
+    def preload(self) -> None:
+        # Starts loading on a background thread. Does nothing if loading already started
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.load, daemon=True)
+        self.thread.start()
+
+    def load(self) -> None:
+        try:
+            import pygame
+            initMixer()
+            pygame.font.init()
+
+            fonts, sounds = {}, {}
+            if self.bundlePath is not None and os.path.exists(self.bundlePath):
+                try:
+                    mixerFormat, fonts, sounds = readBundle(self.bundlePath)
+                except (OSError, ValueError):
+                    fonts, sounds = {}, {}
+                else:
+                    # Raw samples only play right in the format they were decoded to
+                    if mixerFormat != pygame.mixer.get_init():
+                        sounds = {}
+
+            for name, (file, size) in FONTS.items():
+                # The font keeps reading from the file object, so each one gets its own
+                source = io.BytesIO(fonts[name]) if name in fonts else assetPath(file)
+                self.fonts[name] = pygame.font.Font(source, size)
+            for name, file in SOUNDS.items():
+                if name in sounds:
+                    self.sounds[name] = pygame.mixer.Sound(buffer=sounds[name])
+                else:
+                    self.sounds[name] = pygame.mixer.Sound(assetPath(file))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.loaded.set()
+
+    def wait(self) -> None:
+        with self.lock:
+            started = self.thread is not None
+            if not started:
+                self.thread = threading.current_thread()
+        if not started:
+            self.load()
+        self.loaded.wait()
+        if self.error is not None:
+            raise self.error
+
+    def font(self, name: str):
+        self.wait()
+        return self.fonts[name]
+
+    def sound(self, name: str):
+        self.wait()
+        return self.sounds[name]
@@ -0,0 +1,209 @@
+# Headless pong engine that runs many games at once.
+# The state of every game lives in NumPy arrays, one element per game, and step() advances all of them with
+# array operations instead of a Python loop. The rules are the same as PongSimulation's, step for step: each
+# step finds the first collision or other event in every game, moves every game to its own event, handles
+# them and repeats until every game has used up the step. The arithmetic is done in the same order as
+# PongSimulation and helperCode.sweptAABB so the float positions come out bit for bit the same, but nothing
+# here needs pygame or a display.
+import numpy as np
+
+from assets.code.rules import (PADDLE_WIDTH, PADDLE_HEIGHT, PADDLE_SPEED, BALL_SIZE, BALL_SPEED, WALL_HEIGHT,
+                               WINNING_SCORE, EVENT_BOUNCE, EVENT_POINT, EVENT_GAME_OVER)
+
+# Same as in helperCode and simulation, which import pygame so can't be imported here
+AXIS_X = 1
+AXIS_Y = 2
+TOUCH_EPSILON = 1e-9
+MAX_EVENTS = 64
+HIT_NOTHING = 0
+CROSSED_EDGE = 1
+HIT_WALL = 2
+HIT_PADDLE_SIDE = 3
+HIT_PADDLE_EDGE = 4
+PADDLE_STOPPED = 5
+
+def axisOverlap(position: np.ndarray, size: float, velocity: np.ndarray, other, otherSize: float
+                ) -> tuple[np.ndarray, np.ndarray]:
+    # When a box moving along one axis starts and stops overlapping another box on that axis. Boxes not moving
+    # on the axis overlap forever if they already do, and never otherwise
+    near = other - (position + size)
+    far = other + otherSize - position
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entry = np.where(velocity > 0, near, far) / velocity
+        exit = np.where(velocity > 0, far, near) / velocity
+    still = velocity == 0
+    overlapping = (position + size > other) & (position < other + otherSize)
+    entry = np.where(still, np.where(overlapping, -np.inf, np.inf), entry)
+    exit = np.where(still, np.where(overlapping, np.inf, -np.inf), exit)
+    return entry, exit
+
+def sweptAABB(x: np.ndarray, y: np.ndarray, width: float, height: float, xVel: np.ndarray, yVel: np.ndarray,
+              otherX, otherY, otherWidth: float, otherHeight: float) -> tuple[np.ndarray, np.ndarray]:
+    # Vectorized helperCode.sweptAABB. Returns (time, axis) arrays, time being inf and axis 0 where nothing is hit
+    xEntry, xExit = axisOverlap(x, width, xVel, otherX, otherWidth)
+    yEntry, yExit = axisOverlap(y, height, yVel, otherY, otherHeight)
+    entry = np.maximum(xEntry, yEntry)
+    hit = (entry < np.minimum(xExit, yExit)) & (entry >= -TOUCH_EPSILON)
+    time = np.where(hit, np.maximum(entry, 0.0), np.inf)
+    axis = np.where(hit, np.where(xEntry >= yEntry, AXIS_X, AXIS_Y), 0)
+    return time, axis
+
+class BatchEngine:
+    # Purpose:      Holds and advances the state of count games
+    # Pre:          moving[:, side] is set to -1 (up), 0 or 1 (down) for every game before each step, side 0
+    #                   being the left paddle
+    # Post:         step() advances every game by one frame, exactly as PongSimulation.step() would
+# ============================================================================
+    def __init__(self, count: int, screenWidth: int, screenHeight: int) -> None:
+        self.count = count
+        self.screenWidth = screenWidth
+        self.screenHeight = screenHeight
+        self.games = np.arange(count)
+
+        # Where pygame.Rect puts things, since it truncates the float positions PongSimulation gives it
+        self.paddleStartY = int(screenHeight / 2 - PADDLE_HEIGHT / 2)
+        self.paddleX = (10, screenWidth - 20)
+        self.paddleBottom = screenHeight - WALL_HEIGHT - PADDLE_HEIGHT
+        self.ballStartX = int(screenWidth / 2)
+        self.ballStartY = int(screenHeight / 2)
+
+        self.ballX = np.empty(count, dtype=np.float64)
+        self.ballY = np.empty(count, dtype=np.float64)
+        self.ballXVel = np.empty(count, dtype=np.int64)
+        self.ballYVel = np.empty(count, dtype=np.int64)
+        self.paddleY = np.empty((count, 2), dtype=np.float64)   # [:, 0] is the left paddle, [:, 1] the right
+        self.moving = np.zeros((count, 2), dtype=np.int8)
+        self.lScore = np.empty(count, dtype=np.int64)
+        self.rScore = np.empty(count, dtype=np.int64)
+        self.tick = np.empty(count, dtype=np.int64)
+        self.reset(np.ones(count, dtype=bool))
+
+    def reset(self, games: np.ndarray) -> None:
+        # Starts the selected games over, games being a boolean mask or an array of indices
+        self.ballX[games] = self.ballStartX
+        self.ballY[games] = self.ballStartY
+        self.ballXVel[games] = -BALL_SPEED
+        self.ballYVel[games] = 0
+        self.paddleY[games] = self.paddleStartY
+        self.moving[games] = 0
+        self.lScore[games] = 0
+        self.rScore[games] = 0
+        self.tick[games] = 0
+
+    def gameOver(self) -> np.ndarray:
+        return (self.lScore >= WINNING_SCORE) | (self.rScore >= WINNING_SCORE)
+
+    def saveState(self, game: int) -> tuple:
+        # One game's state, laid out like PongSimulation.saveState() so the two can be compared
+        return (float(self.ballX[game]), float(self.ballY[game]), int(self.ballXVel[game]), int(self.ballYVel[game]),
+                float(self.paddleY[game, 0]), float(self.paddleY[game, 1]),
+                int(self.lScore[game]), int(self.rScore[game]), int(self.tick[game]))
+
+    def upcoming(self, playing: np.ndarray, velocity: np.ndarray) -> list:
+        # (kind, side, frames from now) for everything that can happen next in each game, in the same order as
+        # PongSimulation.upcoming. Times are inf where it can't happen
+        x, y, xVel, yVel = self.ballX, self.ballY, self.ballXVel, self.ballYVel
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # The ball reaching either edge of the screen, or a wall
+            edge = np.maximum(0.0, np.where(xVel > 0, self.screenWidth - x, 0 - x) / xVel)
+            wall = np.maximum(0.0, np.where(yVel < 0, WALL_HEIGHT - y,
+                                            self.screenHeight - WALL_HEIGHT - BALL_SIZE - y) / yVel)
+            upcoming = [
+                (CROSSED_EDGE, 0, np.where(playing & (xVel != 0), edge, np.inf)),
+                (HIT_WALL, 0, np.where(playing & (yVel != 0), wall, np.inf)),
+            ]
+
+            # The ball reaching a paddle, which may be moving too
+            for side in (0, 1):
+                time, axis = sweptAABB(x, y, BALL_SIZE, BALL_SIZE, xVel, yVel - velocity[:, side],
+                                       self.paddleX[side], self.paddleY[:, side], PADDLE_WIDTH, PADDLE_HEIGHT)
+                upcoming.append((np.where(axis == AXIS_X, HIT_PADDLE_SIDE, HIT_PADDLE_EDGE), side,
+                                 np.where(playing, time, np.inf)))
+
+            # A paddle reaching the wall it is moving toward
+            for side in (0, 1):
+                paddleY, paddleVel = self.paddleY[:, side], velocity[:, side]
+                stop = np.maximum(0.0, np.where(paddleVel > 0, self.paddleBottom - paddleY,
+                                                WALL_HEIGHT - paddleY) / paddleVel)
+                upcoming.append((PADDLE_STOPPED, side, np.where(paddleVel != 0, stop, np.inf)))
+        return upcoming
+
+    def move(self, games: np.ndarray, playing: np.ndarray, velocity: np.ndarray, frames: np.ndarray) -> None:
+        # Moves the ball and paddles of the selected games along their velocities
+        ball = games & playing
+        self.ballX = np.where(ball, self.ballX + self.ballXVel * frames, self.ballX)
+        self.ballY = np.where(ball, self.ballY + self.ballYVel * frames, self.ballY)
+        self.paddleY = np.where(games[:, None], self.paddleY + velocity * frames[:, None], self.paddleY)
+
+    def step(self, frames: float = 1.0) -> np.ndarray:
+        # Advances every game by a number of frames and returns each game's EVENT_ bits
+        events = np.zeros(self.count, dtype=np.uint8)
+        games = self.games
+
+        # Paddles move until they reach the wall they are moving toward
+        velocity = np.where((self.moving == 1) & (self.paddleY < self.paddleBottom), PADDLE_SPEED,
+                            np.where((self.moving == -1) & (self.paddleY > WALL_HEIGHT), -PADDLE_SPEED, 0))
+        playing = ~self.gameOver()      # Once someone has won the ball stops
+
+        remaining = np.full(self.count, float(frames))
+        active = np.ones(self.count, dtype=bool)      # Games that haven't used up the step yet
+        for _ in range(MAX_EVENTS):
+            # The first thing to happen in each game
+            first = remaining + TOUCH_EPSILON
+            kind = np.full(self.count, HIT_NOTHING)
+            side = np.zeros(self.count, dtype=np.int64)
+            for kind_, side_, time in self.upcoming(playing, velocity):
+                earlier = time < first
+                first = np.where(earlier, time, first)
+                kind = np.where(earlier, kind_, kind)
+                side = np.where(earlier, side_, side)
+            nothing = kind == HIT_NOTHING
+            first = np.where(nothing, remaining, first)
+
+            # Move every game to the moment it happens
+            self.move(active, playing, velocity, first)
+            remaining = np.where(active, np.maximum(0.0, remaining - first), remaining)
+
+            # The ball made it past a paddle, so update score, etc.
+            crossed = active & (kind == CROSSED_EDGE)
+            leftScored = crossed & (self.ballXVel > 0)
+            rightScored = crossed & ~leftScored
+            self.lScore += leftScored
+            self.rScore += rightScored
+            self.ballX[crossed] = self.ballStartX
+            self.ballY[crossed] = self.ballStartY
+            self.ballXVel[crossed] = np.where(leftScored[crossed], -BALL_SPEED, BALL_SPEED)
+            self.ballYVel[crossed] = 0
+            events[crossed] |= EVENT_POINT
+            won = crossed & self.gameOver()
+            events[won] |= EVENT_GAME_OVER
+            playing &= ~won
+
+            # Bounces off walls and paddles
+            hitWall = active & (kind == HIT_WALL)
+            self.ballYVel[hitWall] *= -1
+            hitSide = active & (kind == HIT_PADDLE_SIDE)
+            paddleCenter = self.paddleY[games, side] + PADDLE_HEIGHT // 2
+            self.ballXVel[hitSide] *= -1
+            self.ballYVel[hitSide] = np.floor((self.ballY + BALL_SIZE // 2 - paddleCenter) / 2
+                                              + TOUCH_EPSILON)[hitSide].astype(np.int64)
+            hitEdge = active & (kind == HIT_PADDLE_EDGE)
+            self.ballYVel[hitEdge] = (2 * velocity[games, side] - self.ballYVel)[hitEdge]
+            events[hitWall | hitSide | hitEdge] |= EVENT_BOUNCE
+
+            # A paddle reached a wall
+            stopped = active & (kind == PADDLE_STOPPED)
+            stoppedSide = side[stopped]
+            self.paddleY[stopped, stoppedSide] = np.where(velocity[stopped, stoppedSide] > 0, self.paddleBottom,
+                                                          WALL_HEIGHT)
+            velocity[stopped, stoppedSide] = 0
+
+            active &= ~nothing
+            if not active.any():
+                break
+
+        # Games where too much happened in one step finish it without looking for anything else
+        self.move(active, playing, velocity, remaining)
+
+        self.tick += 1
+        return events
@@ -0,0 +1,86 @@
+# Round trip time and clock offset estimates for one connection, NTP style.
+# Either side sends MSG_PING with its clock reading T1. The other side notes when it arrived (T2) and answers with
+# MSG_PONG when it next sends (T3), and the pong arrives back at T4. Then
+#   round trip = (T4 - T1) - (T3 - T2)          time on the wire, without the time the answer waited to be sent
+#   offset     = ((T2 - T1) + (T3 - T4)) / 2    the peer's clock minus ours, exact if both ways take equally long
+# Both are smoothed with an EWMA like TCP's RTT estimate. An offset sample is only as good as the round trip it
+# came from is short, so samples from round trips past what TCP would time out on are left out of the offset.
+# A ping sent while the peer is still starting up can sit unread in its buffers, so the first STARTUP_SAMPLES only
+# keep the fastest round trip seen, the way NTP prefers its lowest delay sample.
+#
+# answer() only notes the ping, and the pong goes out with the next message the answering side sends anyway.
+# That keeps every send on the thread or coroutine that already does the sending.
+from assets.code.protocol import encodePing, decodePing, encodePong, decodePong
+
+PING_INTERVAL = 0.5         # Seconds between pings
+RTT_SMOOTHING = 0.125       # Weight of a new round trip sample, as in TCP
+VARIANCE_SMOOTHING = 0.25   # Weight of a new sample in the round trip variation
+OFFSET_SMOOTHING = 0.125    # Weight of a new offset sample
+STARTUP_SAMPLES = 4         # Pongs before smoothing starts
+
+class ClockSync:
+    # Purpose:      Keeps smoothed round trip time and clock offset estimates for one peer
+    # Pre:          Every clock reading passed in is from the same clock, in seconds. ping() is sent whenever
+    #                   pingDue() says so, pings from the peer go to answer() and pongs to handlePong()
+    # Post:         rtt, rttVariation and offset hold the estimates once synced() is True. toLocal() converts a
+    #                   peer clock reading to ours
+# ============================================================================
+    __slots__ = ("sequence", "nextPing", "pending", "rtt", "rttVariation", "offset", "samples")
+
+    def __init__(self) -> None:
+        self.sequence = 0           # Sequence number of the last ping sent
+        self.nextPing = 0.0         # Clock reading the next ping is due at
+        self.pending: tuple[int, float, float] | None = None    # (sequence, origin, arrival) of a ping to answer
+        self.rtt = 0.0              # Smoothed round trip time
+        self.rttVariation = 0.0     # Smoothed mean deviation of the round trip time
+        self.offset = 0.0           # Smoothed peer clock minus our clock
+        self.samples = 0            # Pongs received
+
+    def synced(self) -> bool:
+        return self.samples > 0
+
+    def pingDue(self, now: float) -> bool:
+        return now >= self.nextPing
+
+    def ping(self, now: float) -> bytes:
+        self.sequence += 1
+        self.nextPing = now + PING_INTERVAL
+        return encodePing(self.sequence, now)
+
+    def answer(self, data: bytes, now: float) -> None:
+        # Notes a ping from the peer, which arrived at now. Only the newest ping is answered
+        sequence, origin = decodePing(data)
+        self.pending = (sequence, origin, now)
+
+    def reply(self, now: float) -> bytes | None:
+        # The pong for the noted ping, or None if there is nothing to answer. Call right before sending it
+        pending, self.pending = self.pending, None
+        if pending is None:
+            return None
+        sequence, origin, arrival = pending
+        return encodePong(sequence, origin, arrival, now)
+
+    def handlePong(self, data: bytes, now: float) -> float | None:
+        # Purpose:      Updates the estimates from a pong, which arrived at now
+        # Pre:          data holds a MSG_PONG message
+        # Post:         Returns the round trip sample, or None if the pong is not for our latest ping
+# ============================================================================
+        sequence, origin, arrival, sent = decodePong(data)
+        if sequence != self.sequence:   # An answer to an older ping that took so long a newer one went out
+            return None
+        rtt = max(0.0, (now - origin) - (sent - arrival))
+        offset = ((arrival - origin) + (sent - now)) / 2
+        if not self.samples or (self.samples < STARTUP_SAMPLES and rtt < self.rtt):
+            self.rtt = rtt
+            self.rttVariation = rtt / 2
+            self.offset = offset
+        elif self.samples >= STARTUP_SAMPLES:
+            self.rttVariation += (abs(rtt - self.rtt) - self.rttVariation) * VARIANCE_SMOOTHING
+            if rtt <= self.rtt + 4 * self.rttVariation:
+                self.offset += (offset - self.offset) * OFFSET_SMOOTHING
+            self.rtt += (rtt - self.rtt) * RTT_SMOOTHING
+        self.samples += 1
+        return rtt
+
+    def toLocal(self, peerTime: float) -> float:
+        return peerTime - self.offset
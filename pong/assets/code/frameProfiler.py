@@ -0,0 +1,146 @@
+# Timing for every frame of playGame, split into the phases of the loop, for finding where stutter comes from.
+# Each phase costs one clock read, each frame a few stores into preallocated rings and histograms, and the overlay
+# text is only rendered a few times a second, so the profiler hardly changes what it measures. When profiling is off
+# playGame gets a NullProfiler, whose methods do nothing.
+#
+# The trace is written in the Chrome trace event format, so it opens in chrome://tracing or ui.perfetto.dev
+# with one bar per phase per frame. Only the last TRACE_FRAMES frames are kept.
+import json
+import time
+
+from assets.code.metrics import Histogram
+
+PHASES = ("events", "update", "draw", "wait")   # In the order playGame runs them
+EVENTS, UPDATE, DRAW, WAIT = range(len(PHASES))
+WINDOW = 300                # Frames the overlay's numbers cover, 5 seconds at 60 FPS
+TRACE_FRAMES = 36000        # Frames kept for the trace file, 10 minutes at 60 FPS
+OVERLAY_INTERVAL = 0.25     # Seconds between overlay refreshes
+
+class NullProfiler:
+    # Stands in for FrameProfiler when profiling is off
+    overlayVisible = False
+
+    def start(self) -> None:
+        pass
+
+    def mark(self, phase: int) -> None:
+        pass
+
+    def endFrame(self) -> None:
+        pass
+
+    def rttSample(self, rtt: float) -> None:
+        pass
+
+class FrameProfiler:
+    # Purpose:      Times each phase of every frame and keeps the numbers for the overlay and the trace file
+    # Pre:          start() is called right before the first frame. Each frame calls mark() as each phase in PHASES
+    #                   ends, in order, then endFrame()
+    # Post:         overlayLines() summarizes the last WINDOW frames, dump() writes the trace
+# ============================================================================
+    def __init__(self, tracePath: str | None) -> None:
+        self.tracePath = tracePath
+        self.overlayVisible = True
+        self.frames = 0
+        self.frameStart = 0.0
+        self.last = 0.0
+        self.started = 0.0
+
+        # Ring buffers, indexed by frame number. Phase times and frame start times are in seconds
+        self.starts = [0.0] * TRACE_FRAMES
+        self.phaseTimes = [[0.0] * TRACE_FRAMES for _ in PHASES]
+        self.current = [0.0] * len(PHASES)
+        # Every frame of the session, for percentiles the ring no longer covers
+        self.histograms = {phase: Histogram() for phase in PHASES}
+        self.histograms["frame"] = Histogram()
+
+        # Round trips to the server measured by clock sync pings. Set from the receiver thread
+        self.rtt: float | None = None
+        self.rttHistogram = Histogram()
+
+    def start(self) -> None:
+        self.started = self.frameStart = self.last = time.perf_counter()
+
+    def mark(self, phase: int) -> None:
+        now = time.perf_counter()
+        self.current[phase] = now - self.last
+        self.last = now
+
+    def endFrame(self) -> None:
+        slot = self.frames % TRACE_FRAMES
+        self.starts[slot] = self.frameStart - self.started
+        total = 0.0
+        for phase, elapsed in enumerate(self.current):
+            self.phaseTimes[phase][slot] = elapsed
+            self.histograms[PHASES[phase]].observe(elapsed)
+            total += elapsed
+        self.histograms["frame"].observe(total)
+        self.frames += 1
+        self.frameStart = self.last
+
+    def rttSample(self, rtt: float) -> None:
+        self.rtt = rtt
+        self.rttHistogram.observe(rtt)
+
+    def recent(self) -> range:
+        # Frame numbers the overlay covers
+        return range(max(0, self.frames - WINDOW), self.frames)
+
+    def overlayLines(self) -> list[str]:
+        # Purpose:      The overlay text
+        # Pre:          n/a
+        # Post:         Returns FPS, frame time average and p99, RTT, and each phase's average and p99 over the
+        #                   last WINDOW frames
+# ============================================================================
+        frames = self.recent()
+        if len(frames) < 2:
+            return ["Profiling..."]
+        slots = [frame % TRACE_FRAMES for frame in frames]
+        frameTimes = sorted(sum(times[slot] for times in self.phaseTimes) for slot in slots)
+        elapsed = self.starts[slots[-1]] - self.starts[slots[0]]
+        fps = (len(slots) - 1) / elapsed if elapsed > 0 else 0.0
+
+        def summary(times: list[float]) -> str:
+            return f"avg {sum(times) / len(times) * 1000:6.2f}  p99 {times[int(len(times) * 0.99)] * 1000:6.2f} ms"
+
+        rtt = "-" if self.rtt is None else f"{self.rtt * 1000:.1f} ms"
+        lines = [f"FPS {fps:5.1f}   RTT {rtt}", f"frame   {summary(frameTimes)}"]
+        for phase, name in enumerate(PHASES):
+            lines.append(f"{name:<8}{summary(sorted(self.phaseTimes[phase][slot] for slot in slots))}")
+        return lines
+
+    def summary(self) -> dict:
+        # Whole-session numbers in milliseconds, from the histograms
+        histograms = dict(self.histograms, rtt=self.rttHistogram)
+        return {
+            name: {
+                "count": histogram.count,
+                "avg_ms": histogram.total / histogram.count * 1000 if histogram.count else 0.0,
+                "p50_ms": histogram.percentile(0.5) * 1000,
+                "p99_ms": histogram.percentile(0.99) * 1000,
+                "max_ms": histogram.maximum * 1000,
+            }
+            for name, histogram in histograms.items()
+        }
+
+    def dump(self) -> None:
+        # Purpose:      Writes the trace file
+        # Pre:          n/a
+        # Post:         tracePath holds a Chrome trace with one event per phase of every kept frame, and the
+        #                   session summary under "otherData". Does nothing without a tracePath
+# ============================================================================
+        if self.tracePath is None:
+            return
+        events = []
+        for frame in range(max(0, self.frames - TRACE_FRAMES), self.frames):
+            slot = frame % TRACE_FRAMES
+            start = self.starts[slot] * 1e6
+            for phase, name in enumerate(PHASES):
+                duration = self.phaseTimes[phase][slot] * 1e6
+                events.append({"name": name, "ph": "X", "ts": round(start, 1), "dur": round(duration, 1),
+                               "pid": 0, "tid": 0, "args": {"frame": frame}})
+                start += duration
+        with open(self.tracePath, "w") as trace:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "otherData": {"frames": self.frames, "summary": self.summary()}}, trace)
+        print(f"Wrote frame trace to {self.tracePath}")
@@ -0,0 +1,132 @@
+# Stream framing shared by pongClient.py and pongServer.py
+# TCP is a byte stream, so one recv can return part of a message or several messages at once. Every message
+# is sent as a frame: a 2 byte big endian length followed by that many bytes of payload.
+# FrameReader receives straight into a preallocated ring buffer with recv_into and hands out memoryviews of
+# complete frames, so reading does not allocate or copy per message.
+import socket
+import struct
+
+LENGTH = struct.Struct("!H")
+MAX_FRAME_SIZE = 4096               # Largest payload either side will send or accept
+DEFAULT_CAPACITY = 2 * MAX_FRAME_SIZE   # Ring buffer size. Must hold at least one whole frame
+
+class FramingError(ValueError):
+    # Raised when a frame is too large to be sent or received
+    pass
+
+def frame(payload: bytes) -> bytes:
+    # Purpose:      Prefixes a message with its length so the other side can find where it ends
+    # Pre:          payload is at most MAX_FRAME_SIZE bytes
+    # Post:         Returns the framed message, ready to be written to the socket
+# ============================================================================
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FramingError(f"Frame of {len(payload)} bytes is larger than {MAX_FRAME_SIZE}")
+    return LENGTH.pack(len(payload)) + payload
+
+class FrameReader:
+    # Purpose:      Splits a byte stream back into frames
+    # Pre:          Call freeSpace() for a writable view, fill it (sock.recv_into or loop.sock_recv_into) and
+    #                   pass the byte count to commit(). Then iterate frames() for every complete frame
+    # Post:         Frames are memoryviews into the ring buffer. Each is only valid until the next frame is
+    #                   read or more data is received, so decode it before moving on
+# ============================================================================
+    __slots__ = ("capacity", "buffer", "view", "scratch", "scratchView", "start", "size")
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY) -> None:
+        if capacity < LENGTH.size + MAX_FRAME_SIZE:
+            raise ValueError(f"capacity must be at least {LENGTH.size + MAX_FRAME_SIZE} bytes")
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        # A frame that wraps past the end of the ring is joined here, so it can still be returned as one view
+        self.scratch = bytearray(MAX_FRAME_SIZE)
+        self.scratchView = memoryview(self.scratch)
+        self.start = 0      # Index of the first unread byte
+        self.size = 0       # Number of unread bytes
+
+    def freeSpace(self) -> memoryview:
+        # Returns the largest contiguous writable region after the unread bytes. Empty if the buffer is full
+        end = (self.start + self.size) % self.capacity
+        if self.size == self.capacity:
+            return self.view[0:0]
+        if end >= self.start:
+            return self.view[end:self.capacity]
+        return self.view[end:self.start]
+
+    def commit(self, count: int) -> None:
+        # Marks count bytes written into the region returned by freeSpace() as received
+        self.size += count
+
+    def _copyOut(self, dest: memoryview, offset: int, count: int) -> None:
+        # Copies count unread bytes starting offset bytes after start into dest, following the wrap
+        first = (self.start + offset) % self.capacity
+        head = min(count, self.capacity - first)
+        dest[:head] = self.view[first:first + head]
+        if head < count:
+            dest[head:count] = self.view[0:count - head]
+
+    def _peekLength(self) -> int:
+        if self.start + LENGTH.size <= self.capacity:
+            return LENGTH.unpack_from(self.buffer, self.start)[0]
+        self._copyOut(self.scratchView, 0, LENGTH.size)
+        return LENGTH.unpack_from(self.scratch)[0]
+
+    def frames(self):
+        # Yields a memoryview of every complete frame received so far
+        while self.size >= LENGTH.size:
+            length = self._peekLength()
+            if length > MAX_FRAME_SIZE:
+                raise FramingError(f"Received frame of {length} bytes, larger than {MAX_FRAME_SIZE}")
+            if self.size < LENGTH.size + length:
+                break
+            bodyStart = (self.start + LENGTH.size) % self.capacity
+            if bodyStart + length <= self.capacity:
+                payload = self.view[bodyStart:bodyStart + length]
+            else:
+                # The frame wraps around the end of the ring. This is the only case that copies
+                self._copyOut(self.scratchView, LENGTH.size, length)
+                payload = self.scratchView[:length]
+            self.start = (self.start + LENGTH.size + length) % self.capacity
+            self.size -= LENGTH.size + length
+            if self.size == 0:
+                # Nothing unread, so rewind to keep the next receive contiguous
+                self.start = 0
+            yield payload
+
+    def recvFrom(self, sock: socket.socket) -> int:
+        # Receives once from a blocking socket into the ring buffer. Returns the number of bytes received,
+        # 0 means the peer closed the connection
+        free = self.freeSpace()
+        if not free:
+            raise FramingError("Receive buffer is full without a complete frame")
+        count = sock.recv_into(free)
+        self.commit(count)
+        return count
+
+def recvFrame(sock: socket.socket, reader: FrameReader) -> memoryview:
+    # Purpose:      Blocks until one whole frame has been received
+    # Pre:          sock is a blocking connected socket, reader is only ever used with this socket
+    # Post:         Returns the next frame. Raises ConnectionError if the peer disconnects first.
+    #                   Frames received along with it stay queued in the reader for the next call
+# ============================================================================
+    while True:
+        for payload in reader.frames():
+            return payload
+        if reader.recvFrom(sock) == 0:
+            raise ConnectionError("Connection closed by peer")
+
+async def recvFrameAsync(loop, sock: socket.socket, reader: FrameReader) -> memoryview:
+    # Purpose:      Event loop version of recvFrame
+    # Pre:          sock is a non-blocking connected socket, loop is the running asyncio event loop
+    # Post:         Returns the next frame. Raises ConnectionError if the peer disconnects first
+# ============================================================================
+    while True:
+        for payload in reader.frames():
+            return payload
+        free = reader.freeSpace()
+        if not free:
+            raise FramingError("Receive buffer is full without a complete frame")
+        count = await loop.sock_recv_into(sock, free)
+        if count == 0:
+            raise ConnectionError("Connection closed by peer")
+        reader.commit(count)
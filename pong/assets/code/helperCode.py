@@ -1,6 +1,13 @@
 # You don't need to edit this file at all unless you really want to
+import math
 import pygame
 
+# Faces a swept box can hit another box on
+AXIS_X = 1          # Its left or right face
+AXIS_Y = 2          # Its top or bottom face
+NO_HIT = (math.inf, 0)
+TOUCH_EPSILON = 1e-9    # Float error allowed when deciding whether boxes touch or a value is a whole number
+
 # This draws the score to the screen
 def updateScore(lScore:int, rScore:int, screen:pygame.surface.Surface, color, scoreFont:pygame.font.Font) -> pygame.Rect:
     textSurface = scoreFont.render(f"{lScore}   {rScore}", False, color)
@@ -9,11 +16,62 @@ def updateScore(lScore:int, rScore:int, screen:pygame.surface.Surface, color, sc
     textRect.center = (int((screenWidth/2)+5), 50)
     return screen.blit(textSurface, textRect)
 
+# Finds when a box moving by (xVel, yVel) every frame first touches a box that stays still. For a moving
+# target pass the velocity relative to it. Returns (frames until they touch, AXIS_ of the face that was hit),
+# or NO_HIT. Boxes that already overlap, or only slide along each other's edges, don't hit, like colliderect
+def sweptAABB(x:float, y:float, width:float, height:float, xVel:float, yVel:float,
+              otherX:float, otherY:float, otherWidth:float, otherHeight:float) -> tuple[float, int]:
+    # The span of time the boxes overlap along each axis
+    if xVel > 0:
+        xEntry = (otherX - (x + width)) / xVel
+        xExit = (otherX + otherWidth - x) / xVel
+    elif xVel < 0:
+        xEntry = (otherX + otherWidth - x) / xVel
+        xExit = (otherX - (x + width)) / xVel
+    elif x + width > otherX and x < otherX + otherWidth:
+        xEntry, xExit = -math.inf, math.inf
+    else:
+        return NO_HIT
+    if xExit < 0:   # Moving away from it
+        return NO_HIT
+    if yVel > 0:
+        yEntry = (otherY - (y + height)) / yVel
+        yExit = (otherY + otherHeight - y) / yVel
+    elif yVel < 0:
+        yEntry = (otherY + otherHeight - y) / yVel
+        yExit = (otherY - (y + height)) / yVel
+    elif y + height > otherY and y < otherY + otherHeight:
+        yEntry, yExit = -math.inf, math.inf
+    else:
+        return NO_HIT
+
+    # They touch when they overlap on both axes at once
+    entry = max(xEntry, yEntry)
+    if entry >= min(xExit, yExit) or entry < -TOUCH_EPSILON:
+        return NO_HIT
+    return max(entry, 0.0), AXIS_X if xEntry >= yEntry else AXIS_Y
+
 class Paddle:
     def __init__(self, rect: pygame.Rect) -> None:
         self.rect = rect
         self.moving = ""
         self.speed = 5
+        self.y = float(rect.y)  # Exact position. rect is where it is drawn
+
+    # Pixels per frame the paddle moves, 0 once it has reached the wall it is moving toward
+    def velocity(self, top:float, bottom:float) -> int:
+        if self.moving == "down" and self.y < bottom:
+            return self.speed
+        if self.moving == "up" and self.y > top:
+            return -self.speed
+        return 0
+
+    def moveTo(self, y:float) -> None:
+        self.y = y
+        self.rect.y = round(y)
+
+    def moveBy(self, velocity:int, frames:float) -> None:
+        self.moveTo(self.y + velocity * frames)
 
 class Ball:
     def __init__(self, rect:pygame.Rect, startXvel:int, startYvel:int) -> None:
@@ -22,14 +80,28 @@ class Ball:
         self.yVel = startYvel
         self.startXpos = rect.x
         self.startYpos = rect.y
+        self.x = float(rect.x)  # Exact position. rect is where it is drawn
+        self.y = float(rect.y)
 
     def updatePos(self) -> None:
-        self.rect.x += self.xVel
-        self.rect.y += self.yVel
+        self.moveBy(1)
 
-    def hitPaddle(self, paddleCenter:int) -> None:
+    # Moves the ball along its velocity for a number of frames, which doesn't have to be whole
+    def moveBy(self, frames:float) -> None:
+        self.x += self.xVel * frames
+        self.y += self.yVel * frames
+        self.rect.x = round(self.x)
+        self.rect.y = round(self.y)
+
+    # The ball hit the side of a paddle. The further from the paddle's center, the steeper it bounces off.
+    # The epsilon stops a ball that is a whole number of pixels off center rounding down a pixel
+    def hitPaddle(self, paddleCenter:float) -> None:
         self.xVel *= -1
-        self.yVel = (self.rect.center[1] - paddleCenter)//2
+        self.yVel = math.floor((self.y + self.rect.height//2 - paddleCenter)/2 + TOUCH_EPSILON)
+
+    # The ball hit the top or bottom of a paddle moving at paddleVelocity, and bounces off it
+    def hitPaddleEdge(self, paddleVelocity:int) -> None:
+        self.yVel = 2*paddleVelocity - self.yVel
 
     def hitWall(self) -> None:
         self.yVel *= -1
@@ -38,5 +110,7 @@ class Ball:
         # nowGoing  The direction the ball should be going after the reset
         self.rect.x = self.startXpos
         self.rect.y = self.startYpos
+        self.x = float(self.startXpos)
+        self.y = float(self.startYpos)
         self.xVel = -5 if nowGoing == "left" else 5
         self.yVel = 0
@@ -0,0 +1,119 @@
+# Client side of the lockstep netcode mode.
+# Both clients run the same deterministic PongSimulation and only exchange paddle inputs, tagged with the frame
+# they belong to. A frame is simulated as soon as the local input for it is known. If the opponent's input
+# hasn't arrived yet, it's predicted to be whatever they were last doing. When the real input arrives and
+# differs from the prediction, the simulation goes back to the state saved before that frame and replays
+# every frame since with the inputs we now know.
+import threading
+import time
+from collections import deque
+
+from assets.code.protocol import encodeLockstepInput, decodeLockstepInput
+from assets.code.simulation import PongSimulation
+
+MAX_ROLLBACK = 30           # Frames we may run ahead of the opponent's last known input before waiting for it
+HISTORY_SIZE = 128          # Frames of saved states and inputs kept. Each side can be MAX_ROLLBACK ahead of the
+                            # other, so this must cover twice that, plus the frames in flight
+STALL_TIMEOUT = 5.0         # Seconds waiting on the opponent before giving up on them
+
+class LockstepSession:
+    # Purpose:      Runs the local copy of a lockstep game, with prediction and rollback
+    # Pre:          connection has finished the handshake and the server announced NETCODE_LOCKSTEP.
+    #                   advance() is called once per frame from the render loop
+    # Post:         simulation always holds the state for the newest frame, using real inputs where they have
+    #                   arrived and predictions elsewhere. If the connection fails, error is set
+# ============================================================================
+    def __init__(self, connection, screenWidth: int, screenHeight: int, playerIndex: int) -> None:
+        self.connection = connection
+        self.simulation = PongSimulation(screenWidth, screenHeight)
+        self.localIndex = playerIndex
+        self.remoteIndex = 1 - playerIndex
+        self.frame = 0              # Next frame to simulate
+
+        # Indexed by frame % HISTORY_SIZE
+        self.states: list[tuple | None] = [None] * HISTORY_SIZE     # State before each frame was simulated
+        self.localInputs = [""] * HISTORY_SIZE
+        self.remoteInputs = [""] * HISTORY_SIZE                     # Real or predicted, see confirmedFrame
+        self.confirmedFrame = -1    # Every remote input up to this frame is real
+        self.peerReceived = 0       # How many of our frames the opponent has, so the rest are resent
+
+        self.rollbackFrame: int | None = None   # Oldest simulated frame whose remote input turned out wrong
+        self.rollbacks = 0                      # Rollbacks done so far, for debugging
+        self.lastAdvance = time.monotonic()     # When a frame was last simulated, to notice the opponent is gone
+        self.received: deque[bytes] = deque()   # Filled by the receive thread, emptied by advance()
+        self.error: Exception | None = None
+        self.thread = threading.Thread(target=self.receive, daemon=True)
+        self.thread.start()
+
+    def receive(self) -> None:
+        # Runs on the background thread, so reading from the network never holds up a frame
+        try:
+            while True:
+                self.received.append(self.connection.recv())
+        except Exception as e: # Lost the connection, or the server sent something we can't read
+            self.error = e
+
+    def applyRemoteInputs(self) -> None:
+        # Records the opponent inputs received since the last frame and notes the oldest misprediction
+        while self.received:
+            endFrame, peerReceived, inputs = decodeLockstepInput(self.received.popleft())
+            self.peerReceived = max(self.peerReceived, peerReceived)
+            for frame in range(endFrame - len(inputs), endFrame):
+                if frame <= self.confirmedFrame:
+                    continue
+                if frame > self.confirmedFrame + 1:
+                    break   # A gap we can't fill yet. Our ack tells the opponent to resend from the gap
+                moving = inputs[frame - endFrame]
+                slot = frame % HISTORY_SIZE
+                if frame < self.frame and self.remoteInputs[slot] != moving:
+                    if self.rollbackFrame is None or frame < self.rollbackFrame:
+                        self.rollbackFrame = frame
+                self.remoteInputs[slot] = moving
+                self.confirmedFrame = frame
+
+    def simulateFrame(self, frame: int) -> int:
+        # Saves the state before frame, then simulates it with the inputs recorded for it
+        slot = frame % HISTORY_SIZE
+        if frame > self.confirmedFrame:
+            # No real input yet, so predict the opponent keeps doing what they did last
+            self.remoteInputs[slot] = self.remoteInputs[(frame - 1) % HISTORY_SIZE] if frame > 0 else ""
+        self.states[slot] = self.simulation.saveState()
+        self.simulation.paddles[self.localIndex].moving = self.localInputs[slot]
+        self.simulation.paddles[self.remoteIndex].moving = self.remoteInputs[slot]
+        return self.simulation.step()
+
+    def advance(self, moving: str) -> int:
+        # Purpose:      Runs one frame with the local paddle doing moving
+        # Pre:          moving is "up", "down" or ""
+        # Post:         Rolls back if the opponent's inputs proved a prediction wrong, simulates the new frame and
+        #                   sends our inputs. Returns the simulation.EVENT_ bits of the new frame, or 0 if we are
+        #                   too far ahead of the opponent and are waiting for them
+# ============================================================================
+        self.applyRemoteInputs()
+
+        if self.rollbackFrame is not None:
+            self.rollbacks += 1
+            self.simulation.loadState(self.states[self.rollbackFrame % HISTORY_SIZE])
+            for frame in range(self.rollbackFrame, self.frame):
+                self.simulateFrame(frame)
+            self.rollbackFrame = None
+
+        if self.frame - self.confirmedFrame > MAX_ROLLBACK:
+            # Resend what we have so the opponent can catch up, but don't run further ahead
+            if time.monotonic() - self.lastAdvance > STALL_TIMEOUT:
+                self.error = ConnectionError("The opponent stopped sending inputs")
+            self.sendInputs()
+            return 0
+
+        self.localInputs[self.frame % HISTORY_SIZE] = moving
+        events = self.simulateFrame(self.frame)
+        self.frame += 1
+        self.lastAdvance = time.monotonic()
+        self.sendInputs()
+        return events
+
+    def sendInputs(self) -> None:
+        # Sends every input the opponent hasn't acknowledged, with our own ack of theirs
+        startFrame = max(self.peerReceived, self.frame - HISTORY_SIZE)
+        inputs = [self.localInputs[frame % HISTORY_SIZE] for frame in range(startFrame, self.frame)]
+        self.connection.send(encodeLockstepInput(self.frame, self.confirmedFrame + 1, inputs))
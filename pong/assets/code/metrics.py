@@ -0,0 +1,92 @@
+# Counters and histograms for watching the server while it runs.
+# Everything is allocated up front, so recording a value is an integer add or a bisect into a fixed bucket
+# list. Timing something costs two clock reads, so hot paths only time one call in every SAMPLE_EVERY
+# (see Metrics.sample). Nothing is formatted until render() is called by the stats endpoint or the periodic dump.
+from bisect import bisect_left
+
+SAMPLE_EVERY = 64           # Calls between timed samples of per-message work like encoding and decoding
+
+# Bucket upper bounds in seconds, doubling from 1 microsecond to about 8 seconds
+TIME_BUCKETS = tuple(1e-6 * 2 ** i for i in range(24))
+
+class Histogram:
+    # Purpose:      Counts observed values into fixed buckets
+    # Pre:          Values are in the same unit as bounds
+    # Post:         percentile() returns the upper bound of the bucket the percentile falls in, capped at the
+    #                   largest value seen, so it is accurate to within one bucket
+# ============================================================================
+    __slots__ = ("bounds", "counts", "count", "total", "maximum")
+
+    def __init__(self, bounds: tuple[float, ...] = TIME_BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # The last bucket holds everything above the last bound
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+
+    def percentile(self, fraction: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[i], self.maximum) if i < len(self.bounds) else self.maximum
+        return self.maximum
+
+class Metrics:
+    # Purpose:      The set of named counters, gauges and histograms for one process
+    # Pre:          Every counter and histogram name is passed to the constructor. Gauges are functions that are
+    #                   only called when rendering, so they cost nothing in between
+    # Post:         render() returns every value as plain "name value" lines
+# ============================================================================
+    def __init__(self, counters: tuple[str, ...], histograms: tuple[str, ...]) -> None:
+        self.counters = dict.fromkeys(counters, 0)
+        self.histograms = {name: Histogram() for name in histograms}
+        self.gauges = {}
+        self.reasons: dict[str, int] = {}     # Disconnects by reason
+        self.calls = 0
+
+    def count(self, name: str, amount: int = 1) -> None:
+        # Unknown names raise KeyError, so a typo can't silently create a new counter
+        self.counters[name] += amount
+
+    def observe(self, name: str, value: float) -> None:
+        self.histograms[name].observe(value)
+
+    def gauge(self, name: str, read) -> None:
+        # Registers read, a function taking no arguments, to be called for name's value when rendering
+        self.gauges[name] = read
+
+    def disconnect(self, reason: str) -> None:
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def sample(self) -> bool:
+        # True once every SAMPLE_EVERY calls, for deciding whether to time this one
+        self.calls += 1
+        return self.calls % SAMPLE_EVERY == 0
+
+    def render(self) -> str:
+        lines = []
+        for name, read in self.gauges.items():
+            lines.append(f"{name} {read()}")
+        for name, value in self.counters.items():
+            lines.append(f"{name} {value}")
+        for reason, value in sorted(self.reasons.items()):
+            lines.append(f"disconnects{{reason=\"{reason}\"}} {value}")
+        for name, histogram in self.histograms.items():
+            mean = histogram.total / histogram.count if histogram.count else 0.0
+            lines.append(f"{name}_count {histogram.count}")
+            lines.append(f"{name}_mean {mean:.6f}")
+            for label, fraction in (("p50", 0.5), ("p99", 0.99), ("p999", 0.999)):
+                lines.append(f"{name}_{label} {histogram.percentile(fraction):.6f}")
+            lines.append(f"{name}_max {histogram.maximum:.6f}")
+        return "\n".join(lines) + "\n"
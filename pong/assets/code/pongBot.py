@@ -0,0 +1,70 @@
+# A computer player for the server, to fill the empty side of a game nobody else has joined.
+# The bot works out where the ball will meet its paddle in closed form instead of stepping the game ahead. Bouncing
+# between the walls is a reflection, so the ball's height is unfolded as if there were no walls, y + yVel * t, and
+# folded back with a modulo. Each bot predicts again only when the ball's velocity changes, which is when it bounces off
+# a wall or a paddle, including a paddle's top or bottom edge, or a point resets it. Predictions are cached by the
+# ball's position and velocity at that moment, which repeat often across games (every serve starts from the same
+# spot). Steering a paddle between predictions is a comparison.
+import functools
+import random
+
+from assets.code.rules import PADDLE_WIDTH, PADDLE_HEIGHT, PADDLE_SPEED, BALL_SIZE, WALL_HEIGHT
+from assets.code.simulation import PongSimulation
+
+PREDICTION_CACHE = 65536    # Predictions kept, shared by every bot in the process
+AIM_SPREAD = PADDLE_HEIGHT // 2 - 2 * BALL_SIZE # How far off center the bot may hit the ball, so returns have an angle
+
+@functools.lru_cache(maxsize=PREDICTION_CACHE)
+def predictIntercept(x: float, y: float, xVel: float, yVel: float, faceX: float, top: float, bottom: float) -> float:
+    # Purpose:      Where the ball will be when it reaches a paddle
+    # Pre:          xVel is not 0. The ball moves between y = top and y = bottom, bouncing off both
+    # Post:         Returns the ball's y once its x is faceX, or y if it is already past it
+# ============================================================================
+    frames = (faceX - x) / xVel
+    span = bottom - top
+    if frames <= 0 or span <= 0:
+        return y
+    # Unfolded, the ball goes straight, and every 2 * span it is back where it started going the same way
+    unfolded = (y - top + yVel * frames) % (2 * span)
+    return top + (unfolded if unfolded <= span else 2 * span - unfolded)
+
+class PongBot:
+    # Purpose:      Plays one side of a PongSimulation
+    # Pre:          steer() is called before every step of the simulation, with the frames that step covers
+    # Post:         steer() returns the direction for the paddle on side, like a player's input
+# ============================================================================
+    __slots__ = ("side", "heading", "target", "aim")
+
+    def __init__(self, side: int) -> None:
+        self.side = side            # 0 for left, 1 for right
+        self.heading = None         # (xVel, yVel) the target was predicted for
+        self.target = 0.0           # Paddle y the bot is moving to
+        self.aim = 0                # Offset from the paddle's center the ball is meant to hit this time
+
+    def steer(self, simulation: PongSimulation, frames: float = 1.0) -> str:
+        ball = simulation.ball
+        paddle = simulation.paddles[self.side]
+        heading = (ball.xVel, ball.yVel)
+        if heading != self.heading:
+            # The ball bounced or a point reset it. A wall bounce predicts the same spot again, but a paddle's edge
+            # can flip yVel alone, onto a new course. Only a new xVel is a new return to aim
+            newReturn = self.heading is None or ball.xVel != self.heading[0]
+            self.heading = heading
+            coming = ball.xVel < 0 if self.side == 0 else ball.xVel > 0
+            if coming:
+                faceX = paddle.rect.x + PADDLE_WIDTH if self.side == 0 else paddle.rect.x - BALL_SIZE
+                bottom = simulation.screenHeight - WALL_HEIGHT - BALL_SIZE
+                y = predictIntercept(ball.x, ball.y, ball.xVel, ball.yVel, faceX, WALL_HEIGHT, bottom)
+                if newReturn:
+                    self.aim = random.randint(-AIM_SPREAD, AIM_SPREAD)
+                center = y + BALL_SIZE / 2 - self.aim
+            else:
+                # Wait in the middle for the return
+                center = simulation.screenHeight / 2
+            self.target = min(max(center - PADDLE_HEIGHT / 2, WALL_HEIGHT), simulation.paddleBottom)
+
+        # Stop once the next step would get no closer, so the paddle doesn't jitter around the target
+        distance = self.target - paddle.y
+        if abs(distance) <= PADDLE_SPEED * frames / 2:
+            return ""
+        return "down" if distance > 0 else "up"
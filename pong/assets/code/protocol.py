@@ -0,0 +1,333 @@
+# Wire format shared by pongClient.py and pongServer.py
+# Every message is a fixed layout built with struct, in network byte order. The first two bytes of every
+# message are the protocol version and the message type, so either side can reject a message it can't read.
+import struct
+from typing import NamedTuple
+
+PROTOCOL_VERSION = 9
+
+# Message types
+MSG_HELLO = 1       # Server -> client once a game has 2 players: screen size, player index, tick rate, netcode, game
+MSG_INPUT = 3       # Client -> server every frame: paddle direction, the client's frame number and snapshot ack
+MSG_SNAPSHOT = 4    # Server -> client: the full authoritative state of the game. Also used as the delta keyframe
+MSG_DELTA = 5       # Server -> client every tick: only the fields that changed since an acknowledged snapshot
+MSG_EVENT = 6       # Server -> client, reliably: a point was scored or the game ended
+MSG_LOCKSTEP = 7    # Client -> server -> other client in lockstep games: the sender's unacknowledged paddle inputs
+MSG_JOIN = 8        # Client -> server, first message on a TCP connection: play, or watch a given game
+MSG_PING = 9        # Either way, every so often: the sender's clock reading, to be echoed in a MSG_PONG
+MSG_PONG = 10       # Answer to MSG_PING: the echoed reading, and the answering side's clock when it arrived and left
+
+# Roles a client asks for in MSG_JOIN
+ROLE_PLAYER = 0
+ROLE_SPECTATOR = 1
+SPECTATOR_INDEX = 2     # Player index in a spectator's MSG_HELLO, since they have no paddle
+
+# Netcode modes, chosen by the server and announced in MSG_HELLO
+NETCODE_SERVER = 0      # The server simulates the game and sends snapshots
+NETCODE_LOCKSTEP = 1    # Each client simulates the game, and the server only relays inputs between them
+NETCODES = {"server": NETCODE_SERVER, "lockstep": NETCODE_LOCKSTEP}
+
+# Layouts. B = version, B = message type, then the message body
+HEADER = struct.Struct("!BB")
+HELLO = struct.Struct("!BBHHBBBI")      # width, height, player index, server ticks per second, netcode, game ID
+INPUT = struct.Struct("!BBbII")         # paddle direction, input sequence number, tick of newest snapshot received
+SNAPSHOT = struct.Struct("!BBIhhhhBBBII")   # tick, ball x, ball y, left paddle y, right paddle y,
+                                            # left score, right score, events, last input processed, server time
+DELTA_HEADER = struct.Struct("!BBIBBH") # tick, ticks back to the baseline, mask of the fields that follow,
+                                        # milliseconds of server time since the baseline
+EVENT = struct.Struct("!BBIBBB")        # tick, simulation.EVENT_ bits, left score, right score
+JOIN = struct.Struct("!BBBI")           # role, game ID to watch (ignored for players)
+LOCKSTEP_HEADER = struct.Struct("!BBIIB")   # end frame, peer frames received, frame count, then a direction byte each
+PING = struct.Struct("!BBId")           # ping sequence number, sender's clock in seconds
+PONG = struct.Struct("!BBIddd")         # echoed sequence number and clock, answerer's clock on arrival and on sending
+
+# Layout of every Snapshot field after tick, except serverTime which changes every tick and is always sent, as an
+# offset from the baseline's. Bit i of a delta's mask is set when field i + 1 is present.
+# A delta is small only next to a snapshot: during play the ball and lastInput change every tick, so a typical delta
+# is 16 to 21 bytes against 25, while it takes about three times as long to encode as a snapshot (the mask is found
+# field by field in Python, a snapshot is one struct.pack) and almost twice as long to decode. So encodeDelta sends
+# the full snapshot instead unless the delta saves at least MIN_DELTA_SAVING bytes
+DELTA_FIELDS = ("h", "h", "h", "h", "B", "B", "B", "I")
+DELTA_BODIES = [struct.Struct("!" + "".join(fmt for i, fmt in enumerate(DELTA_FIELDS) if mask & (1 << i)))
+                for mask in range(1 << len(DELTA_FIELDS))]
+DELTA_POSITIONS = [tuple(i + 1 for i in range(len(DELTA_FIELDS)) if mask & (1 << i))
+                   for mask in range(1 << len(DELTA_FIELDS))]  # Snapshot index of each field in a delta's body
+MAX_DELTA_DISTANCE = 255    # Farthest back a baseline can be, since the distance is one byte
+MAX_DELTA_TIME = 0xFFFF     # Most server time, in milliseconds, a delta can be from its baseline
+MIN_DELTA_SAVING = 4        # Bytes a delta has to save over the full snapshot to be sent
+
+# Paddle.moving is a string in the game code, but a single signed byte on the wire
+MOVING_TO_WIRE = {"up": -1, "": 0, "down": 1}
+WIRE_TO_MOVING = {-1: "up", 0: "", 1: "down"}
+
+class ProtocolError(ValueError):
+    # Raised when a message is too short, has the wrong version, or is not the expected type
+    pass
+
+class Snapshot(NamedTuple):
+    # The state of a game after a server tick, as sent to one player
+    tick: int           # Server tick the snapshot was taken on
+    ballX: int
+    ballY: int
+    leftY: int          # Top of the left paddle
+    rightY: int         # Top of the right paddle
+    lScore: int
+    rScore: int
+    events: int         # simulation.EVENT_ bits for this tick
+    lastInput: int      # Sequence number of the last input the server applied for the receiving player
+    serverTime: int = 0 # Server clock in milliseconds when the tick ran, modulo 2**32. 0 when unknown, as in replays
+
+def messageType(data: bytes) -> int:
+    # Purpose:      Checks the header of a received message and returns its type
+    # Pre:          data holds at least one whole message
+    # Post:         Returns one of the MSG_ constants, or raises ProtocolError
+# ============================================================================
+    if len(data) < HEADER.size:
+        raise ProtocolError(f"Message too short: {len(data)} bytes")
+    version, msgType = HEADER.unpack_from(data)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}, expected {PROTOCOL_VERSION}")
+    return msgType
+
+def _checkType(data: bytes, expected: int, layout: struct.Struct) -> None:
+    if messageType(data) != expected:
+        raise ProtocolError(f"Expected message type {expected}, got {data[1]}")
+    if len(data) < layout.size:
+        raise ProtocolError(f"Message too short: {len(data)} bytes, expected {layout.size}")
+
+def encodeHello(width: int, height: int, playerIndex: int, tickRate: int, netcode: int = NETCODE_SERVER,
+                gameId: int = 0) -> bytes:
+    # Purpose:      Builds the handshake the server sends once a game is full, or when a spectator joins
+    # Pre:          width and height fit in 16 bits, playerIndex is 0 (left), 1 (right) or SPECTATOR_INDEX,
+    #                   tickRate is under 256, netcode is one of the NETCODE_ constants
+    # Post:         Returns the encoded message
+# ============================================================================
+    return HELLO.pack(PROTOCOL_VERSION, MSG_HELLO, width, height, playerIndex, tickRate, netcode, gameId)
+
+def decodeHello(data: bytes) -> tuple[int, int, int, int, int, int]:
+    # Purpose:      Reads the handshake sent by the server
+    # Pre:          data holds a MSG_HELLO message
+    # Post:         Returns (width, height, playerIndex, tickRate, netcode, gameId)
+# ============================================================================
+    _checkType(data, MSG_HELLO, HELLO)
+    _, _, width, height, playerIndex, tickRate, netcode, gameId = HELLO.unpack_from(data)
+    if netcode not in NETCODES.values():
+        raise ProtocolError(f"Unknown netcode {netcode}")
+    return width, height, playerIndex, tickRate, netcode, gameId
+
+def encodeJoin(role: int, gameId: int = 0) -> bytes:
+    # Purpose:      Builds the first message a TCP client sends, saying whether it plays or watches
+    # Pre:          role is ROLE_PLAYER or ROLE_SPECTATOR. gameId is the game to watch
+    # Post:         Returns the encoded message
+# ============================================================================
+    return JOIN.pack(PROTOCOL_VERSION, MSG_JOIN, role, gameId)
+
+def decodeJoin(data: bytes) -> tuple[int, int]:
+    # Purpose:      Reads a client's MSG_JOIN
+    # Pre:          data holds a MSG_JOIN message
+    # Post:         Returns (role, gameId)
+# ============================================================================
+    _checkType(data, MSG_JOIN, JOIN)
+    _, _, role, gameId = JOIN.unpack_from(data)
+    if role not in (ROLE_PLAYER, ROLE_SPECTATOR):
+        raise ProtocolError(f"Unknown role {role}")
+    return role, gameId
+
+def encodeInput(moving: str, sequence: int, ack: int) -> bytes:
+    # Purpose:      Builds the per-frame input message a client sends
+    # Pre:          moving is one of "up", "down" or "", sequence counts up by one every frame,
+    #                   ack is the tick of the newest snapshot the client has decoded
+    # Post:         Returns the encoded message
+# ============================================================================
+    return INPUT.pack(PROTOCOL_VERSION, MSG_INPUT, MOVING_TO_WIRE[moving], sequence, ack)
+
+def decodeInput(data: bytes) -> tuple[str, int, int]:
+    # Purpose:      Reads a client's input message
+    # Pre:          data holds a MSG_INPUT message
+    # Post:         Returns (moving, sequence, ack)
+# ============================================================================
+    _checkType(data, MSG_INPUT, INPUT)
+    _, _, moving, sequence, ack = INPUT.unpack_from(data)
+    if moving not in WIRE_TO_MOVING:
+        raise ProtocolError(f"Invalid paddle direction {moving}")
+    return WIRE_TO_MOVING[moving], sequence, ack
+
+def encodeSnapshot(snapshot: Snapshot) -> bytes:
+    # Purpose:      Builds the state message the server sends every tick
+    # Pre:          n/a
+    # Post:         Returns the encoded message
+# ============================================================================
+    return SNAPSHOT.pack(PROTOCOL_VERSION, MSG_SNAPSHOT, *snapshot)
+
+def decodeSnapshot(data: bytes) -> Snapshot:
+    # Purpose:      Reads a state message from the server
+    # Pre:          data holds a MSG_SNAPSHOT message
+    # Post:         Returns the Snapshot
+# ============================================================================
+    _checkType(data, MSG_SNAPSHOT, SNAPSHOT)
+    return Snapshot._make(SNAPSHOT.unpack_from(data)[2:])
+
+def encodeEvent(tick: int, events: int, lScore: int, rScore: int) -> bytes:
+    # Purpose:      Builds the message announcing a point or the end of the game
+    # Pre:          events holds simulation.EVENT_POINT and/or simulation.EVENT_GAME_OVER
+    # Post:         Returns the encoded message
+# ============================================================================
+    return EVENT.pack(PROTOCOL_VERSION, MSG_EVENT, tick, events, lScore, rScore)
+
+def decodeEvent(data: bytes) -> tuple[int, int, int, int]:
+    # Purpose:      Reads an event message
+    # Pre:          data holds a MSG_EVENT message
+    # Post:         Returns (tick, events, lScore, rScore)
+# ============================================================================
+    _checkType(data, MSG_EVENT, EVENT)
+    _, _, tick, events, lScore, rScore = EVENT.unpack_from(data)
+    return tick, events, lScore, rScore
+
+def encodeLockstepInput(endFrame: int, received: int, inputs: list[str]) -> bytes:
+    # Purpose:      Builds a lockstep input message. Every input the peer hasn't acknowledged is repeated, so a
+    #                   lost message is covered by the next one
+    # Pre:          inputs holds the paddle direction for frames endFrame - len(inputs) through endFrame - 1, oldest
+    #                   first, and has at most 255 entries. received is how many of the peer's frames we have
+    # Post:         Returns the encoded message
+# ============================================================================
+    return (LOCKSTEP_HEADER.pack(PROTOCOL_VERSION, MSG_LOCKSTEP, endFrame, received, len(inputs))
+            + bytes(MOVING_TO_WIRE[moving] & 0xFF for moving in inputs))
+
+def decodeLockstepInput(data: bytes) -> tuple[int, int, list[str]]:
+    # Purpose:      Reads a lockstep input message
+    # Pre:          data holds a MSG_LOCKSTEP message
+    # Post:         Returns (endFrame, received, inputs), inputs being oldest first and ending with the input for
+    #                   frame endFrame - 1
+# ============================================================================
+    _checkType(data, MSG_LOCKSTEP, LOCKSTEP_HEADER)
+    _, _, endFrame, received, count = LOCKSTEP_HEADER.unpack_from(data)
+    if len(data) < LOCKSTEP_HEADER.size + count or count > endFrame:
+        raise ProtocolError(f"Lockstep message with {count} inputs is malformed")
+    inputs = []
+    for byte in data[LOCKSTEP_HEADER.size:LOCKSTEP_HEADER.size + count]:
+        moving = byte - 256 if byte > 127 else byte
+        if moving not in WIRE_TO_MOVING:
+            raise ProtocolError(f"Invalid paddle direction {moving}")
+        inputs.append(WIRE_TO_MOVING[moving])
+    return endFrame, received, inputs
+
+def encodePing(sequence: int, sent: float) -> bytes:
+    # Purpose:      Builds a clock sync request
+    # Pre:          sent is the sender's clock reading in seconds as the message goes out
+    # Post:         Returns the encoded message
+# ============================================================================
+    return PING.pack(PROTOCOL_VERSION, MSG_PING, sequence, sent)
+
+def decodePing(data: bytes) -> tuple[int, float]:
+    # Purpose:      Reads a clock sync request
+    # Pre:          data holds a MSG_PING message
+    # Post:         Returns (sequence, sent)
+# ============================================================================
+    _checkType(data, MSG_PING, PING)
+    _, _, sequence, sent = PING.unpack_from(data)
+    return sequence, sent
+
+def encodePong(sequence: int, origin: float, received: float, sent: float) -> bytes:
+    # Purpose:      Builds the answer to a MSG_PING
+    # Pre:          sequence and origin are from the ping, received and sent are the answerer's clock when the
+    #                   ping arrived and as this message goes out
+    # Post:         Returns the encoded message
+# ============================================================================
+    return PONG.pack(PROTOCOL_VERSION, MSG_PONG, sequence, origin, received, sent)
+
+def decodePong(data: bytes) -> tuple[int, float, float, float]:
+    # Purpose:      Reads the answer to a MSG_PING
+    # Pre:          data holds a MSG_PONG message
+    # Post:         Returns (sequence, origin, received, sent)
+# ============================================================================
+    _checkType(data, MSG_PONG, PONG)
+    _, _, sequence, origin, received, sent = PONG.unpack_from(data)
+    return sequence, origin, received, sent
+
+def encodeDelta(snapshot: Snapshot, baseline: Snapshot) -> bytes:
+    # Purpose:      Builds a snapshot message holding only the fields that differ from baseline
+    # Pre:          baseline is a snapshot the receiver has acknowledged, at most MAX_DELTA_DISTANCE ticks older
+    # Post:         Returns the encoded message. That is a full MSG_SNAPSHOT if the delta would not be at least
+    #                   MIN_DELTA_SAVING bytes smaller, or the snapshots are more than MAX_DELTA_TIME apart
+# ============================================================================
+    mask = 0
+    values = []
+    for i in range(len(DELTA_FIELDS)):
+        value = snapshot[i + 1]
+        if value != baseline[i + 1]:
+            mask |= 1 << i
+            values.append(value)
+    body = DELTA_BODIES[mask]
+    elapsed = (snapshot.serverTime - baseline.serverTime) & 0xFFFFFFFF
+    if SNAPSHOT.size - (DELTA_HEADER.size + body.size) < MIN_DELTA_SAVING or elapsed > MAX_DELTA_TIME:
+        return encodeSnapshot(snapshot)
+    return (DELTA_HEADER.pack(PROTOCOL_VERSION, MSG_DELTA, snapshot.tick, snapshot.tick - baseline.tick, mask,
+                              elapsed)
+            + body.pack(*values))
+
+def deltaBaseline(data: bytes) -> int:
+    # Purpose:      Finds which snapshot a delta message was encoded against
+    # Pre:          data holds a MSG_DELTA message
+    # Post:         Returns the tick of the baseline snapshot
+# ============================================================================
+    _checkType(data, MSG_DELTA, DELTA_HEADER)
+    _, _, tick, distance, _, _ = DELTA_HEADER.unpack_from(data)
+    return tick - distance
+
+def decodeDelta(data: bytes, baseline: Snapshot) -> Snapshot:
+    # Purpose:      Rebuilds a full snapshot from a delta message and its baseline
+    # Pre:          data holds a MSG_DELTA message, baseline is the snapshot with tick deltaBaseline(data)
+    # Post:         Returns the Snapshot
+# ============================================================================
+    _checkType(data, MSG_DELTA, DELTA_HEADER)
+    _, _, tick, distance, mask, elapsed = DELTA_HEADER.unpack_from(data)
+    if baseline.tick != tick - distance:
+        raise ProtocolError(f"Delta for tick {tick} needs baseline {tick - distance}, got {baseline.tick}")
+    body = DELTA_BODIES[mask]
+    if len(data) < DELTA_HEADER.size + body.size:
+        raise ProtocolError(f"Message too short: {len(data)} bytes, expected {DELTA_HEADER.size + body.size}")
+    # Start from the baseline and overwrite what changed
+    fields = list(baseline)
+    fields[0] = tick
+    for position, value in zip(DELTA_POSITIONS[mask], body.unpack_from(data, DELTA_HEADER.size)):
+        fields[position] = value
+    fields[-1] = (baseline.serverTime + elapsed) & 0xFFFFFFFF
+    return Snapshot._make(fields)
+
+class SnapshotHistory:
+    # Purpose:      Remembers the most recent snapshots by tick, so deltas can be encoded and decoded against them
+    # Pre:          size is at most MAX_DELTA_DISTANCE + 1
+    # Post:         get() returns a snapshot added within the last size ticks, otherwise None
+# ============================================================================
+    __slots__ = ("slots",)
+
+    def __init__(self, size: int = 32) -> None:
+        self.slots: list[Snapshot | None] = [None] * size
+
+    def add(self, snapshot: Snapshot) -> None:
+        self.slots[snapshot.tick % len(self.slots)] = snapshot
+
+    def get(self, tick: int) -> Snapshot | None:
+        snapshot = self.slots[tick % len(self.slots)]
+        if snapshot is None or snapshot.tick != tick:
+            return None
+        return snapshot
+
+    def clear(self) -> None:
+        self.slots = [None] * len(self.slots)
+
+def decodeGameState(data: bytes, history: SnapshotHistory) -> Snapshot | None:
+    # Purpose:      Reads either kind of state message, MSG_SNAPSHOT or MSG_DELTA, and records it in history
+    # Pre:          history holds the snapshots decoded so far from this server
+    # Post:         Returns the Snapshot, or None if a delta's baseline is no longer in history.
+    #                   In that case the server sends a keyframe once it sees the stale ack
+# ============================================================================
+    if messageType(data) == MSG_DELTA:
+        baseline = history.get(deltaBaseline(data))
+        if baseline is None:
+            return None
+        snapshot = decodeDelta(data, baseline)
+    else:
+        snapshot = decodeSnapshot(data)
+    history.add(snapshot)
+    return snapshot
@@ -0,0 +1,202 @@
+# Match recordings: a compact append-only file per game, and a reader that replays them.
+# A recording is a header followed by fixed size records, so record n is always at the same offset and the
+# file can be cut short at any record boundary without losing what came before. The records come in blocks:
+# an index record holding the first tick of the block, then up to INDEX_INTERVAL state records, one per tick.
+# The reader mmaps the file and only has to look at the index records to find any tick.
+#
+# Layouts, in network byte order:
+#   HEADER  magic b"PONGREC", format version, screen width, screen height, ticks per second
+#   STATE   kind, tick, ball x, ball y, left paddle y, right paddle y, left score, right score, events
+#   INDEX   kind, first tick of the block, padded to the size of a state record
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from bisect import bisect_right
+
+from assets.code.protocol import Snapshot, encodeEvent, encodeSnapshot
+from assets.code.rules import EVENT_POINT, EVENT_GAME_OVER
+
+MAGIC = b"PONGREC"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("!7sBHHB")
+STATE = struct.Struct("!BIhhhhBBB")
+INDEX = struct.Struct(f"!BI{STATE.size - 5}x")
+RECORD_SIZE = STATE.size
+
+RECORD_STATE = 1
+RECORD_INDEX = 2
+
+INDEX_INTERVAL = 256        # State records per block
+FLUSH_SIZE = 64 * 1024      # Bytes a recorder buffers before handing them to the writer thread
+FLUSH_INTERVAL = 2.0        # Seconds a recorder buffers at most, so a crash loses little of even a short game
+
+class RecordingError(ValueError):
+    # Raised when a file is not a recording, or is too short to hold one
+    pass
+
+class RecordingWriter(threading.Thread):
+    # Purpose:      Background thread that does all recording file I/O, so a slow disk never holds up a game
+    # Pre:          Shared by every GameRecorder in the process. close() is called before the process exits
+    # Post:         Chunks are written in the order they were queued. A None chunk closes the file
+# ============================================================================
+    def __init__(self) -> None:
+        super().__init__(daemon=True)
+        self.chunks: queue.SimpleQueue = queue.SimpleQueue()
+
+    def write(self, file, chunk: bytes | None) -> None:
+        self.chunks.put((file, chunk))
+
+    def close(self) -> None:
+        # Writes everything queued so far, then stops the thread. The thread is a daemon so a stuck disk can't
+        # keep the process alive, which means nothing is written at exit unless this is called
+        self.chunks.put((None, None))
+        self.join()
+
+    def run(self) -> None:
+        while True:
+            file, chunk = self.chunks.get()
+            if file is None:
+                return
+            try:
+                if chunk is None:
+                    file.close()
+                else:
+                    # Straight to the OS, which keeps it if the process dies
+                    file.write(chunk)
+                    file.flush()
+            except OSError:
+                pass    # A full or failing disk loses the recording, not the game
+
+class GameRecorder:
+    # Purpose:      Records one game, one state record per tick
+    # Pre:          add() is called with strictly increasing ticks, and close() once the game ends
+    # Post:         The header is written at once. Records are packed into a memory buffer and handed to writer
+    #                   every FLUSH_SIZE bytes or FLUSH_INTERVAL seconds, whichever comes first
+# ============================================================================
+    def __init__(self, path: str, writer: RecordingWriter, width: int, height: int, tickRate: int) -> None:
+        self.writer = writer
+        self.file = open(path, "wb")
+        self.buffer = bytearray()
+        self.states = 0     # State records so far
+        self.writer.write(self.file, HEADER.pack(MAGIC, FORMAT_VERSION, width, height, tickRate))
+        self.flushDue = time.monotonic() + FLUSH_INTERVAL
+
+    def add(self, tick: int, ballX: int, ballY: int, leftY: int, rightY: int, lScore: int, rScore: int,
+            events: int) -> None:
+        if self.states % INDEX_INTERVAL == 0:
+            self.buffer += INDEX.pack(RECORD_INDEX, tick)
+        self.buffer += STATE.pack(RECORD_STATE, tick, ballX, ballY, leftY, rightY, lScore, rScore, events)
+        self.states += 1
+        if len(self.buffer) >= FLUSH_SIZE or time.monotonic() >= self.flushDue:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffer:
+            self.writer.write(self.file, bytes(self.buffer))
+            self.buffer.clear()
+        self.flushDue = time.monotonic() + FLUSH_INTERVAL
+
+    def close(self) -> None:
+        self.flush()
+        self.writer.write(self.file, None)
+
+class Recording:
+    # Purpose:      Read only view of a recording file
+    # Pre:          path is a recording, possibly still being written or cut short. Raises RecordingError if it
+    #                   isn't one, or is empty or cut short before the end of the header
+    # Post:         len() is the number of complete state records. recording[i] is the i-th as a Snapshot,
+    #                   and find(tick) is the position of the first state at or after a tick
+# ============================================================================
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            # An empty file can't be mapped at all, so the size is checked first
+            if os.fstat(file.fileno()).st_size < HEADER.size:
+                raise RecordingError(f"{path} is an empty or truncated recording")
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.width, self.height, self.tickRate = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.data.close()
+            raise RecordingError(f"{path} is not a version {FORMAT_VERSION} recording")
+
+        records = (len(self.data) - HEADER.size) // RECORD_SIZE
+        blocks = (records + INDEX_INTERVAL) // (INDEX_INTERVAL + 1)
+        self.length = max(0, records - blocks)
+        # First tick of every block, read straight from the index records
+        self.blockTicks = [INDEX.unpack_from(self.data, self.offset(block * (INDEX_INTERVAL + 1)))[1]
+                           for block in range(blocks)]
+
+    @staticmethod
+    def offset(record: int) -> int:
+        return HEADER.size + record * RECORD_SIZE
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, position: int) -> Snapshot:
+        if not 0 <= position < self.length:
+            raise IndexError(position)
+        # Skip the index record at the start of this block and every block before it
+        record = position + position // INDEX_INTERVAL + 1
+        _, tick, ballX, ballY, leftY, rightY, lScore, rScore, events = STATE.unpack_from(self.data,
+                                                                                        self.offset(record))
+        return Snapshot(tick, ballX, ballY, leftY, rightY, lScore, rScore, events, 0)
+
+    def find(self, tick: int) -> int:
+        # Binary search the index, then step through the one block that can hold tick
+        block = max(0, bisect_right(self.blockTicks, tick) - 1)
+        position = block * INDEX_INTERVAL
+        end = min(self.length, position + INDEX_INTERVAL)
+        while position < end and self[position].tick < tick:
+            position += 1
+        return position
+
+    def close(self) -> None:
+        self.data.close()
+
+class ReplayConnection:
+    # Purpose:      Stands in for a server connection and plays a recording back at its original speed, so
+    #                   playGame can render it without changes
+    # Pre:          Used like a TcpConnection by SnapshotReceiver. Only one thread calls recv
+    # Post:         recv returns each recorded tick as a MSG_SNAPSHOT when its time comes, preceded by a
+    #                   MSG_EVENT for points. Inputs sent to it are ignored. Raises EOFError at the end
+# ============================================================================
+    def __init__(self, recording: Recording, startTick: int = 0, speed: float = 1.0) -> None:
+        self.recording = recording
+        self.position = recording.find(startTick)
+        self.speed = speed
+        self.started: float | None = None   # Local time the first replayed tick was returned
+        self.firstTick = 0
+        self.pendingSnapshot: bytes | None = None
+
+    def send(self, *payloads: bytes) -> None:
+        pass
+
+    def recv(self) -> bytes:
+        if self.pendingSnapshot is not None:
+            data, self.pendingSnapshot = self.pendingSnapshot, None
+            return data
+        if self.position >= len(self.recording):
+            raise EOFError("End of the recording")
+        snapshot = self.recording[self.position]
+        self.position += 1
+
+        # Wait until this tick is due
+        now = time.monotonic()
+        if self.started is None:
+            self.started, self.firstTick = now, snapshot.tick
+        due = self.started + (snapshot.tick - self.firstTick) / (self.recording.tickRate * self.speed)
+        if due > now:
+            time.sleep(due - now)
+
+        data = encodeSnapshot(snapshot)
+        if snapshot.events & (EVENT_POINT | EVENT_GAME_OVER):
+            self.pendingSnapshot = data
+            return encodeEvent(snapshot.tick, snapshot.events & (EVENT_POINT | EVENT_GAME_OVER),
+                               snapshot.lScore, snapshot.rScore)
+        return data
+
+    def close(self) -> None:
+        self.recording.close()
@@ -0,0 +1,145 @@
+# Drawing for playGame that only touches the parts of the screen that changed.
+# The center line and walls never move, so they are drawn once onto a background surface. Each frame the
+# ball, paddles and any changed text are erased by copying the background back over where they were, then
+# drawn where they are now, and only those rectangles are sent to the display.
+# The profiler's overlay sits on top of everything in the top left corner and is treated the same as the score.
+import pygame
+
+class Renderer:
+    # Purpose:      Draws the game to screen with dirty rectangles
+    # Pre:          pygame.display.set_mode has been called, screen is the display surface
+    # Post:         draw() leaves the screen showing the given state, updating only what changed since the
+    #                   last call
+# ============================================================================
+    def __init__(self, screen: pygame.Surface, scoreFont: pygame.font.Font, winFont: pygame.font.Font,
+                 color: tuple[int, int, int]) -> None:
+        self.screen = screen
+        self.scoreFont = scoreFont
+        self.winFont = winFont
+        self.color = color
+        screenWidth, screenHeight = screen.get_size()
+
+        # Everything that never moves: the dotted center line and the walls
+        self.background = pygame.Surface((screenWidth, screenHeight)).convert()
+        self.background.fill((0,0,0))
+        self.centerLine = [pygame.Rect((screenWidth/2)-5, y, 5, 5) for y in range(0, screenHeight, 10)]
+        for rect in self.centerLine:
+            pygame.draw.rect(self.background, color, rect)
+        pygame.draw.rect(self.background, color, pygame.Rect(-10, 0, screenWidth+20, 10))
+        pygame.draw.rect(self.background, color, pygame.Rect(-10, screenHeight-10, screenWidth+20, 10))
+
+        self.scores: dict[tuple[int, int], tuple[pygame.Surface, pygame.Rect]] = {}   # Rendered text by score
+        self.shownScore: tuple[int, int] | None = None
+        self.scoreRect = pygame.Rect(0, 0, 0, 0)
+        self.winTexts: dict[int, tuple[pygame.Surface, pygame.Rect]] = {}  # Rendered text by winner
+        self.previous: list[pygame.Rect] = []   # Where the moving things were drawn last frame
+        self.firstFrame = True
+
+        self.overlayFont: pygame.font.Font | None = None
+        self.overlay: pygame.Surface | None = None
+        self.overlayRect = pygame.Rect(0, 0, 0, 0)
+        self.overlayChanged = False
+
+    def renderScore(self, lScore: int, rScore: int) -> tuple[pygame.Surface, pygame.Rect]:
+        # The same text and position as helperCode.updateScore, rendered once per score
+        key = (lScore, rScore)
+        if key not in self.scores:
+            textSurface = self.scoreFont.render(f"{lScore}   {rScore}", False, self.color)
+            textRect = textSurface.get_rect()
+            textRect.center = (int((self.screen.get_width()/2)+5), 50)
+            self.scores[key] = (textSurface, textRect)
+        return self.scores[key]
+
+    def renderWin(self, lScore: int) -> tuple[pygame.Surface, pygame.Rect]:
+        # Rendered once per winner, so a game played after this one shows its own winner
+        winner = 0 if lScore > 4 else 1
+        if winner not in self.winTexts:
+            winText = "Player 1 Wins! " if winner == 0 else "Player 2 Wins! "
+            textSurface = self.winFont.render(winText, False, self.color, (0,0,0))
+            textRect = textSurface.get_rect()
+            textRect.center = (int(self.screen.get_width()/2), int(self.screen.get_height()/2))
+            self.winTexts[winner] = (textSurface, textRect)
+        return self.winTexts[winner]
+
+    def setOverlay(self, lines: list[str] | None) -> None:
+        # Replaces the overlay text from the next draw() on, or removes the overlay if lines is None
+        if lines is None:
+            self.overlay = None
+        else:
+            if self.overlayFont is None:
+                self.overlayFont = pygame.font.Font(None, 20)
+            lineHeight = self.overlayFont.get_linesize()
+            rendered = [self.overlayFont.render(line, True, self.color) for line in lines]
+            self.overlay = pygame.Surface((max(line.get_width() for line in rendered) + 8,
+                                           lineHeight * len(rendered) + 8)).convert()
+            self.overlay.fill((0,0,0))
+            for i, line in enumerate(rendered):
+                self.overlay.blit(line, (4, 4 + i * lineHeight))
+        self.overlayChanged = True
+
+    def draw(self, ball: pygame.Rect, paddles: list[pygame.Rect], lScore: int, rScore: int) -> None:
+        # Purpose:      Draws one frame
+        # Pre:          ball and paddles are where they should be drawn this frame
+        # Post:         The display shows this frame. Only rectangles that changed are redrawn and updated
+# ============================================================================
+        screen = self.screen
+        dirty = []
+
+        # Erase last frame's moving things by putting the background back
+        erased = self.previous
+        for rect in self.previous:
+            screen.blit(self.background, rect, rect)
+            dirty.append(rect)
+
+        # A changed overlay is erased along with them and drawn again at the end
+        if self.overlayChanged:
+            screen.blit(self.background, self.overlayRect, self.overlayRect)
+            dirty.append(self.overlayRect)
+            erased = erased + [self.overlayRect]
+            self.overlayRect = self.overlay.get_rect(topleft=(10, 20)) if self.overlay else pygame.Rect(0, 0, 0, 0)
+
+        if self.firstFrame:
+            screen.blit(self.background, (0, 0))
+
+        # The old score is erased when it changes, the new one is drawn last so it ends up on top like before
+        scoreChanged = (lScore, rScore) != self.shownScore
+        if scoreChanged:
+            screen.blit(self.background, self.scoreRect, self.scoreRect)
+            dirty.append(self.scoreRect)
+            self.scoreRect = self.renderScore(lScore, rScore)[1]
+            self.shownScore = (lScore, rScore)
+
+        # Once the game is over the win message replaces the ball. Its black box goes under the center line
+        current = [rect.copy() for rect in paddles]
+        if lScore > 4 or rScore > 4:
+            textSurface, textRect = self.renderWin(lScore)
+            screen.blit(textSurface, textRect)
+            for i in textRect.collidelistall(self.centerLine):
+                pygame.draw.rect(screen, self.color, self.centerLine[i])
+            current.append(textRect)
+        else:
+            current.append(ball.copy())
+            pygame.draw.rect(screen, self.color, ball)
+        for rect in paddles:
+            pygame.draw.rect(screen, self.color, rect)
+
+        # The score isn't part of the background, so draw it again whenever something was erased or drawn over it
+        if scoreChanged or self.scoreRect.collidelist(erased) != -1 or self.scoreRect.collidelist(current) != -1:
+            screen.blit(self.scores[self.shownScore][0], self.scoreRect)
+            dirty.append(self.scoreRect)
+
+        # The overlay goes over everything, just below the top wall
+        if self.overlay is not None and (self.overlayChanged or self.overlayRect.collidelist(erased) != -1
+                                         or self.overlayRect.collidelist(current) != -1
+                                         or (scoreChanged and self.overlayRect.colliderect(self.scoreRect))):
+            screen.blit(self.overlay, self.overlayRect)
+            dirty.append(self.overlayRect)
+        self.overlayChanged = False
+
+        dirty.extend(current)
+        if self.firstFrame:
+            pygame.display.update()
+            self.firstFrame = False
+        else:
+            pygame.display.update(dirty)
+        self.previous = current
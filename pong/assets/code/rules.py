@@ -0,0 +1,15 @@
+# Numbers that define the game, shared by every implementation of the rules.
+# Kept free of pygame so headless code (see batchEngine.py) can use them without a display.
+FRAME_RATE = 60             # Frames per second of game time. The speeds below are per frame
+PADDLE_WIDTH = 10
+PADDLE_HEIGHT = 50
+PADDLE_SPEED = 5            # Pixels a moving paddle travels per frame, as in helperCode.Paddle
+BALL_SIZE = 5
+BALL_SPEED = 5              # Horizontal speed of the ball after a reset, as in helperCode.Ball.reset
+WALL_HEIGHT = 10            # The top and bottom walls, which the paddles also stop at
+WINNING_SCORE = 5           # The first player to reach this many points wins
+
+# Bits returned by each step, so the client knows which sound to play and when the game ended
+EVENT_BOUNCE = 1            # The ball bounced off a paddle or a wall
+EVENT_POINT = 2             # Someone scored and the ball was reset
+EVENT_GAME_OVER = 4         # That point won the game
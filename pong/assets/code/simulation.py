@@ -0,0 +1,153 @@
+# The rules of a single game of pong, without any drawing or networking.
+# This is the same ball, paddle, scoring and collision logic the client used to run inside playGame, so the
+# server can run it once per game and send the result to both players. Collisions are swept instead of
+# tested for overlap after moving, so the server can step a game less often without the ball skipping
+# through paddles or walls.
+import pygame
+
+from assets.code.helperCode import AXIS_X, TOUCH_EPSILON, Ball, Paddle, sweptAABB
+from assets.code.rules import (PADDLE_WIDTH, PADDLE_HEIGHT, BALL_SIZE, WALL_HEIGHT, WINNING_SCORE, EVENT_BOUNCE,
+                               EVENT_POINT, EVENT_GAME_OVER)
+
+MAX_EVENTS = 64     # Collisions and other events handled in one step before the rest of it is just moved through
+
+# What step() found happens next
+HIT_NOTHING = 0
+CROSSED_EDGE = 1    # The ball went past a paddle and off the screen
+HIT_WALL = 2
+HIT_PADDLE_SIDE = 3 # The face of a paddle that faces the other player
+HIT_PADDLE_EDGE = 4 # The top or bottom of a paddle
+PADDLE_STOPPED = 5  # A paddle reached a wall
+
+class PongSimulation:
+    # Purpose:      Holds and advances the state of one game
+    # Pre:          Paddle directions are set through paddles[side].moving before every step, 0 being left
+    # Post:         step() advances the game by one frame, or by several at once
+# ============================================================================
+    def __init__(self, screenWidth: int, screenHeight: int) -> None:
+        self.screenWidth = screenWidth
+        self.screenHeight = screenHeight
+
+        paddleStartPosY = (screenHeight/2)-(PADDLE_HEIGHT/2)
+        self.paddles = [
+            Paddle(pygame.Rect(10, paddleStartPosY, PADDLE_WIDTH, PADDLE_HEIGHT)),
+            Paddle(pygame.Rect(screenWidth-20, paddleStartPosY, PADDLE_WIDTH, PADDLE_HEIGHT)),
+        ]
+        self.ball = Ball(pygame.Rect(screenWidth/2, screenHeight/2, BALL_SIZE, BALL_SIZE), -5, 0)
+        self.paddleBottom = screenHeight - WALL_HEIGHT - PADDLE_HEIGHT   # Lowest a paddle can go
+        self.lScore = 0
+        self.rScore = 0
+        self.tick = 0       # Number of steps taken
+
+    def saveState(self) -> tuple:
+        # Returns everything step() reads or changes, as a tuple that loadState() can restore
+        ball = self.ball
+        left, right = self.paddles
+        return (ball.x, ball.y, ball.xVel, ball.yVel, left.y, right.y, self.lScore, self.rScore, self.tick)
+
+    def loadState(self, state: tuple) -> None:
+        ball = self.ball
+        left, right = self.paddles
+        ball.x, ball.y, ball.xVel, ball.yVel, leftY, rightY, self.lScore, self.rScore, self.tick = state
+        ball.moveBy(0)
+        left.moveTo(leftY)
+        right.moveTo(rightY)
+
+    def gameOver(self) -> bool:
+        return self.lScore >= WINNING_SCORE or self.rScore >= WINNING_SCORE
+
+    def step(self, frames: float = 1.0) -> int:
+        # Advances the game by a number of frames (see rules.FRAME_RATE) and returns the EVENT_ bits for what
+        # happened. Rather than moving everything and then looking for overlaps, this finds the first thing to
+        # happen in that time, moves everything to that exact moment, handles it and repeats. The ball can't
+        # pass through anything however far it moves, and any number of frames plays out the same game as
+        # stepping one frame at a time with the same inputs
+        events = 0
+        ball = self.ball
+        paddles = self.paddles
+        velocities = [paddle.velocity(WALL_HEIGHT, self.paddleBottom) for paddle in paddles]
+        playing = not self.gameOver()   # Once someone has won the ball stops
+
+        remaining = frames
+        for _ in range(MAX_EVENTS):
+            # Something due right as the step ends belongs to this step, whichever way float error rounded it
+            first, kind, side = remaining + TOUCH_EPSILON, HIT_NOTHING, 0
+            for kind_, side_, time in self.upcoming(playing, velocities):
+                if time < first:
+                    first, kind, side = time, kind_, side_
+            if kind == HIT_NOTHING:
+                first = remaining
+
+            # Move everything to the moment it happens
+            if playing:
+                ball.moveBy(first)
+            for paddle, velocity in zip(paddles, velocities):
+                paddle.moveBy(velocity, first)
+            remaining = max(0.0, remaining - first)
+
+            if kind == HIT_NOTHING:
+                break
+            elif kind == CROSSED_EDGE:
+                # The ball made it past a paddle, so update score, etc.
+                if ball.xVel > 0:
+                    self.lScore += 1
+                    ball.reset(nowGoing="left")
+                else:
+                    self.rScore += 1
+                    ball.reset(nowGoing="right")
+                events |= EVENT_POINT
+                if self.gameOver():
+                    events |= EVENT_GAME_OVER
+                    playing = False
+            elif kind == HIT_WALL:
+                events |= EVENT_BOUNCE
+                ball.hitWall()
+            elif kind == HIT_PADDLE_SIDE:
+                events |= EVENT_BOUNCE
+                ball.hitPaddle(paddles[side].y + PADDLE_HEIGHT//2)
+            elif kind == HIT_PADDLE_EDGE:
+                events |= EVENT_BOUNCE
+                ball.hitPaddleEdge(velocities[side])
+            elif kind == PADDLE_STOPPED:
+                paddles[side].moveTo(self.paddleBottom if velocities[side] > 0 else WALL_HEIGHT)
+                velocities[side] = 0
+        else:
+            # Too much happened in one step. Finish it without looking for anything else
+            if playing:
+                ball.moveBy(remaining)
+            for paddle, velocity in zip(paddles, velocities):
+                paddle.moveBy(velocity, remaining)
+
+        self.tick += 1
+        return events
+
+    def upcoming(self, playing: bool, velocities: list[int]):
+        # Yields (kind, side, frames from now) for everything that will happen if nothing else happens first,
+        # always in the same order so ties are broken the same way every time
+        ball = self.ball
+        if playing:
+            # The ball reaching either edge of the screen
+            if ball.xVel > 0:
+                yield CROSSED_EDGE, 0, max(0.0, (self.screenWidth - ball.x) / ball.xVel)
+            elif ball.xVel < 0:
+                yield CROSSED_EDGE, 0, max(0.0, (0 - ball.x) / ball.xVel)
+
+            # The ball reaching a wall
+            if ball.yVel < 0:
+                yield HIT_WALL, 0, max(0.0, (WALL_HEIGHT - ball.y) / ball.yVel)
+            elif ball.yVel > 0:
+                yield HIT_WALL, 0, max(0.0, (self.screenHeight - WALL_HEIGHT - BALL_SIZE - ball.y) / ball.yVel)
+
+            # The ball reaching a paddle, which may be moving too
+            for side, paddle in enumerate(self.paddles):
+                time, axis = sweptAABB(ball.x, ball.y, BALL_SIZE, BALL_SIZE, ball.xVel, ball.yVel - velocities[side],
+                                       paddle.rect.x, paddle.y, PADDLE_WIDTH, PADDLE_HEIGHT)
+                if axis:
+                    yield HIT_PADDLE_SIDE if axis == AXIS_X else HIT_PADDLE_EDGE, side, time
+
+        # A paddle reaching the wall it is moving toward
+        for side, paddle in enumerate(self.paddles):
+            if velocities[side] > 0:
+                yield PADDLE_STOPPED, side, max(0.0, (self.paddleBottom - paddle.y) / velocities[side])
+            elif velocities[side] < 0:
+                yield PADDLE_STOPPED, side, max(0.0, (WALL_HEIGHT - paddle.y) / velocities[side])
@@ -0,0 +1,155 @@
+# Client side snapshot handling that keeps network I/O off the render loop.
+# SnapshotReceiver reads from the server on a background thread and files every snapshot in a SnapshotBuffer.
+# The render loop then asks the buffer where things were a little while ago, and draws a position interpolated
+# between the two snapshots around that time, so uneven packet arrival doesn't show up as uneven motion.
+# Once pings have measured the server's clock, snapshots are placed by the server time they carry, so a tick the
+# server ran late is drawn late too instead of bending the timeline.
+import threading
+import time
+from collections import deque
+
+from assets.code.clockSync import ClockSync
+from assets.code.frameProfiler import NullProfiler
+from assets.code.protocol import (MSG_EVENT, MSG_PING, MSG_PONG, Snapshot, SnapshotHistory, messageType, decodeEvent,
+                                  decodeGameState)
+from assets.code.rules import EVENT_BOUNCE
+
+BUFFER_SIZE = 64            # Snapshots kept for interpolation
+JITTER_MARGIN = 0.02        # Seconds of extra delay on top of two ticks, to absorb arrival jitter
+OFFSET_SMOOTHING = 0.05     # How quickly the tick to clock mapping drifts up when packets arrive late
+TELEPORT_DISTANCE = 100     # A ball moving further than this between snapshots was reset, so it isn't interpolated
+SERVER_TIME_WRAP = 2 ** 32  # Snapshot server times are milliseconds modulo this
+
+class SnapshotBuffer:
+    # Purpose:      Timestamped store of recent snapshots that can be sampled at any time
+    # Pre:          add() is called for every snapshot in the order received, from any thread
+    # Post:         sample() returns the state interpolated for a render time delayed by interpolationDelay
+# ============================================================================
+    def __init__(self, tickRate: int) -> None:
+        self.tickRate = tickRate
+        self.interpolationDelay = 2 / tickRate + JITTER_MARGIN
+        self.lock = threading.Lock()
+        self.snapshots: deque[tuple[float, Snapshot]] = deque(maxlen=BUFFER_SIZE)
+        self.offset: float | None = None    # Local clock time of server tick 0, estimated from arrival times
+
+    def add(self, snapshot: Snapshot, arrival: float, clock: ClockSync | None = None) -> None:
+        # Files a snapshot under the local time it would arrive at without jitter. With a synced clock that is
+        # when the server stamped it plus half the round trip. Otherwise the time comes from the tick number,
+        # with an offset that follows the fastest arrivals, so a late packet doesn't bend the timeline
+        with self.lock:
+            if self.snapshots and snapshot.tick <= self.snapshots[-1][1].tick:
+                if snapshot.tick == self.snapshots[-1][1].tick:
+                    return
+                # Ticks went backwards, so the server started a new game. Start the timeline over
+                self.snapshots.clear()
+                self.offset = None
+            if clock is not None and clock.synced() and snapshot.serverTime:
+                # How long ago the server's clock read serverTime, taking the wraparound into account
+                serverNow = round((arrival + clock.offset) * 1000)
+                age = (serverNow - snapshot.serverTime) % SERVER_TIME_WRAP
+                if age >= SERVER_TIME_WRAP // 2:    # Stamped "after" now, from error in the offset
+                    age -= SERVER_TIME_WRAP
+                self.snapshots.append((arrival - age / 1000 + clock.rtt / 2, snapshot))
+                return
+            sample = arrival - snapshot.tick / self.tickRate
+            if self.offset is None or sample < self.offset:
+                self.offset = sample
+            else:
+                self.offset += (sample - self.offset) * OFFSET_SMOOTHING
+            self.snapshots.append((snapshot.tick / self.tickRate + self.offset, snapshot))
+
+    def latest(self) -> Snapshot | None:
+        with self.lock:
+            return self.snapshots[-1][1] if self.snapshots else None
+
+    def sample(self, now: float) -> Snapshot | None:
+        # Returns the ball and paddle positions interpolated for now - interpolationDelay. Scores come from the
+        # newest snapshot. Before the first snapshot arrives, returns None
+        with self.lock:
+            if not self.snapshots:
+                return None
+            newest = self.snapshots[-1][1]
+            renderTime = now - self.interpolationDelay
+
+            # Find the two snapshots either side of the render time. If it's past the newest, hold the newest
+            for i in range(len(self.snapshots) - 1, 0, -1):
+                if self.snapshots[i - 1][0] <= renderTime:
+                    older, newer = self.snapshots[i - 1], self.snapshots[i]
+                    break
+            else:
+                older = newer = self.snapshots[0]
+
+        olderTime, a = older
+        newerTime, b = newer
+        if newerTime <= olderTime or renderTime >= newerTime:
+            fraction = 1.0
+        else:
+            fraction = max(0.0, (renderTime - olderTime) / (newerTime - olderTime))
+
+        def lerp(start: int, end: int) -> int:
+            return round(start + (end - start) * fraction)
+
+        if abs(b.ballX - a.ballX) > TELEPORT_DISTANCE or abs(b.ballY - a.ballY) > TELEPORT_DISTANCE:
+            ballX, ballY = (b.ballX, b.ballY) if fraction >= 1.0 else (a.ballX, a.ballY)
+        else:
+            ballX, ballY = lerp(a.ballX, b.ballX), lerp(a.ballY, b.ballY)
+        return newest._replace(ballX=ballX, ballY=ballY, leftY=lerp(a.leftY, b.leftY), rightY=lerp(a.rightY, b.rightY))
+
+class SnapshotReceiver(threading.Thread):
+    # Purpose:      Background thread that receives everything the server sends during a game
+    # Pre:          connection has finished the handshake. Only this thread reads from it
+    # Post:         Snapshots go into buffer, sound events are collected for takeEvents(), and acked always holds
+    #                   the newest snapshot tick, for the render loop to send back with its input. Pings and pongs
+    #                   go to clock, whose answers the render loop sends, and round trip samples to profiler.
+    #                   If the connection fails, error is set and the thread ends
+# ============================================================================
+    def __init__(self, connection, buffer: SnapshotBuffer, profiler=NullProfiler()) -> None:
+        super().__init__(daemon=True)
+        self.connection = connection
+        self.buffer = buffer
+        self.profiler = profiler
+        self.clock = ClockSync()    # Read on time.monotonic()
+        self.history = SnapshotHistory()
+        self.acked = 0              # Snapshot ticks start at 1, so 0 means nothing received yet
+        self.events = 0             # simulation.EVENT_ bits received since the last takeEvents()
+        self.eventLock = threading.Lock()
+        self.error: Exception | None = None
+
+    def takeEvents(self) -> int:
+        with self.eventLock:
+            events, self.events = self.events, 0
+        return events
+
+    def run(self) -> None:
+        try:
+            while True:
+                data = self.connection.recv()
+                arrival = time.monotonic()
+
+                kind = messageType(data)
+                if kind == MSG_PING:
+                    self.clock.answer(data, arrival)
+                    continue
+                if kind == MSG_PONG:
+                    rtt = self.clock.handlePong(data, arrival)
+                    if rtt is not None:
+                        self.profiler.rttSample(rtt)
+                    continue
+
+                # Points come as reliable MSG_EVENT messages, so only bounces are taken from snapshots
+                if kind == MSG_EVENT:
+                    _, events, _, _ = decodeEvent(data)
+                else:
+                    # A delta whose baseline we no longer have is skipped, the server falls back to a
+                    # full snapshot when it sees our ack
+                    snapshot = decodeGameState(data, self.history)
+                    if snapshot is None:
+                        continue
+                    self.acked = snapshot.tick
+                    self.buffer.add(snapshot, arrival, self.clock)
+                    events = snapshot.events & EVENT_BOUNCE
+                if events:
+                    with self.eventLock:
+                        self.events |= events
+        except Exception as e: # Lost the connection, or the server sent something we can't read
+            self.error = e
@@ -0,0 +1,278 @@
+# Client and server transports
+# TCP sends every message as a length prefixed frame (see framing.py). UDP wraps messages in datagrams that carry
+# a sequence number, so stale or reordered state is dropped instead of holding up newer state, plus a small
+# reliable channel that is resent on every datagram until the peer acknowledges it.
+#
+# Datagram layouts, in network byte order:
+#   CONNECT     kind, magic b"PONG", protocol version       Client -> server until ACCEPT arrives
+#   ACCEPT      same layout as CONNECT                      Server -> client
+#   DISCONNECT  same layout as CONNECT                      Either way, when leaving
+#   DATA        kind, sequence, reliable ack, reliable count, then for each reliable message its sequence,
+#               length and payload, then the unreliable messages (the latest state and anything sent with it),
+#               each length prefixed as in framing.py, filling the rest
+# Everything sent at once goes in one datagram, so a reordered datagram can't make the receiver drop the state in
+# an older one as stale. A DATA packet with nothing in it is a keepalive, which the server answers with another
+import random
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+from assets.code.framing import LENGTH, FrameReader, frame, recvFrame
+from assets.code.protocol import PROTOCOL_VERSION, ROLE_PLAYER, ProtocolError, encodeJoin
+
+TRANSPORTS = ("tcp", "udp")
+
+PACKET_CONNECT = 1
+PACKET_ACCEPT = 2
+PACKET_DATA = 3
+PACKET_DISCONNECT = 4
+
+MAGIC = b"PONG"
+CONTROL = struct.Struct("!B4sB")        # kind, magic, protocol version
+DATA_HEADER = struct.Struct("!BIIB")    # kind, sequence, reliable ack, reliable message count
+RELIABLE_HEADER = struct.Struct("!IB")  # reliable sequence, payload length
+
+MAX_DATAGRAM_SIZE = 1200                # Stays under the usual internet MTU
+MAX_RELIABLE_PER_PACKET = 8             # Oldest unacknowledged reliable messages carried by each datagram
+CONNECT_RETRY = 0.2                     # Seconds between CONNECT attempts, and between keepalives while idle
+CONNECT_TIMEOUT = 5.0                   # Seconds to wait for ACCEPT
+SESSION_TIMEOUT = 5.0                   # Seconds without a datagram before a peer is considered gone
+
+def controlPacket(kind: int) -> bytes:
+    return CONTROL.pack(kind, MAGIC, PROTOCOL_VERSION)
+
+def packetKind(datagram: bytes) -> int:
+    # Purpose:      Reads the kind of a received datagram, checking control packets are ours
+    # Pre:          n/a
+    # Post:         Returns one of the PACKET_ constants, or raises ProtocolError
+# ============================================================================
+    if not datagram:
+        raise ProtocolError("Empty datagram")
+    kind = datagram[0]
+    if kind in (PACKET_CONNECT, PACKET_ACCEPT, PACKET_DISCONNECT):
+        if len(datagram) < CONTROL.size:
+            raise ProtocolError("Control packet too short")
+        _, magic, version = CONTROL.unpack_from(datagram)
+        if magic != MAGIC or version != PROTOCOL_VERSION:
+            raise ProtocolError(f"Control packet with magic {magic!r} and version {version}")
+    elif kind != PACKET_DATA:
+        raise ProtocolError(f"Unknown packet kind {kind}")
+    return kind
+
+class UdpChannel:
+    # Purpose:      Sequencing and reliable delivery for one UDP peer. Used by both the client and the server
+    # Pre:          Every DATA datagram sent to the peer is built by packData, and every one received is
+    #                   passed to unpackData
+    # Post:         unpackData returns reliable messages once each and in order, and only returns state that is
+    #                   newer than any state already returned. Unreliable messages packed together are returned
+    #                   together
+# ============================================================================
+    __slots__ = ("sendSequence", "receivedSequence", "nextReliable", "pendingReliable", "deliveredReliable",
+                 "lossRate")
+
+    def __init__(self, lossRate: float = 0.0) -> None:
+        self.sendSequence = 0           # Sequence number of the last datagram sent
+        self.receivedSequence = 0       # Highest sequence number received
+        self.nextReliable = 1           # Sequence number for the next reliable message
+        self.pendingReliable: deque[tuple[int, bytes]] = deque()    # Sent but not yet acknowledged
+        self.deliveredReliable = 0      # Highest reliable sequence delivered, in order, to this side
+        self.lossRate = lossRate        # Fraction of datagrams to drop on purpose, for testing over loopback
+
+    def queueReliable(self, payload: bytes) -> None:
+        # Queues a message that is resent on every datagram until the peer acknowledges it
+        if len(payload) > 255:
+            raise ProtocolError(f"Reliable message of {len(payload)} bytes is too large")
+        self.pendingReliable.append((self.nextReliable, payload))
+        self.nextReliable += 1
+
+    def lost(self) -> bool:
+        # True when a simulated loss should drop the datagram being sent or received
+        return self.lossRate > 0 and random.random() < self.lossRate
+
+    def packData(self, *messages: bytes) -> bytes:
+        # Builds the next DATA datagram, carrying the pending reliable messages and messages as the latest state.
+        # Without messages it is a keepalive
+        self.sendSequence += 1
+        reliable = [self.pendingReliable[i] for i in range(min(len(self.pendingReliable), MAX_RELIABLE_PER_PACKET))]
+        parts = [DATA_HEADER.pack(PACKET_DATA, self.sendSequence, self.deliveredReliable, len(reliable))]
+        for sequence, message in reliable:
+            parts.append(RELIABLE_HEADER.pack(sequence, len(message)))
+            parts.append(message)
+        parts.extend(frame(message) for message in messages)
+        datagram = b"".join(parts)
+        if len(datagram) > MAX_DATAGRAM_SIZE:
+            raise ProtocolError(f"Datagram of {len(datagram)} bytes is too large")
+        return datagram
+
+    def unpackData(self, datagram: bytes) -> tuple[list[bytes], list[bytes]]:
+        # Reads a DATA datagram. Returns the reliable messages that are new, in order, and the unreliable
+        # messages, which are left out if the datagram is older than one already received
+        if len(datagram) < DATA_HEADER.size:
+            raise ProtocolError("Data packet too short")
+        kind, sequence, reliableAck, count = DATA_HEADER.unpack_from(datagram)
+        if kind != PACKET_DATA:
+            raise ProtocolError(f"Expected a data packet, got kind {kind}")
+
+        # The peer has everything up to reliableAck, so stop resending it
+        while self.pendingReliable and self.pendingReliable[0][0] <= reliableAck:
+            self.pendingReliable.popleft()
+
+        # Reliable messages are delivered even from a reordered datagram, as long as they are next in line
+        delivered = []
+        offset = DATA_HEADER.size
+        for _ in range(count):
+            if offset + RELIABLE_HEADER.size > len(datagram):
+                raise ProtocolError("Truncated reliable message")
+            reliableSequence, length = RELIABLE_HEADER.unpack_from(datagram, offset)
+            offset += RELIABLE_HEADER.size
+            if offset + length > len(datagram):
+                raise ProtocolError("Truncated reliable message")
+            if reliableSequence == self.deliveredReliable + 1:
+                delivered.append(bytes(datagram[offset:offset + length]))
+                self.deliveredReliable = reliableSequence
+            offset += length
+
+        # State is only worth anything if it is newer than what we already have
+        if sequence <= self.receivedSequence:
+            return delivered, []
+        self.receivedSequence = sequence
+        messages = []
+        while offset < len(datagram):
+            if offset + LENGTH.size > len(datagram):
+                raise ProtocolError("Truncated message")
+            (length,) = LENGTH.unpack_from(datagram, offset)
+            offset += LENGTH.size
+            if offset + length > len(datagram):
+                raise ProtocolError("Truncated message")
+            messages.append(bytes(datagram[offset:offset + length]))
+            offset += length
+        return delivered, messages
+
+class TcpConnection:
+    # Purpose:      Client side of a TCP connection to the server
+    # Pre:          sock is connected
+    # Post:         recv returns one message at a time, send sends any number in one write. Reliable messages
+    #                   need no special handling
+# ============================================================================
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+        self.reader = FrameReader()
+
+    def send(self, *payloads: bytes) -> None:
+        self.sock.sendall(b"".join(frame(payload) for payload in payloads))
+
+    def recv(self) -> bytes:
+        # Blocks until the next message arrives
+        return bytes(recvFrame(self.sock, self.reader))
+
+    def poll(self):
+        # Yields the messages already received, without blocking
+        for payload in self.reader.frames():
+            yield bytes(payload)
+
+    def close(self) -> None:
+        self.sock.close()
+
+class UdpConnection:
+    # Purpose:      Client side of a UDP session with the server
+    # Pre:          The server is running with UDP enabled
+    # Post:         send sends the latest state unreliably, in one datagram however many messages it is given.
+    #                   recv returns reliable messages in order and state that is newer than any state returned
+    #                   before. The connect handshake runs in __init__. send may be called from a different thread
+    #                   than recv
+# ============================================================================
+    def __init__(self, ip: str, port: int, lossRate: float = 0.0) -> None:
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect((ip, port))
+        self.channel = UdpChannel(lossRate)
+        self.sendLock = threading.Lock()    # recv sends keepalives, so sends can come from two threads
+        self.received: deque[bytes] = deque()
+        self.handshake()
+
+    def handshake(self) -> None:
+        # Sends CONNECT until the server answers with ACCEPT
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        self.sock.settimeout(CONNECT_RETRY)
+        while time.monotonic() < deadline:
+            self.sock.send(controlPacket(PACKET_CONNECT))
+            try:
+                datagram = self.sock.recv(MAX_DATAGRAM_SIZE)
+            except socket.timeout:
+                continue
+            if packetKind(datagram) == PACKET_ACCEPT:
+                return
+        raise ConnectionError("The server did not accept the UDP session")
+
+    def sendDatagram(self, *payloads: bytes) -> None:
+        with self.sendLock:
+            datagram = self.channel.packData(*payloads)
+            if not self.channel.lost():
+                self.sock.send(datagram)
+
+    def send(self, *payloads: bytes) -> None:
+        self.sendDatagram(*payloads)
+
+    def handleDatagram(self, datagram: bytes) -> None:
+        if self.channel.lost():
+            return
+        kind = packetKind(datagram)
+        if kind == PACKET_DISCONNECT:
+            raise ConnectionError("The server ended the session")
+        if kind != PACKET_DATA:
+            return
+        reliable, messages = self.channel.unpackData(datagram)
+        self.received.extend(reliable)
+        self.received.extend(messages)
+
+    def recv(self) -> bytes:
+        # Blocks until the next message arrives. While nothing arrives, keepalives carry our acks to the server,
+        # and its answers show it is still there
+        deadline = time.monotonic() + SESSION_TIMEOUT
+        self.sock.settimeout(CONNECT_RETRY)
+        while not self.received:
+            try:
+                self.handleDatagram(self.sock.recv(MAX_DATAGRAM_SIZE))
+                deadline = time.monotonic() + SESSION_TIMEOUT
+            except socket.timeout:
+                if time.monotonic() > deadline:
+                    raise ConnectionError("The server stopped responding")
+                self.sendDatagram()
+        return self.received.popleft()
+
+    def poll(self):
+        # Yields the messages already received, without blocking
+        self.sock.settimeout(0)
+        try:
+            while True:
+                self.handleDatagram(self.sock.recv(MAX_DATAGRAM_SIZE))
+        except (BlockingIOError, socket.timeout):
+            pass
+        while self.received:
+            yield self.received.popleft()
+
+    def close(self) -> None:
+        try:
+            self.sock.send(controlPacket(PACKET_DISCONNECT))
+        except OSError:
+            pass
+        self.sock.close()
+
+def connect(ip: str, port: int, transport: str = "tcp", lossRate: float = 0.0, role: int = ROLE_PLAYER,
+            gameId: int = 0) -> TcpConnection | UdpConnection:
+    # Purpose:      Opens a connection to the server with the chosen transport, to play or to watch game gameId
+    # Pre:          transport is one of TRANSPORTS. role is one of the ROLE_ constants. Only TCP can spectate
+    # Post:         Returns the connection, ready for the server's MSG_HELLO
+# ============================================================================
+    if transport == "udp":
+        # A UDP CONNECT always means a new player
+        if role != ROLE_PLAYER:
+            raise ValueError("Spectating needs the TCP transport")
+        return UdpConnection(ip, port, lossRate)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect((ip, port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    connection = TcpConnection(sock)
+    connection.send(encodeJoin(role, gameId))
+    return connection
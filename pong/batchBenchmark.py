@@ -0,0 +1,98 @@
+# =================================================================================================
+# Date:                     Oct 17 2026
+# Purpose:                  Checks the NumPy batch engine in assets/code/batchEngine.py against PongSimulation
+#                           with random inputs, then times both. Run from the pong directory:
+#                               python batchBenchmark.py [--games N] [--steps N] [--seed N]
+# Misc:                     Exits with status 1 if any game's state differs between the two engines
+# =================================================================================================
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from assets.code.batchEngine import BatchEngine
+from assets.code.protocol import WIRE_TO_MOVING
+from assets.code.simulation import PongSimulation
+
+WIDTH, HEIGHT = 700, 700
+
+def random_inputs(rng: np.random.Generator, games: int, steps: int) -> np.ndarray:
+    # Purpose:       Makes paddle inputs that hold a direction for a while, like a player would
+    # Pre:           n/a
+    # Post:          Returns a (steps, games, 2) array of -1, 0 and 1
+# ============================================================================
+    changes = rng.random((steps, games, 2)) < 0.05
+    choices = rng.integers(-1, 2, size=(steps, games, 2), dtype=np.int8)
+    inputs = np.zeros((steps, games, 2), dtype=np.int8)
+    current = np.zeros((games, 2), dtype=np.int8)
+    for step in range(steps):
+        current = np.where(changes[step], choices[step], current)
+        inputs[step] = current
+    return inputs
+
+def verify(inputs: np.ndarray, games: int) -> int:
+    # Purpose:       Runs the same inputs through both engines and compares every game after every step
+    # Pre:           inputs comes from random_inputs
+    # Post:          Returns the number of games whose state or events ever differed
+# ============================================================================
+    batch = BatchEngine(games, WIDTH, HEIGHT)
+    simulations = [PongSimulation(WIDTH, HEIGHT) for _ in range(games)]
+    mismatched = set()
+    for step_inputs in inputs:
+        batch.moving[:] = step_inputs
+        batch_events = batch.step()
+        for game, simulation in enumerate(simulations):
+            for side in (0, 1):
+                simulation.paddles[side].moving = WIRE_TO_MOVING[int(step_inputs[game, side])]
+            events = simulation.step()
+            if game not in mismatched and (events != batch_events[game]
+                                           or simulation.saveState() != batch.saveState(game)):
+                print(f"Game {game} differs at tick {simulation.tick}: "
+                      f"{simulation.saveState()} != {batch.saveState(game)}")
+                mismatched.add(game)
+    return len(mismatched)
+
+def time_engines(inputs: np.ndarray, games: int) -> tuple[float, float]:
+    # Purpose:       Times both engines on the same inputs
+    # Pre:           inputs comes from random_inputs
+    # Post:          Returns (PongSimulation, BatchEngine) game steps per second
+# ============================================================================
+    steps = len(inputs)
+    moving = [[[WIRE_TO_MOVING[int(value)] for value in game] for game in step] for step in inputs]
+
+    simulations = [PongSimulation(WIDTH, HEIGHT) for _ in range(games)]
+    start = time.perf_counter()
+    for step_moving in moving:
+        for simulation, (left, right) in zip(simulations, step_moving):
+            simulation.paddles[0].moving = left
+            simulation.paddles[1].moving = right
+            simulation.step()
+    object_rate = games * steps / (time.perf_counter() - start)
+
+    batch = BatchEngine(games, WIDTH, HEIGHT)
+    start = time.perf_counter()
+    for step_inputs in inputs:
+        batch.moving[:] = step_inputs
+        batch.step()
+    batch_rate = games * steps / (time.perf_counter() - start)
+    return object_rate, batch_rate
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check and benchmark the batch engine against PongSimulation")
+    parser.add_argument("--games", type=int, default=1000, help="Games simulated side by side")
+    parser.add_argument("--steps", type=int, default=3000, help="Steps per game")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the random inputs")
+    args = parser.parse_args()
+
+    inputs = random_inputs(np.random.default_rng(args.seed), args.games, args.steps)
+
+    mismatched = verify(inputs, args.games)
+    print(f"{args.games - mismatched}/{args.games} games matched PongSimulation for {args.steps} steps")
+
+    object_rate, batch_rate = time_engines(inputs, args.games)
+    print(f"{'engine':<16}{'game steps/s':>16}")
+    print(f"{'PongSimulation':<16}{object_rate:>16,.0f}")
+    print(f"{'BatchEngine':<16}{batch_rate:>16,.0f}")
+    sys.exit(1 if mismatched else 0)
@@ -0,0 +1,285 @@
+# =================================================================================================
+# Date:                     Oct 17 2026
+# Purpose:                  Microbenchmarks for the hot paths: ball physics, a simulation step, message encoding,
+#                           the game registry with many games, the server's bot, and a message relayed through the
+#                           server over loopback. Results are saved as JSON so runs can be compared. Run from the
+#                           pong directory:
+#                               python benchmarks.py run [--output FILE] [--only NAME ...]
+#                               python benchmarks.py compare BASELINE.json NEW.json [--threshold 0.1]
+# Misc:                     compare exits with status 1 if anything got slower by more than the threshold
+# =================================================================================================
+
+import argparse
+import asyncio
+import itertools
+import json
+import pickle
+import platform
+import socket
+import sys
+import threading
+import time
+import timeit
+
+import pygame
+
+import pongServer
+from assets.code.batchEngine import BatchEngine
+from assets.code.helperCode import Ball, Paddle
+from assets.code.pongBot import PongBot, predictIntercept
+from assets.code.protocol import (NETCODE_LOCKSTEP, Snapshot, encodeInput, decodeInput, encodeSnapshot,
+                                  decodeSnapshot, encodeDelta, decodeDelta, encodeLockstepInput)
+from assets.code.simulation import PongSimulation
+from assets.code.transport import connect
+from codecBenchmark import Player
+
+WIDTH, HEIGHT = 700, 700
+REGISTRY_SIZES = (1000, 100000)     # Games in the registry for the find and join benchmarks
+BATCH_GAMES = 1000
+REPEAT = 5                          # Timing runs per benchmark. The fastest is kept
+
+def ball_benchmarks() -> dict:
+    # Purpose:       The Ball methods the simulation calls every step
+    # Pre:           n/a
+    # Post:          Returns benchmark name -> function doing one operation
+# ============================================================================
+    ball = Ball(pygame.Rect(WIDTH/2, HEIGHT/2, 5, 5), -5, 3)
+    return {
+        "ball_update_pos": ball.updatePos,
+        "ball_hit_paddle": lambda: ball.hitPaddle(350),
+        "ball_hit_wall": ball.hitWall,
+    }
+
+def simulation_benchmarks() -> dict:
+    # Purpose:       One step of the paddle, collision and scoring logic, alone and in the batch engine
+    # Pre:           n/a
+    # Post:          Returns benchmark name -> function doing one operation. The batch step moves all BATCH_GAMES
+    #                   games at once
+# ============================================================================
+    simulation = PongSimulation(WIDTH, HEIGHT)
+    simulation.paddles[0].moving = "down"
+    simulation.paddles[1].moving = "up"
+    start = simulation.saveState()
+
+    def simulation_step() -> None:
+        simulation.step()
+        # Keep the ball moving instead of timing a finished game
+        if simulation.gameOver():
+            simulation.loadState(start)
+
+    batch = BatchEngine(BATCH_GAMES, WIDTH, HEIGHT)
+    batch.moving[:, 0] = 1
+    batch.moving[:, 1] = -1
+
+    def batch_step() -> None:
+        batch.step()
+        batch.reset(batch.gameOver())
+
+    return {
+        "simulation_step": simulation_step,
+        f"batch_step_{BATCH_GAMES}_games": batch_step,
+    }
+
+def bot_benchmarks() -> dict:
+    # Purpose:       The server's bot choosing its input for a tick, and predicting where the ball meets its paddle
+    # Pre:           n/a
+    # Post:          Returns benchmark name -> function doing one operation. bot_steer is the usual tick, where the
+    #                   ball is on the course already predicted. bot_predict skips the cache, as on a new course
+# ============================================================================
+    simulation = PongSimulation(WIDTH, HEIGHT)
+    simulation.ball.xVel = 5
+    simulation.ball.yVel = 7
+    bot = PongBot(1)
+    predict = predictIntercept.__wrapped__
+    return {
+        "bot_steer": lambda: bot.steer(simulation),
+        "bot_predict": lambda: predict(350.0, 350.0, 5, 7, 675, 10, 685),
+    }
+
+def codec_benchmarks() -> dict:
+    # Purpose:       Encoding and decoding what goes over the wire every frame, next to the old pickled Player
+    # Pre:           n/a
+    # Post:          Returns benchmark name -> function doing one operation
+# ============================================================================
+    player = Player(0)
+    player.paddle = Paddle(pygame.Rect(10, 325, 10, 50))
+    player.paddle.moving = "down"
+    player.points = 3
+    player.sync = 12345
+    pickled = pickle.dumps(player)
+
+    baseline = Snapshot(12345, 350, 350, 325, 325, 3, 2, 0, 12345)
+    snapshot = baseline._replace(tick=12346, ballX=345, leftY=330, lastInput=12346)
+    encoded_input = encodeInput("down", 12345, baseline.tick)
+    encoded_snapshot = encodeSnapshot(snapshot)
+    encoded_delta = encodeDelta(snapshot, baseline)
+
+    return {
+        "pickle_player_dumps": lambda: pickle.dumps(player),
+        "pickle_player_loads": lambda: pickle.loads(pickled),
+        "encode_input": lambda: encodeInput("down", 12345, baseline.tick),
+        "decode_input": lambda: decodeInput(encoded_input),
+        "encode_snapshot": lambda: encodeSnapshot(snapshot),
+        "decode_snapshot": lambda: decodeSnapshot(encoded_snapshot),
+        "encode_delta": lambda: encodeDelta(snapshot, baseline),
+        "decode_delta": lambda: decodeDelta(encoded_delta, baseline),
+    }
+
+def fill_registry(size: int) -> None:
+    # Purpose:       Fills the server's registry with full games, as if size games were being played
+    # Pre:           n/a
+    # Post:          GAMES holds exactly size games and OPEN_GAMES is empty
+# ============================================================================
+    pongServer.GAMES.clear()
+    pongServer.OPEN_GAMES.clear()
+    pongServer.GAME_IDS = itertools.count()     # So the games are numbered 0 to size - 1
+    for _ in range(size * 2):
+        pongServer.join_game()
+
+def registry_benchmarks() -> dict:
+    # Purpose:       Finding a game, and a player joining and leaving, with many games running
+    # Pre:           n/a
+    # Post:          Returns benchmark name -> function doing one operation. Each fills the registry when
+    #                   first called, so only one size is held in memory at a time
+# ============================================================================
+    benchmarks = {}
+    for size in REGISTRY_SIZES:
+        def find(size=size) -> None:
+            pongServer.find_game(size // 2)
+
+        def join_and_leave() -> None:
+            player_id, game_id = pongServer.join_game()
+            pongServer.remove_player(game_id, player_id)
+
+        benchmarks[f"find_game_{size}"] = (lambda size=size: fill_registry(size), find)
+        benchmarks[f"join_leave_{size}"] = (lambda size=size: fill_registry(size), join_and_leave)
+    return benchmarks
+
+def start_relay_server() -> int:
+    # Purpose:       Runs the server in lockstep mode on a background thread, where it passes every message from
+    #                   one player straight to the other
+    # Pre:           n/a
+    # Post:          Returns the loopback port it listens on
+# ============================================================================
+    pongServer.GAMES.clear()
+    pongServer.OPEN_GAMES.clear()
+    pongServer.NETCODE = NETCODE_LOCKSTEP
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    server.setblocking(False)
+    threading.Thread(target=asyncio.run, args=(pongServer.main(server, False, 0.0),), daemon=True).start()
+    return server.getsockname()[1]
+
+def relay_benchmarks() -> dict:
+    # Purpose:       A message sent by one player, relayed to the other and relayed back, over real sockets
+    # Pre:           n/a
+    # Post:          Returns benchmark name -> function doing one round trip
+# ============================================================================
+    state = {}
+    message = encodeLockstepInput(100, 100, ["down"] * 4)
+
+    def setup() -> None:
+        port = start_relay_server()
+        first = connect("127.0.0.1", port)
+        second = connect("127.0.0.1", port)
+        first.recv()    # The handshakes
+        second.recv()
+        state["first"], state["second"] = first, second
+
+    def echo() -> None:
+        state["first"].send(message)
+        state["second"].recv()
+        state["second"].send(message)
+        state["first"].recv()
+
+    return {"relay_round_trip": (setup, echo)}
+
+def time_benchmark(function) -> tuple[float, int]:
+    # Purpose:       Times one benchmark
+    # Pre:           function takes no arguments
+    # Post:          Returns (microseconds per call, calls per timing run). Runs are sized to take about 0.2s,
+    #                   and the fastest of REPEAT runs is kept since the slower ones were interrupted by something
+# ============================================================================
+    timer = timeit.Timer(function)
+    loops, _ = timer.autorange()
+    return min(timer.repeat(REPEAT, loops)) / loops * 1e6, loops
+
+def run(only: list[str] | None) -> dict:
+    # Purpose:       Runs every benchmark, or the ones named in only
+    # Pre:           n/a
+    # Post:          Returns the results, ready to be saved as JSON
+# ============================================================================
+    benchmarks = {}
+    for group in (ball_benchmarks, simulation_benchmarks, bot_benchmarks, codec_benchmarks, registry_benchmarks,
+                  relay_benchmarks):
+        benchmarks.update(group())
+
+    results = {}
+    for name, benchmark in benchmarks.items():
+        if only and name not in only:
+            continue
+        # Benchmarks with costly setup come as (setup, function)
+        if isinstance(benchmark, tuple):
+            setup, benchmark = benchmark
+            setup()
+        us_per_op, loops = time_benchmark(benchmark)
+        results[name] = {"us_per_op": us_per_op, "loops": loops}
+        print(f"{name:<28}{us_per_op:>14.3f} us")
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+def compare(baseline: dict, new: dict, threshold: float) -> int:
+    # Purpose:       Prints the change in every benchmark between two runs
+    # Pre:           Both are results from run
+    # Post:          Returns the number of benchmarks more than threshold (a fraction) slower in new
+# ============================================================================
+    regressions = 0
+    print(f"{'benchmark':<28}{'baseline us':>14}{'new us':>14}{'change':>10}")
+    for name, result in new["results"].items():
+        if name not in baseline["results"]:
+            print(f"{name:<28}{'-':>14}{result['us_per_op']:>14.3f}{'new':>10}")
+            continue
+        before = baseline["results"][name]["us_per_op"]
+        after = result["us_per_op"]
+        change = after / before - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:<28}{before:>14.3f}{after:>14.3f}{change:>+10.1%}{flag}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the game's hot paths")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--output", help="File to save the results to as JSON")
+    run_parser.add_argument("--only", nargs="+", metavar="NAME", help="Only run these benchmarks")
+    compare_parser = commands.add_parser("compare", help="Compare two saved runs")
+    compare_parser.add_argument("baseline", help="Results to compare against")
+    compare_parser.add_argument("new", help="Results to check")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="Slowdown, as a fraction, counted as a regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run(args.only)
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(results, file, indent=2)
+    else:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        with open(args.new) as file:
+            new = json.load(file)
+        regressions = compare(baseline, new, args.threshold)
+        if regressions:
+            print(f"{regressions} benchmark(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
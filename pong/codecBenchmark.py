@@ -0,0 +1,79 @@
+# =================================================================================================
+# Date:                     Oct 17 2026
+# Purpose:                  Compares the binary wire codec in assets/code/protocol.py against the old
+#                           per-frame pickle of a Player holding a Paddle. Run from the pong directory:
+#                               python codecBenchmark.py [--frames N]
+# Misc:
+# =================================================================================================
+
+import argparse
+import pickle
+import timeit
+
+import pygame
+
+from assets.code.helperCode import Paddle
+from assets.code.protocol import (Snapshot, encodeInput, decodeInput, encodeSnapshot, decodeSnapshot,
+                                  encodeDelta, decodeDelta)
+
+class Player:
+    # Purpose:       The Player the client and server used to pickle every frame, kept here as the baseline
+    # Pre:           n/a
+    # Post:          n/a
+# ============================================================================
+    paddle: Paddle
+    id: int
+    points: int
+    sync: int
+    pause: bool = False
+    def __init__(self, id) -> None:
+        self.id = id
+
+def time_per_call(statement, frames: int) -> float:
+    # Purpose:       Times a callable
+    # Pre:           statement takes no arguments
+    # Post:          Returns the best average time per call in microseconds over 5 runs of frames calls
+# ============================================================================
+    return min(timeit.repeat(statement, number=frames, repeat=5)) / frames * 1e6
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the wire codec against pickle")
+    parser.add_argument("--frames", type=int, default=100000, help="Messages encoded/decoded per timing run")
+    args = parser.parse_args()
+
+    # A player mid-game, as the client used to send it
+    player = Player(0)
+    player.paddle = Paddle(pygame.Rect(10, 325, 10, 50))
+    player.paddle.moving = "down"
+    player.points = 3
+    player.sync = 12345
+
+    # The same frame in the binary protocol: the client sends its input, the server sends a snapshot
+    snapshot = Snapshot(player.sync, 350, 350, player.paddle.rect.y, 325, player.points, 2, 0, player.sync)
+    # A tick later the ball and this paddle have moved, the other paddle and the score have not
+    baseline = snapshot
+    snapshot = snapshot._replace(tick=snapshot.tick + 1, ballX=345, leftY=330, lastInput=snapshot.lastInput + 1)
+
+    pickled = pickle.dumps(player)
+    encoded_input = encodeInput(player.paddle.moving, player.sync, baseline.tick)
+    encoded_snapshot = encodeSnapshot(snapshot)
+    encoded_delta = encodeDelta(snapshot, baseline)
+
+    results = [
+        ("pickle", len(pickled),
+            time_per_call(lambda: pickle.dumps(player), args.frames),
+            time_per_call(lambda: pickle.loads(pickled), args.frames)),
+        ("input", len(encoded_input),
+            time_per_call(lambda: encodeInput(player.paddle.moving, player.sync, baseline.tick), args.frames),
+            time_per_call(lambda: decodeInput(encoded_input), args.frames)),
+        ("snapshot", len(encoded_snapshot),
+            time_per_call(lambda: encodeSnapshot(snapshot), args.frames),
+            time_per_call(lambda: decodeSnapshot(encoded_snapshot), args.frames)),
+        ("delta", len(encoded_delta),
+            time_per_call(lambda: encodeDelta(snapshot, baseline), args.frames),
+            time_per_call(lambda: decodeDelta(encoded_delta, baseline), args.frames)),
+    ]
+
+    print(f"{'codec':<10}{'bytes/frame':>12}{'encode us':>12}{'decode us':>12}")
+    for name, size, encode_us, decode_us in results:
+        print(f"{name:<10}{size:>12}{encode_us:>12.3f}{decode_us:>12.3f}")
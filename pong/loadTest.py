@@ -0,0 +1,420 @@
+# =================================================================================================
+# Date:                     Oct 17 2026
+# Purpose:                  Load generator for pongServer.py. Runs headless bot clients that do the same
+#                           handshake and per-frame input/snapshot exchange as joinServer and playGame, then
+#                           reports games per second, round trip latency percentiles, server CPU and bytes
+#                           per second. Run from the pong directory:
+#                               python loadTest.py --bots 1000 --duration 30 --spawn --output results.json
+# Misc:                     Round trip time is measured from sending an input to receiving the first snapshot
+#                           that reports it processed, so it includes the wait for the server's next tick.
+#                           Server CPU is read from /proc, so it needs Linux and either --spawn or --server-pid.
+#                           It includes the server's worker processes. Exits with status 1 if no bot connected.
+#                           --lone-wait checks a player can wait alone for an opponent longer than the UDP session
+#                           timeout without being dropped
+# =================================================================================================
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+from assets.code.framing import FrameReader, frame, recvFrameAsync
+from assets.code.clockSync import ClockSync
+from assets.code.protocol import (MSG_EVENT, MSG_PING, NETCODE_SERVER, ROLE_PLAYER, SnapshotHistory, decodeHello,
+                                  decodeEvent, decodeGameState, encodeInput, encodeJoin, messageType)
+from assets.code.rules import EVENT_GAME_OVER
+from assets.code.transport import (UdpChannel, PACKET_ACCEPT, PACKET_CONNECT, PACKET_DATA, PACKET_DISCONNECT,
+                                   CONNECT_RETRY, CONNECT_TIMEOUT, SESSION_TIMEOUT, controlPacket, packetKind)
+
+FRAME_RATE = 60         # Inputs each bot sends per second, like playGame's clock.tick(60)
+SEND_HISTORY = 256      # Send times kept per bot for matching against the server's last processed input
+
+class BotStats:
+    # Purpose:       Everything the bots in one worker process measured
+    # Pre:           n/a
+    # Post:          Merged across workers by merge_results
+# ============================================================================
+    __slots__ = ("sent_bytes", "received_bytes", "snapshots", "game_overs", "connections", "errors", "lone_errors",
+                 "rtts")
+    def __init__(self) -> None:
+        self.sent_bytes = 0
+        self.received_bytes = 0
+        self.snapshots = 0
+        self.game_overs = 0         # Games seen to the end, counted once by each of the 2 bots in them
+        self.connections = 0
+        self.errors = 0
+        self.lone_errors = 0        # Errors of the bot --lone-wait keeps waiting alone, also counted in errors
+        self.rtts: list[float] = [] # Seconds
+
+class TcpBotLink:
+    # Purpose:       A bot's TCP connection, framed like TcpConnection but on the event loop
+    # Pre:           sock is connected and non-blocking
+    # Post:          Counts the bytes that go each way in stats
+# ============================================================================
+    def __init__(self, sock: socket.socket, stats: BotStats) -> None:
+        self.sock = sock
+        self.stats = stats
+        self.reader = FrameReader()
+
+    @classmethod
+    async def open(cls, ip: str, port: int, stats: BotStats) -> "TcpBotLink":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock, (ip, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        link = cls(sock, stats)
+        await link.send(encodeJoin(ROLE_PLAYER))
+        return link
+
+    async def send(self, *payloads: bytes) -> None:
+        data = b"".join(frame(payload) for payload in payloads)
+        self.stats.sent_bytes += len(data)
+        await asyncio.get_running_loop().sock_sendall(self.sock, data)
+
+    async def recv(self) -> bytes:
+        payload = bytes(await recvFrameAsync(asyncio.get_running_loop(), self.sock, self.reader))
+        self.stats.received_bytes += len(payload) + 2
+        return payload
+
+    def close(self) -> None:
+        self.sock.close()
+
+class UdpBotLink(asyncio.DatagramProtocol):
+    # Purpose:       A bot's UDP session, speaking the same datagrams as UdpConnection but on the event loop
+    # Pre:           Created by open, which runs the CONNECT handshake
+    # Post:          Counts the bytes that go each way in stats
+# ============================================================================
+    def __init__(self, stats: BotStats) -> None:
+        self.stats = stats
+        self.channel = UdpChannel()
+        self.transport: asyncio.DatagramTransport | None = None
+        self.accepted = asyncio.Event()
+        self.received: asyncio.Queue[bytes | None] = asyncio.Queue()
+        self.last_heard = 0.0       # Event loop time of the last datagram from the server
+
+    @classmethod
+    async def open(cls, ip: str, port: int, stats: BotStats) -> "UdpBotLink":
+        loop = asyncio.get_running_loop()
+        _, link = await loop.create_datagram_endpoint(lambda: cls(stats), remote_addr=(ip, port))
+        deadline = loop.time() + CONNECT_TIMEOUT
+        while not link.accepted.is_set():
+            if loop.time() > deadline:
+                link.transport.close()
+                raise ConnectionError("The server did not accept the UDP session")
+            link.transport.sendto(controlPacket(PACKET_CONNECT))
+            try:
+                await asyncio.wait_for(link.accepted.wait(), CONNECT_RETRY)
+            except asyncio.TimeoutError:
+                pass
+        return link
+
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, datagram: bytes, address: tuple) -> None:
+        self.stats.received_bytes += len(datagram)
+        self.last_heard = asyncio.get_running_loop().time()
+        try:
+            kind = packetKind(datagram)
+            if kind == PACKET_ACCEPT:
+                self.accepted.set()
+            elif kind == PACKET_DISCONNECT:
+                self.received.put_nowait(None)
+            elif kind == PACKET_DATA:
+                reliable, messages = self.channel.unpackData(datagram)
+                for message in reliable + messages:
+                    self.received.put_nowait(message)
+        except ValueError: # ProtocolError, counted as a failed game once recv sees it
+            self.received.put_nowait(None)
+
+    async def send(self, *payloads: bytes) -> None:
+        datagram = self.channel.packData(*payloads)
+        self.stats.sent_bytes += len(datagram)
+        self.transport.sendto(datagram)
+
+    async def recv(self) -> bytes:
+        # Like UdpConnection.recv, keepalives go out while nothing arrives, and the session is over once the
+        # server has been silent for SESSION_TIMEOUT
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                message = await asyncio.wait_for(self.received.get(), CONNECT_RETRY)
+                break
+            except asyncio.TimeoutError:
+                if loop.time() - self.last_heard > SESSION_TIMEOUT:
+                    raise ConnectionError("The server stopped responding")
+                await self.send()
+        if message is None:
+            raise ConnectionError("The server ended the session")
+        return message
+
+    def close(self) -> None:
+        self.transport.sendto(controlPacket(PACKET_DISCONNECT))
+        self.transport.close()
+
+async def play_game(link: TcpBotLink | UdpBotLink, stats: BotStats, rng: random.Random, until: float) -> None:
+    # Purpose:       Plays one game like playGame does: an input every frame, snapshots received as they come
+    # Pre:           link is connected and the server hasn't sent the handshake yet
+    # Post:          Returns when the game is over or the run ends. Every processed input adds a round trip time
+# ============================================================================
+    loop = asyncio.get_running_loop()
+    try:
+        # A bot left without an opponent when the run ends stops waiting for one
+        hello = await asyncio.wait_for(link.recv(), max(0.0, until - loop.time()))
+    except asyncio.TimeoutError:
+        return
+    _, _, _, _, netcode, _ = decodeHello(hello)
+    if netcode != NETCODE_SERVER:
+        raise ValueError("The load test needs the server to run with --netcode server")
+
+    history = SnapshotHistory()
+    send_times = [(-1, 0.0)] * SEND_HISTORY     # (input sequence, send time), indexed by sequence % SEND_HISTORY
+    state = {"acked": 0, "processed": 0, "over": False}
+    clock = ClockSync()     # Only answers the server's pings, so its round trip stats cover the bots too
+
+    async def receive() -> None:
+        while True:
+            data = await link.recv()
+            now = loop.time()
+            if messageType(data) == MSG_PING:
+                clock.answer(data, now)
+                continue
+            if messageType(data) == MSG_EVENT:
+                _, events, _, _ = decodeEvent(data)
+            else:
+                snapshot = decodeGameState(data, history)
+                if snapshot is None:
+                    continue
+                stats.snapshots += 1
+                state["acked"] = snapshot.tick
+                events = snapshot.events
+                if snapshot.lastInput > state["processed"]:
+                    state["processed"] = snapshot.lastInput
+                    sequence, sent = send_times[snapshot.lastInput % SEND_HISTORY]
+                    if sequence == snapshot.lastInput:
+                        stats.rtts.append(now - sent)
+            if events & EVENT_GAME_OVER:
+                state["over"] = True
+                return
+
+    receiver = asyncio.create_task(receive())
+    try:
+        # Hold a direction for a while, like a player would
+        moving = ""
+        sequence = 0
+        # Frames start at a random point in the server's tick. Starting right as the handshake arrives would line
+        # every input up just after a tick, which over UDP is sent right before the first one, and every round
+        # trip would include a whole tick of waiting
+        next_frame = loop.time() + rng.random() / FRAME_RATE
+        while not state["over"] and loop.time() < until:
+            if receiver.done():
+                receiver.result()   # Raises whatever ended the receiver
+                break
+            if rng.random() < 0.05:
+                moving = rng.choice(("up", "down", ""))
+            sequence += 1
+            send_times[sequence % SEND_HISTORY] = (sequence, loop.time())
+            # Like playGame, the answer to a ping goes out with the input
+            messages = [encodeInput(moving, sequence, state["acked"])]
+            pong = clock.reply(loop.time())
+            if pong is not None:
+                messages.append(pong)
+            await link.send(*messages)
+
+            next_frame += 1 / FRAME_RATE
+            await asyncio.sleep(max(0.0, next_frame - loop.time()))
+        if state["over"]:
+            stats.game_overs += 1
+    finally:
+        receiver.cancel()
+
+async def bot(ip: str, port: int, transport: str, stats: BotStats, start: float, until: float, seed: int,
+              lone: bool = False) -> None:
+    # Purpose:       One bot. Plays games back to back until the run ends
+    # Pre:           lone is set for the bot --lone-wait starts ahead of the others
+    # Post:          Connection failures are counted in stats, and the bot tries again after a short wait
+# ============================================================================
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    await asyncio.sleep(max(0.0, start - loop.time()))
+    link_type = UdpBotLink if transport == "udp" else TcpBotLink
+    while loop.time() < until:
+        link = None
+        try:
+            link = await link_type.open(ip, port, stats)
+            stats.connections += 1
+            await play_game(link, stats, rng, until)
+        except (OSError, ValueError): # ConnectionError is an OSError, ProtocolError a ValueError
+            stats.errors += 1
+            stats.lone_errors += lone
+            await asyncio.sleep(0.1)
+        finally:
+            if link is not None:
+                link.close()
+
+async def run_bots(ip: str, port: int, transport: str, bots: int, duration: float, ramp: float,
+                   seed: int, delay: float = 0.0, lone: bool = False) -> BotStats:
+    # Purpose:       Runs a worker's bots on one event loop
+    # Pre:           n/a
+    # Post:          Returns once every bot has stopped, shortly after duration seconds. The bots start delay
+    #                   seconds in, except the first one if lone is set, which is left waiting alone until then
+# ============================================================================
+    loop = asyncio.get_running_loop()
+    stats = BotStats()
+    now = loop.time()
+    until = now + duration
+    starts = [now + delay + ramp * i / max(bots, 1) for i in range(bots)]
+    if lone and bots:
+        starts[0] = now
+    await asyncio.gather(*(bot(ip, port, transport, stats, starts[i], until, seed + i, lone and i == 0)
+                           for i in range(bots)))
+    return stats
+
+def run_worker(options: tuple) -> dict:
+    # Purpose:       Entry point of a worker process
+    # Pre:           options holds run_bots' arguments
+    # Post:          Returns the worker's BotStats as a dict, which can be sent back to the parent process
+# ============================================================================
+    stats = asyncio.run(run_bots(*options))
+    return {name: getattr(stats, name) for name in BotStats.__slots__}
+
+def merge_results(results: list[dict]) -> dict:
+    # Purpose:       Adds up the workers' measurements
+    # Pre:           results come from run_worker
+    # Post:          Returns the totals, with every round trip time in one sorted list
+# ============================================================================
+    merged = {name: 0 for name in BotStats.__slots__ if name != "rtts"}
+    rtts = []
+    for result in results:
+        for name in merged:
+            merged[name] += result[name]
+        rtts.extend(result["rtts"])
+    rtts.sort()
+    merged["rtts"] = rtts
+    return merged
+
+def percentile(values: list[float], fraction: float) -> float | None:
+    # Purpose:       Nearest rank percentile
+    # Pre:           values is sorted
+    # Post:          Returns the value below which fraction of values fall, or None if there are none
+# ============================================================================
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def cpu_seconds(pid: int) -> float:
+    # Purpose:       Reads the user plus system CPU time a process and every process under it have used, so a
+    #                   server running with --workers is measured whole
+    # Pre:           Linux, and pid is running
+    # Post:          Returns the time in seconds
+# ============================================================================
+    parents = {}
+    ticks = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # The command name is in parentheses and may contain spaces, so count fields from after it
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except OSError: # It exited while we looked
+            continue
+        parents[int(entry)] = int(fields[1])
+        ticks[int(entry)] = int(fields[11]) + int(fields[12])
+
+    tree = [pid]
+    for process in tree:
+        tree.extend(child for child, parent in parents.items() if parent == process)
+    return sum(ticks.get(process, 0) for process in tree) / os.sysconf("SC_CLK_TCK")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test pongServer.py with headless bot clients")
+    parser.add_argument("--ip", default="127.0.0.1", help="Server IP")
+    parser.add_argument("--port", type=int, default=4567, help="Server port")
+    parser.add_argument("--transport", choices=("tcp", "udp"), default="tcp", help="Transport the bots use")
+    parser.add_argument("--bots", type=int, default=200, help="Bot clients, 2 per game")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes the bots are split across, so the bots themselves aren't the bottleneck")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds to run for")
+    parser.add_argument("--ramp", type=float, default=2.0, help="Seconds over which the bots connect")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the bots' random inputs")
+    parser.add_argument("--spawn", action="store_true", help="Start a server for the run and stop it after")
+    parser.add_argument("--server-pid", type=int, help="Measure the CPU of an already running server")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--lone-wait", type=float, default=0.0, metavar="SECONDS",
+                        help="Start one bot this long before the rest, so it waits alone for an opponent. It counts "
+                             "as a lone wait error if the server drops it. Exits with status 1 if it was")
+    args = parser.parse_args()
+
+    server = None
+    server_pid = args.server_pid
+    if args.spawn:
+        transport = "both" if args.transport == "udp" else "tcp"
+        server = subprocess.Popen([sys.executable, "pongServer.py", "--transport", transport, "--ip", args.ip,
+                                   "--port", str(args.port)],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        server_pid = server.pid
+        time.sleep(1.0)     # Give it time to bind
+        if server.poll() is not None:
+            sys.exit(f"The server exited with status {server.returncode}, the port may be in use")
+
+    try:
+        cpu_start = cpu_seconds(server_pid) if server_pid else None
+        wall_start = time.monotonic()
+
+        workers = max(1, min(args.workers, args.bots))
+        options = [(args.ip, args.port, args.transport, args.bots // workers + (i < args.bots % workers),
+                    args.duration, args.ramp, args.seed + i * args.bots, args.lone_wait, args.lone_wait > 0 and i == 0)
+                   for i in range(workers)]
+        if workers == 1:
+            results = [run_worker(options[0])]
+        else:
+            with multiprocessing.Pool(workers) as pool:
+                results = pool.map(run_worker, options)
+
+        elapsed = time.monotonic() - wall_start
+        cpu = cpu_seconds(server_pid) - cpu_start if server_pid else None
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    merged = merge_results(results)
+    rtts = merged.pop("rtts")
+    report = {
+        "transport": args.transport,
+        "bots": args.bots,
+        "workers": workers,
+        "duration_s": elapsed,
+        "games_finished": merged["game_overs"] / 2,
+        "games_per_s": merged["game_overs"] / 2 / elapsed,
+        "snapshots_per_s": merged["snapshots"] / elapsed,
+        "rtt_samples": len(rtts),
+        "rtt_p50_ms": percentile(rtts, 0.50) * 1000 if rtts else None,
+        "rtt_p99_ms": percentile(rtts, 0.99) * 1000 if rtts else None,
+        "rtt_p999_ms": percentile(rtts, 0.999) * 1000 if rtts else None,
+        "server_cpu_percent": cpu / elapsed * 100 if cpu is not None else None,
+        "sent_bytes_per_s": merged["sent_bytes"] / elapsed,
+        "received_bytes_per_s": merged["received_bytes"] / elapsed,
+        "connections": merged["connections"],
+        "errors": merged["errors"],
+    }
+    if args.lone_wait:
+        report["lone_wait_errors"] = merged["lone_errors"]
+
+    for name, value in report.items():
+        print(f"{name:<22}{value:>14.2f}" if isinstance(value, float) else f"{name:<22}{value!s:>14}")
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    if not merged["connections"]:
+        sys.exit(f"No bot could connect to {args.ip}:{args.port}")
+    if args.lone_wait and merged["lone_errors"]:
+        sys.exit(1)
@@ -6,57 +6,60 @@
 # Misc:                     <Not Required.  Anything else you might want to include>
 # =================================================================================================
 
-from typing import List
-import pygame
-import tkinter as tk
-import sys
-import socket
-import pickle           # A simple serializing library. Used for sending data between server/client simply
+import time
+LAUNCHED = time.perf_counter()  # For reporting how long the client took to draw its first frame
 
-from assets.code.helperCode import *
+from typing import TYPE_CHECKING, List
+import argparse
+import atexit
+import sys
 
-PACKET_SIZE = 4096
-
-class Player:
-    # Author:        Jacob Hanks
-    # Purpose:       Contains all data that needs to be transferred back and forth between clients
-    # Pre:           When someone joins the game, a new Player is created and they are added to that game
-    # Post:          When a player disconnects, they are removed from the game
-# ============================================================================
-    paddle: Paddle      # Holds data about paddles position, velocity, etc.
-    id: int             # Player ID, either 0 or 1 depending on side (0 for left, 1 for right)
-    points: int         # Players score
-    sync: int           # Sync variable. Used to ensure players remain in sync.
-    pause: bool = False # Tells the player if it should pause to allow the other player to catch up
-    def __init__(self, id) -> None:
-        self.id = id
+# pygame and everything that uses it are imported by playGame. By then the asset manager has usually imported
+# them in the background while the start screen was up, so the start screen doesn't wait on them. tkinter is
+# imported by startScreen, so a replay never loads it
+if TYPE_CHECKING:
+    import tkinter as tk
+from assets.code.assetManager import DEFAULT_BUNDLE, AssetManager, assetPath, buildBundle
+from assets.code.frameProfiler import DRAW, EVENTS, OVERLAY_INTERVAL, UPDATE, WAIT, FrameProfiler, NullProfiler
+from assets.code.protocol import (NETCODE_LOCKSTEP, NETCODE_SERVER, ROLE_PLAYER, ROLE_SPECTATOR, SPECTATOR_INDEX,
+                                  encodeInput, decodeHello)
+from assets.code.recording import Recording, RecordingError, ReplayConnection
+from assets.code.rules import EVENT_BOUNCE, EVENT_POINT
+from assets.code.snapshotBuffer import SnapshotBuffer, SnapshotReceiver
+from assets.code.transport import TRANSPORTS, TcpConnection, UdpConnection, connect
+
+# Fonts and sounds, loaded from the bundle if one has been built
+ASSETS = AssetManager(DEFAULT_BUNDLE)
+# File to write the frame trace to when profiling, or None to not profile
+PROFILE: str | None = None
 
 # This is the main game loop.  For the most part, you will not need to modify this.  The sections
 # where you should add to the code are marked.  Feel free to change any part of this project
 # to suit your needs.
-def playGame(screenWidth:int, screenHeight:int, playerPaddle:str, client:socket.socket) -> None:
+def playGame(screenWidth:int, screenHeight:int, playerPaddle:str, connection:TcpConnection|UdpConnection, tickRate:int, netcode:int) -> None:
     print("Entered playGame")
-
-    # Pygame inits
-    pygame.mixer.pre_init(44100, -16, 2, 2048)
+    gameStarted = time.perf_counter()
+
+    import pygame
+    from assets.code.helperCode import Ball, Paddle
+    from assets.code.lockstep import LockstepSession
+    from assets.code.renderer import Renderer
+
+    # Pygame inits. The fonts and sounds were most likely loaded in the background already
+    scoreFont = ASSETS.font("score")
+    winFont = ASSETS.font("win")
+    pointSound = ASSETS.sound("point")
+    bounceSound = ASSETS.sound("bounce")
     pygame.init()
 
     # Constants
     WHITE = (255,255,255)
     clock = pygame.time.Clock()
-    scoreFont = pygame.font.Font("./assets/fonts/pong-score.ttf", 32)
-    winFont = pygame.font.Font("./assets/fonts/visitor.ttf", 48)
-    pointSound = pygame.mixer.Sound("./assets/sounds/point.wav")
-    bounceSound = pygame.mixer.Sound("./assets/sounds/bounce.wav")
 
     # Display objects
     screen = pygame.display.set_mode((screenWidth, screenHeight))
-    winMessage = pygame.Rect(0,0,0,0)
-    topWall = pygame.Rect(-10,0,screenWidth+20, 10)
-    bottomWall = pygame.Rect(-10, screenHeight-10, screenWidth+20, 10)
-    centerLine = []
-    for i in range(0, screenHeight, 10):
-        centerLine.append(pygame.Rect((screenWidth/2)-5,i,5,5))
+    # The center line and walls are drawn once, after that only what moves is redrawn
+    renderer = Renderer(screen, scoreFont, winFont, WHITE)
 
     # Paddle properties and init
     paddleHeight = 50
@@ -67,34 +70,44 @@ def playGame(screenWidth:int, screenHeight:int, playerPaddle:str, client:socket.
 
     ball = Ball(pygame.Rect(screenWidth/2, screenHeight/2, 5, 5), -5, 0)
 
+    # A spectator has no paddle of their own. Their keys move a paddle nobody draws, and nothing is sent
+    spectating = playerPaddle == "spectator"
     if playerPaddle == "left":
-        opponentPaddleObj = rightPaddle
         playerPaddleObj = leftPaddle
+    elif spectating:
+        playerPaddleObj = Paddle(pygame.Rect(0, 0, 0, 0))
     else:
-        opponentPaddleObj = leftPaddle
         playerPaddleObj = rightPaddle
 
     lScore = 0
     rScore = 0
 
+    # Frame number, sent with every input so the server can report which input it last applied
     sync = 0
 
-    print("Finished setting up display")
-    # Receiving initial data from the server
-    player_data: Player = pickle.loads(client.recv(PACKET_SIZE))
-    print("Received data from server")
+    # In profiling mode every phase of the loop is timed, and F3 shows or hides the numbers
+    if PROFILE is None:
+        profiler = NullProfiler()
+    else:
+        profiler = FrameProfiler(PROFILE)
+        atexit.register(profiler.dump)
+    nextOverlay = 0.0
+
+    # Everything from the server is received on a background thread, so a slow or lost packet never holds up
+    # a frame. The render loop draws the game slightly in the past, interpolated between received snapshots.
+    # In lockstep games we run the simulation ourselves instead, and only trade inputs with the opponent
+    if netcode == NETCODE_LOCKSTEP:
+        receiver = LockstepSession(connection, screenWidth, screenHeight, 0 if playerPaddle == "left" else 1)
+    else:
+        snapshots = SnapshotBuffer(tickRate)
+        receiver = SnapshotReceiver(connection, snapshots, profiler)
+        receiver.start()
 
-    # Initializing opponent data
-    opponent_data: Player
+    print("Finished setting up display")
+    firstFrame = True
+    profiler.start()
 
     while True:
-        # If we are told by the server to pause, do not process anything
-        if player_data.pause == True:
-            continue
-
-        # Wiping the screen
-        screen.fill((0,0,0))
-
         # Getting keypress events
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -107,117 +120,89 @@ def playGame(screenWidth:int, screenHeight:int, playerPaddle:str, client:socket.
                 elif event.key == pygame.K_UP:
                     playerPaddleObj.moving = "up"
 
+                elif event.key == pygame.K_F3 and PROFILE is not None:
+                    profiler.overlayVisible = not profiler.overlayVisible
+                    renderer.setOverlay(None)
+                    nextOverlay = 0.0
+
             elif event.type == pygame.KEYUP:
                 playerPaddleObj.moving = ""
+        profiler.mark(EVENTS)
 
         # =========================================================================================
-        # Your code here to send an update to the server on your paddle's information,
-        # where the ball is and the current score.
-        # Feel free to change when the score is updated to suit your needs/requirements
-
-        # Update paddle position
-        player_data.paddle = playerPaddleObj
-
-        # Update score
-        if playerPaddle == "left":
-            player_data.points = lScore
-        else:
-            player_data.points = rScore
-
-        # Update sync variable
-        player_data.sync = sync
-
-        # Send the server the update
-        client.sendall(pickle.dumps(player_data))
-        print("Sent player data to the server")
-
-        # Receive opponent data from the server
-        opponent_data = pickle.loads(client.recv(PACKET_SIZE))
-        print("Received opponent data from the server")
-
-        # Sync paddle with opponent
-        opponentPaddleObj = opponent_data.paddle
-
-        # Sync points with opponent
-        if playerPaddle == "left":
-            rScore = opponent_data.points
+        # The server runs the game. Send it our paddle input, then draw the state it has sent us so far.
+        # In lockstep games, run the next frame of our own copy of the game and draw that
+
+        if isinstance(receiver.error, EOFError): # A replay reached the end of its recording
+            print("Replay finished")
+            pygame.quit()
+            sys.exit()
+        elif receiver.error is not None:
+            print(f"Lost connection to the server: {receiver.error}")
+            pygame.quit()
+            sys.exit()
+
+        if netcode == NETCODE_LOCKSTEP:
+            # Our input takes effect this frame. The opponent's is predicted until it arrives
+            events = receiver.advance(playerPaddleObj.moving)
+            simulation = receiver.simulation
+            leftPaddle.rect.y = simulation.paddles[0].rect.y
+            rightPaddle.rect.y = simulation.paddles[1].rect.y
+            ball.rect.x = simulation.ball.rect.x
+            ball.rect.y = simulation.ball.rect.y
+            lScore = simulation.lScore
+            rScore = simulation.rScore
         else:
-            lScore = opponent_data.points
+            # Send the server the update, along with the newest snapshot we have so it can send deltas against it
+            if not spectating:
+                # Clock sync rides along in the same write or datagram, to keep the round trip and clock offset
+                # estimates fresh. They place snapshots on our timeline
+                messages = [encodeInput(playerPaddleObj.moving, sync, receiver.acked)]
+                now = time.monotonic()
+                pong = receiver.clock.reply(now)
+                if pong is not None:
+                    messages.append(pong)
+                if receiver.clock.pingDue(now):
+                    messages.append(receiver.clock.ping(now))
+                connection.send(*messages)
+
+            snapshot = snapshots.sample(time.monotonic())
+            if snapshot is not None:
+                # Our own paddle is drawn where the newest snapshot has it, everything else is interpolated
+                newest = snapshots.latest()
+                leftPaddle.rect.y = newest.leftY if playerPaddle == "left" else snapshot.leftY
+                rightPaddle.rect.y = newest.rightY if playerPaddle == "right" else snapshot.rightY
+                ball.rect.x = snapshot.ballX
+                ball.rect.y = snapshot.ballY
+                lScore = snapshot.lScore
+                rScore = snapshot.rScore
+            events = receiver.takeEvents()
+
+        if events & EVENT_POINT:
+            pointSound.play()
+        elif events & EVENT_BOUNCE:
+            bounceSound.play()
+        profiler.mark(UPDATE)
 
         # =========================================================================================
 
-        # Update the player paddle and opponent paddle's location on the screen
-        for paddle in [playerPaddleObj, opponentPaddleObj]:
-            if paddle.moving == "down":
-                if paddle.rect.bottomleft[1] < screenHeight-10:
-                    paddle.rect.y += paddle.speed
-            elif paddle.moving == "up":
-                if paddle.rect.topleft[1] > 10:
-                    paddle.rect.y -= paddle.speed
-
-        # If the game is over, display the win message
-        if lScore > 4 or rScore > 4:
-            winText = "Player 1 Wins! " if lScore > 4 else "Player 2 Wins! "
-            textSurface = winFont.render(winText, False, WHITE, (0,0,0))
-            textRect = textSurface.get_rect()
-            textRect.center = (int(screenWidth/2), int(screenHeight/2)) # My linter was whining about screenWidth/2 being a float instead of an int
-            winMessage = screen.blit(textSurface, textRect)
-        else:
-
-            # ==== Ball Logic =====================================================================
-            ball.updatePos()
-
-            # If the ball makes it past the edge of the screen, update score, etc.
-            if ball.rect.x > screenWidth:
-                lScore += 1
-                pointSound.play()
-                ball.reset(nowGoing="left")
-            elif ball.rect.x < 0:
-                rScore += 1
-                pointSound.play()
-                ball.reset(nowGoing="right")
-
-            # If the ball hits a paddle
-            if ball.rect.colliderect(playerPaddleObj.rect):
-                bounceSound.play()
-                ball.hitPaddle(playerPaddleObj.rect.center[1])
-            elif ball.rect.colliderect(opponentPaddleObj.rect):
-                bounceSound.play()
-                ball.hitPaddle(opponentPaddleObj.rect.center[1])
-
-            # If the ball hits a wall
-            if ball.rect.colliderect(topWall) or ball.rect.colliderect(bottomWall):
-                bounceSound.play()
-                ball.hitWall()
-
-            pygame.draw.rect(screen, WHITE, ball)
-            # ==== End Ball Logic =================================================================
-
-        # Drawing the dotted line in the center
-        for i in centerLine:
-            pygame.draw.rect(screen, WHITE, i)
-
-        # Drawing the player's new location
-        for paddle in [playerPaddleObj, opponentPaddleObj]:
-            pygame.draw.rect(screen, WHITE, paddle)
-
-        pygame.draw.rect(screen, WHITE, topWall)
-        pygame.draw.rect(screen, WHITE, bottomWall)
-        scoreRect = updateScore(lScore, rScore, screen, WHITE, scoreFont)
-        pygame.display.update([topWall, bottomWall, ball, leftPaddle, rightPaddle, scoreRect, winMessage])
+        # Only what moved or changed since the last frame is redrawn. The overlay text only changes a few
+        # times a second, so rendering it hardly shows up in the frame times it reports
+        if profiler.overlayVisible and time.monotonic() >= nextOverlay:
+            renderer.setOverlay(profiler.overlayLines())
+            nextOverlay = time.monotonic() + OVERLAY_INTERVAL
+        renderer.draw(ball.rect, [leftPaddle.rect, rightPaddle.rect], lScore, rScore)
+        profiler.mark(DRAW)
+        if firstFrame:
+            now = time.perf_counter()
+            print(f"Time to first frame: {(now - gameStarted) * 1000:.1f} ms after the game started, "
+                  f"{(now - LAUNCHED) * 1000:.1f} ms after launch")
+            firstFrame = False
         clock.tick(60)
+        profiler.mark(WAIT)
+        profiler.endFrame()
 
-        # This number should be synchronized between you and your opponent.  If your number is larger
-        # then you are ahead of them in time, if theirs is larger, they are ahead of you, and you need to
-        # catch up (use their info)
         sync += 1
-        # =========================================================================================
-        # Send your server update here at the end of the game loop to sync your game with your
-        # opponent's game
-
-        # Handled above
-
-        # =========================================================================================
 
 
 
@@ -226,19 +211,27 @@ def playGame(screenWidth:int, screenHeight:int, playerPaddle:str, client:socket.
 # the screen width, height and player paddle (either "left" or "right")
 # If you want to hard code the screen's dimensions into the code, that's fine, but you will need to know
 # which client is which
-def joinServer(ip:str, port:str, errorLabel:tk.Label, app:tk.Tk) -> None:
+def joinServer(ip:str, port:str, transport:str, spectate:str, errorLabel:"tk.Label", app:"tk.Tk") -> None:
     # Purpose:      This method is fired when the join button is clicked
     # Arguments:
     # ip            A string holding the IP address of the server
     # port          A string holding the port the server is using
+    # transport     "tcp" or "udp", chosen on the start screen
+    # spectate      ID of a game to watch, or blank to play
     # errorLabel    A tk label widget, modify it's text to display messages to the user (example below)
     # app           The tk window object, needed to kill the window
 # ============================================================================
 
-    # Create a socket and connect to the server
-    # You don't have to use SOCK_STREAM, use what you think is best
-    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    client.connect((ip, int(port)))
+    # Connect to the server. TCP frames every message, UDP drops stale state instead of waiting on it
+    try:
+        if spectate.strip():
+            connection = connect(ip, int(port), transport, role=ROLE_SPECTATOR, gameId=int(spectate))
+        else:
+            connection = connect(ip, int(port), transport, role=ROLE_PLAYER)
+    except (OSError, ValueError) as e:
+        errorLabel.config(text=f"Could not connect: {e}")
+        errorLabel.update()
+        return
 
     # Get the required information from your server (screen width, height & player paddle, "left or "right)
 
@@ -247,29 +240,46 @@ def joinServer(ip:str, port:str, errorLabel:tk.Label, app:tk.Tk) -> None:
     # You may or may not need to call this, depending on how many times you update the label
     errorLabel.update()
 
-    screenWidth, screenHeight, paddle_side_int = pickle.loads(client.recv(PACKET_SIZE))
+    # The server closes the connection instead of answering a spectator when there is no such game to watch
+    try:
+        screenWidth, screenHeight, paddle_side_int, tickRate, netcode, gameId = decodeHello(connection.recv())
+    except OSError as e:
+        errorLabel.config(text=f"The server refused the connection: {e}")
+        errorLabel.update()
+        connection.close()
+        return
+    except ValueError as e: # ProtocolError or FramingError, from a server running another version or not a server
+        errorLabel.config(text=f"Could not read the server's reply: {e}")
+        errorLabel.update()
+        connection.close()
+        return
     print("Received screen size and paddle side from server")
 
     # Determine paddle side
     if paddle_side_int == 0:
         paddle_side: str = "left"
+    elif paddle_side_int == SPECTATOR_INDEX:
+        paddle_side: str = "spectator"
     else:
         paddle_side: str = "right"
+    # Others can watch this game by entering its ID on their start screen
+    print(f"Game ID: {gameId}")
 
     errorLabel.config(text="Waiting for 2nd player...")
     errorLabel.update()
 
     # Close this window and start the game with the info passed to you from the server
     app.withdraw()     # Hides the window (we'll kill it later)
-    playGame(screenWidth, screenHeight, paddle_side, client)  # User will be either left or right paddle
+    playGame(screenWidth, screenHeight, paddle_side, connection, tickRate, netcode)  # User will be either left or right paddle
     app.quit()         # Kills the window
 
 # This displays the opening screen, you don't need to edit this (but may if you like)
 def startScreen():
+    import tkinter as tk
     app = tk.Tk()
     app.title("Server Info")
 
-    image = tk.PhotoImage(file="./assets/images/logo.png")
+    image = tk.PhotoImage(file=assetPath("images/logo.png"))
 
     titleLabel = tk.Label(image=image)
     titleLabel.grid(column=0, row=0, columnspan=2)
@@ -286,13 +296,67 @@ def startScreen():
     portEntry = tk.Entry(app)
     portEntry.grid(column=1, row=2)
 
+    transportLabel = tk.Label(text="Transport:")
+    transportLabel.grid(column=0, row=3, sticky="W", padx=8)
+
+    transportVar = tk.StringVar(app, value=TRANSPORTS[0])
+    transportMenu = tk.OptionMenu(app, transportVar, *TRANSPORTS)
+    transportMenu.grid(column=1, row=3, sticky="W")
+
+    spectateLabel = tk.Label(text="Spectate game:")
+    spectateLabel.grid(column=0, row=4, sticky="W", padx=8)
+
+    # Left blank to play, or a game ID to watch that game
+    spectateEntry = tk.Entry(app)
+    spectateEntry.grid(column=1, row=4)
+
     errorLabel = tk.Label(text="")
-    errorLabel.grid(column=0, row=4, columnspan=2)
+    errorLabel.grid(column=0, row=6, columnspan=2)
 
-    joinButton = tk.Button(text="Join", command=lambda: joinServer(ipEntry.get(), portEntry.get(), errorLabel, app))
-    joinButton.grid(column=0, row=3, columnspan=2)
+    joinButton = tk.Button(text="Join", command=lambda: joinServer(ipEntry.get(), portEntry.get(), transportVar.get(), spectateEntry.get(), errorLabel, app))
+    joinButton.grid(column=0, row=5, columnspan=2)
 
     app.mainloop()
 
+# Plays back a game recorded by the server with --record, drawn by playGame as if it were live
+def replay(path:str, startTick:int, speed:float) -> None:
+    recording = Recording(path)
+    connection = ReplayConnection(recording, startTick, speed)
+    # The snapshot buffer times ticks by the tick rate, so a faster replay is a higher tick rate
+    playGame(recording.width, recording.height, "spectator", connection, recording.tickRate * speed, NETCODE_SERVER)
+
+def positiveFloat(text:str) -> float:
+    # Argument type for --speed. A replay at speed 0 would never advance
+    value = float(text)
+    if not 0 < value < float("inf"):
+        raise argparse.ArgumentTypeError(f"must be a number more than 0, not {text}")
+    return value
+
 if __name__ == "__main__":
-    startScreen()
+    parser = argparse.ArgumentParser(description="Network pong client")
+    parser.add_argument("--replay", metavar="FILE", help="Play back a recording instead of joining a server")
+    parser.add_argument("--start", type=int, default=0, help="Tick to start the replay from")
+    parser.add_argument("--speed", type=positiveFloat, default=1.0, help="Replay speed, 2 being twice as fast")
+    parser.add_argument("--bundle", default=DEFAULT_BUNDLE, help="Asset bundle to load fonts and sounds from")
+    parser.add_argument("--build-bundle", metavar="FILE", nargs="?", const=DEFAULT_BUNDLE,
+                        help="Build the asset bundle (by default where the client looks for it) and exit")
+    parser.add_argument("--profile", metavar="TRACE_FILE", nargs="?", const="frameTrace.json",
+                        help="Time every frame, show the numbers (F3 toggles them) and write a trace on exit")
+    args = parser.parse_args()
+    PROFILE = args.profile
+
+    if args.build_bundle:
+        buildBundle(args.build_bundle)
+        print(f"Wrote {args.build_bundle}")
+        sys.exit()
+
+    # Start importing pygame and decoding the assets while the start screen waits on the user
+    ASSETS = AssetManager(args.bundle)
+    ASSETS.preload()
+    if args.replay:
+        try:
+            replay(args.replay, args.start, args.speed)
+        except (OSError, RecordingError) as e:
+            sys.exit(f"Could not replay {args.replay}: {e}")
+    else:
+        startScreen()
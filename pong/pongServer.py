@@ -6,240 +6,1314 @@
 # Misc:
 # =================================================================================================
 
+import argparse     # Command line options
+import asyncio      # Event loop library. Every client connection is a coroutine on a single loop
+import itertools    # Used for a monotonically increasing game ID counter
 import logging      # A simple logging library. Allows us to log what has occured to stdout
-import pickle       # A simple serializing library. Used to serialize data sent/received to/from client
+import multiprocessing  # Worker processes for --workers
+import os
+import selectors    # The lobby process waits on every worker's channel at once
+import signal       # The lobby stops its workers with SIGINT
 import socket       # A simple networking library. Allows us to communicate with the client.
-import threading    # A simple threading library. One thread is used for each client
-from assets.code.helperCode import *
+import threading    # Only used for locks. The registry stays safe to use from any thread
+import time         # perf_counter for timing sampled work
+from collections import deque
+from assets.code.clockSync import ClockSync
+from assets.code.pongBot import PongBot
+from assets.code.protocol import (ProtocolError, Snapshot, SnapshotHistory, MAX_DELTA_DISTANCE, MSG_LOCKSTEP,
+                                  MSG_PING, MSG_PONG, NETCODES, NETCODE_SERVER, NETCODE_LOCKSTEP, ROLE_SPECTATOR,
+                                  SPECTATOR_INDEX,
+                                  messageType, encodeHello, decodeJoin, decodeInput, encodeSnapshot, encodeDelta,
+                                  encodeEvent)
+from assets.code.simulation import PongSimulation, EVENT_POINT, EVENT_GAME_OVER
+from assets.code.rules import FRAME_RATE
+from assets.code.framing import FrameReader, FramingError, frame, recvFrameAsync
+from assets.code.metrics import Metrics
+from assets.code.recording import GameRecorder, RecordingWriter
+from assets.code.transport import (UdpChannel, PACKET_CONNECT, PACKET_ACCEPT, PACKET_DATA, PACKET_DISCONNECT,
+                                   SESSION_TIMEOUT, controlPacket, packetKind)
+
+class Outbox:
+    # Purpose:       Messages waiting to go out on one TCP connection, a player's or a spectator's, and the
+    #                   coroutine that writes them
+    # Pre:           conn is a connected, non-blocking socket. start() is called on the event loop
+    # Post:          offer and offer_reliable never wait. Only the newest state is kept, so a connection that can't
+    #                   keep up is sent fewer ticks instead of falling behind. One whose write has been stuck for
+    #                   WRITE_TIMEOUT, or with more than OUTBOX_LIMIT bytes of reliable messages waiting, is dropped:
+    #                   its socket is shut down, so whoever reads from it cleans up
+# ============================================================================
+    __slots__ = ("conn", "latest", "reliable", "reliable_bytes", "ready", "reason", "task")
+    conn: socket.socket         # The connection
+    latest: bytes | None        # Newest framed state not sent yet. Replaced, not queued, when another arrives
+    reliable: list[bytes]       # Framed messages not sent yet that are never skipped, like the handshake and events
+    reliable_bytes: int         # Total size of reliable
+    ready: asyncio.Event        # Set when there is something to send
+    reason: str | None          # Why the connection was dropped, for the disconnect metrics. None while it is open
+    task: asyncio.Task | None   # The running write coroutine
+    def __init__(self, conn: socket.socket) -> None:
+        self.conn = conn
+        self.latest = None
+        self.reliable = []
+        self.reliable_bytes = 0
+        self.ready = asyncio.Event()
+        self.reason = None
+        self.task = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.write())
+
+    def offer(self, data: bytes) -> None:
+        # Queues framed state, replacing any that hasn't been sent yet
+        if self.reason is not None:
+            return
+        if self.latest is not None:
+            METRICS.count("snapshots_skipped")
+        self.latest = data
+        self.ready.set()
+
+    def offer_reliable(self, data: bytes) -> None:
+        # Queues a framed message that is sent no matter what comes after it
+        if self.reason is not None:
+            return
+        self.reliable.append(data)
+        self.reliable_bytes += len(data)
+        if self.reliable_bytes > OUTBOX_LIMIT:
+            self.drop("send_queue_full")
+            return
+        self.ready.set()
+
+    def drop(self, reason: str) -> None:
+        # Stops sending, and shuts the socket down so a coroutine waiting to read from it wakes up
+        if self.reason is not None:
+            return
+        self.reason = reason
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError: # Already disconnected
+            pass
+
+    async def write(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            data = b"".join(self.reliable) + (self.latest or b"")
+            self.reliable.clear()
+            self.reliable_bytes = 0
+            self.latest = None
+            METRICS.count("bytes_out", len(data))
+            try:
+                async with asyncio.timeout(WRITE_TIMEOUT):
+                    await loop.sock_sendall(self.conn, data)
+            except TimeoutError:
+                self.drop("write_timeout")
+                return
+            except OSError:
+                self.drop("error")
+                return
+
+class TcpLink:
+    # Purpose:       Sends messages to a player connected over TCP
+    # Pre:           outbox belongs to the player's connection and has been started
+    # Post:          Every message is framed and handed to the outbox, which never makes the caller wait. Everything
+    #                   passed to one send() is kept or replaced together, reliable messages are always delivered
+# ============================================================================
+    __slots__ = ("outbox",)
+    def __init__(self, outbox: Outbox) -> None:
+        self.outbox = outbox
+
+    async def send(self, *messages: bytes) -> None:
+        METRICS.count("messages_out", len(messages))
+        self.outbox.offer(b"".join(frame(data) for data in messages))
+
+    async def send_reliable(self, data: bytes) -> None:
+        METRICS.count("messages_out")
+        self.outbox.offer_reliable(frame(data))
+
+class UdpLink:
+    # Purpose:       Sends messages to a player connected over UDP
+    # Pre:           transport is the server's datagram transport, address is the player's address
+    # Post:          send never waits. Everything passed to one send() goes in one datagram. State that is lost is
+    #                   simply replaced by the next tick's, reliable messages ride along on every datagram until the
+    #                   client acknowledges them
+# ============================================================================
+    __slots__ = ("transport", "address", "channel")
+    def __init__(self, transport: asyncio.DatagramTransport, address: tuple, channel: UdpChannel) -> None:
+        self.transport = transport
+        self.address = address
+        self.channel = channel
+
+    def send_now(self, *messages: bytes) -> None:
+        # send for callers that aren't coroutines. Without messages it sends a keepalive
+        datagram = self.channel.packData(*messages)
+        METRICS.count("messages_out", len(messages))
+        METRICS.count("bytes_out", len(datagram))
+        if not self.channel.lost():
+            self.transport.sendto(datagram, self.address)
+
+    async def send(self, *messages: bytes) -> None:
+        self.send_now(*messages)
+
+    async def send_reliable(self, data: bytes) -> None:
+        METRICS.count("messages_out")
+        self.channel.queueReliable(data)
+        self.send_now()
 
 class Player:
     # Author:        Jacob Hanks
-    # Purpose:       Contains all data that needs to be transferred back and forth between clients
+    # Purpose:       Contains the connection and latest input of one player in a game
     # Pre:           When someone joins the game, a new Player is created and they are added to that game
     # Post:          When a player disconnects, they are removed from the game
 # ============================================================================
-    paddle: Paddle      # Holds data about paddles position, velocity, etc.
-    id: int             # Player ID, either 0 or 1 depending on side (0 for left, 1 for right)
-    points: int         # Players score
-    sync: int           # Sync variable. Used to ensure players remain in sync.
-    pause: bool = False # Tells the player if it should pause to allow the other player to catch up
+    __slots__ = ("id", "moving", "last_input", "input_time", "acked", "history", "clock", "link", "bot")
+    id: int                     # Player ID, either 0 or 1 depending on side (0 for left, 1 for right)
+    moving: str                 # Latest paddle direction received from the client: "up", "down" or ""
+    last_input: int             # Sequence number of the latest input received from the client
+    input_time: float           # Event loop time that input arrived, or 0 once a snapshot has reflected it
+    acked: int                  # Tick of the newest snapshot the client says it has, the baseline for deltas
+    history: SnapshotHistory    # Snapshots recently sent to this client, so acked ticks can be looked up
+    clock: ClockSync            # Round trip time to the client and the offset of its clock from server_clock
+    link: TcpLink | UdpLink | None  # Sends to the client. Set once the client has been sent its handshake
+    bot: PongBot | None         # Picks moving every tick if this is the server's own player, which has no link
     def __init__(self, id) -> None:
         self.id = id
+        self.moving = ""
+        self.last_input = 0
+        self.input_time = 0.0
+        self.acked = 0
+        self.history = SnapshotHistory()
+        self.clock = ClockSync()
+        self.link = None
+        self.bot = None
 
 class Game:
     # Author:        Jacob Hanks
     # Purpose:       Contains all the data to run a game between 2 players
     # Pre:           When a game is started, a Game is created
-    # Post:          When a game is ended, the Game is removed from the global game list
+    # Post:          When a game is ended, the Game is removed from the global game dict
 # ============================================================================
-    id: int                     # Games ID, starts at 0 and counts up
-    players: list[Player] = []  # A list of players in a game. Should be less than 2
+    __slots__ = ("id", "players", "spectators", "lock", "opponent_joined", "closed", "simulation", "task",
+                 "bot_timer")
+    id: int                         # Games ID, starts at 0 and counts up
+    players: list[Player | None]    # Two slots indexed by player ID (side). None while the side is empty
+    spectators: set[Outbox]         # Everyone watching the game. There is no limit
+    lock: threading.Lock            # Guards players and simulation. Taken after REGISTRY_LOCK when both are needed
+    opponent_joined: asyncio.Event  # Set while the game has 2 players, awaited by a player waiting alone
+    closed: bool                    # Set once the game is removed, so stale OPEN_GAMES entries are skipped
+    simulation: PongSimulation      # The authoritative ball, paddles and score
+    task: asyncio.Task | None       # The running run_game tick loop, if any
+    bot_timer: asyncio.TimerHandle | None   # Calls add_bot once a lone player has waited BOT_DELAY. Guarded by
+                                            #   REGISTRY_LOCK
 
     # Initialization function
     def __init__(self, id) -> None:
         self.id = id
+        self.players = [None, None]
+        self.spectators = set()
+        self.lock = threading.Lock()
+        self.opponent_joined = asyncio.Event()
+        self.closed = False
+        self.simulation = PongSimulation(WIDTH, HEIGHT)
+        self.task = None
+        self.bot_timer = None
 
 # Global variables
 IP: str = "127.0.0.1"       # IP to connect over
 PORT: int = 4567            # Port to bind
 WIDTH, HEIGHT = 700, 700    # Window width and height (default pong values)
+TICK_RATE: int = 60         # Simulation steps per second for every game. Each step covers FRAME_RATE / TICK_RATE frames
+KEYFRAME_INTERVAL: int = 60 # Ticks between full snapshots. Every other tick sends a delta against the client's ack
+NETCODE: int = NETCODE_SERVER   # NETCODE_SERVER runs run_game for every game, NETCODE_LOCKSTEP only relays inputs
+SHUTDOWN_TIMEOUT: float = 5.0  # Seconds the lobby gives its workers to shut down before killing them
+HANDOFF_DELAY: float = 0.5  # Seconds a TCP player waits for a local opponent before the lobby looks on other workers
+LOBBY: socket.socket | None = None  # This worker's channel to the lobby process when running with --workers
+RECORD_DIR: str | None = None       # Directory every game is recorded to, if --record was given
+RECORDINGS: RecordingWriter | None = None   # Writes the recordings on a background thread
+JOIN_TIMEOUT: float = 5.0   # Seconds a new TCP connection has to say whether it plays or watches
+SEND_BUFFER: int = 4096     # Kernel send buffer of TCP connections, so stale state can't pile up where Outbox
+                            #   can't skip it
+WRITE_TIMEOUT: float = 5.0  # Seconds one write to a TCP connection may be stuck before the connection is dropped
+READ_TIMEOUT: float = 5.0   # Seconds a TCP player may send nothing before being dropped. Clients send every frame
+OUTBOX_LIMIT: int = 65536   # Bytes of reliable messages that may wait on one TCP connection before it is dropped
+KEEPALIVE_IDLE: int = 10    # TCP keepalive: seconds of silence before probing, seconds between probes, and failed
+KEEPALIVE_INTERVAL: int = 5 #   probes before the kernel marks the peer gone. A peer that vanished without closing
+KEEPALIVE_COUNT: int = 3    #   then fails its socket's next read or write, or makes it readable while it is watched
+BOT_DELAY: float | None = None  # Seconds a player waits alone before a bot takes the other side, or None for no bots
+STARTED: float = time.monotonic()       # server_clock reads 0 here
+
+# Game registry. Every game is indexed by ID, and games with exactly one player wait in a FIFO queue,
+# so finding, joining and leaving a game cost the same no matter how many games are running.
+GAMES: dict[int, Game] = {}             # All active games, by game ID
+OPEN_GAMES: deque[Game] = deque()       # Half full games, oldest first. May hold closed games and games a bot
+                                        #   filled, which are skipped
+REGISTRY_LOCK = threading.Lock()        # Guards GAMES, OPEN_GAMES and GAME_IDS
+GAME_IDS = itertools.count()            # Next unused game ID
 
-PACKET_SIZE = 4096          # Packet size for communications between client and conn
-GAMES: list[Game] = []      # A list of all games active
+# Server metrics, served as plain text on --stats-port and logged every --stats-interval seconds.
+# Counters and histograms are preallocated here, the gauges are registered in main
+METRICS = Metrics(
+    counters=("connections", "games_started", "ticks", "ticks_late", "messages_in", "messages_out",
+              "bytes_in", "bytes_out", "snapshots_skipped", "bots_added"),
+    histograms=("matchmaking_wait_seconds", "input_to_snapshot_seconds", "tick_seconds", "encode_seconds",
+                "decode_seconds", "rtt_seconds"))
+
+def server_clock() -> float:
+    # Purpose:       The clock pings are answered with and snapshots are stamped with
+    # Pre:           n/a
+    # Post:          Returns seconds since the server started
+# ============================================================================
+    return time.monotonic() - STARTED
 
 def find_game(game_id: int) -> Game:
     # Author:        Jacob Hanks
-    # Purpose:       Finds a game from the global game list given an input game id
-    # Pre:           Expects that there are valid games in the global games list, and that the game id pass in is among them
+    # Purpose:       Finds a game from the global game dict given an input game id
+    # Pre:           Expects that the game id passed in is among the active games
     # Post:          Returns the Game from GAMES with ID the same as the passed in game_id
-    # Iterate through list of games and find the game with game id matching game_id
 # ============================================================================
-    for game in GAMES:
-        if game_id == game.id:
-            return game
+    game = GAMES.get(game_id)
     # If we end up here, something went wrong.
-    else:
+    if game is None:
         logging.error("Game with ID %d not found.", game_id)
         return Game(-1)
+    return game
 
 def join_game() -> tuple[int, int]:
     # Author:        Jacob Hanks
     # Purpose:       Finds an available game to join when a player connects. If no open games exist, it creates one.
     # Pre:           Called when a player connects.
-    # Post:          Returns a tuple of the player ID and the game ID that were found for the player to join
+    # Post:          Returns a tuple of the player ID and the game ID that were found for the player to join.
+    #                   With BOT_DELAY set, a new game gets a bot if nobody else joins in time
 # ============================================================================
-    if len(GAMES) == 0: # If no GAMES exist, make game 0
-        # Initialize game
-        game_id: int = 0
-        game = Game(game_id)
+    with REGISTRY_LOCK:
+        # Pair with the player that has been waiting the longest
+        while OPEN_GAMES:
+            game = OPEN_GAMES.popleft()
+            if game.closed or None not in game.players: # Everyone left, or a bot joined, after it was queued
+                continue
+            if game.bot_timer is not None:
+                game.bot_timer.cancel()
+                game.bot_timer = None
+            with game.lock:
+                # Take whichever side is free
+                player_id = 0 if game.players[0] is None else 1
+                game.players[player_id] = Player(player_id)
 
-        # Initialize player
-        player_id: int = 0
-        player = Player(player_id)
+                # Wake up the player that has been waiting on an opponent
+                game.opponent_joined.set()
+            return player_id, game.id
 
-        # Put player in the game and append the game to the list of active GAMES
-        game.players.append(player)
-        GAMES.append(game)
+        # No games with 1 player, so make a new game and wait for an opponent
+        game = Game(next(GAME_IDS))
+        player_id = 0
+        game.players[player_id] = Player(player_id)
+        GAMES[game.id] = game
+        OPEN_GAMES.append(game)
+        schedule_bot(game)
         return player_id, game.id
-    else: # At least one game exists
-        for game in GAMES:
-            if len(game.players) < 2: # If 1 or 0 players in a game
-                if game.players[0].id == 0:
-                    player_id = 1
-                elif game.players[0].id == 1:
-                    player_id = 0
-                else:   # Shouldn't happen
-                    player_id = -1
-                player = Player(player_id)
-                game.players.append(player)
-                return player_id, game.id
-        else: # No games with 1 or 0 players, so make a new game
-            # Make a new game, with an ID that hasn't been taken
-            game = Game(GAMES[-1].id + 1)
-
-            # Add the player to the game
-            player_id: int = 0
-            player = Player(player_id)
-            game.players.append(player)
-
-            # Add the game to the game list
-            GAMES.append(game)
-            return player_id, game.id
+
+def join_pair() -> int:
+    # Purpose:       Makes a new game for two players who were already matched with each other by the lobby
+    # Pre:           Called on the event loop
+    # Post:          Returns the game ID. Its players have IDs 0 and 1, and it never went through OPEN_GAMES, so
+    #                   neither player can be paired with anyone else
+# ============================================================================
+    with REGISTRY_LOCK:
+        game = Game(next(GAME_IDS))
+        game.players = [Player(0), Player(1)]
+        game.opponent_joined.set()
+        GAMES[game.id] = game
+        return game.id
 
 def remove_player(game_id: int, player_id: int) -> None:
     # Author:        Jacob Hanks
     # Purpose:       Removes a player from the game once they have disconnected
     # Pre:           A player has disconnected
-    # Post:          That player is removed from the game
+    # Post:          That player is removed from the game. An empty game is removed, and a game with one
+    #                   player left is reset and queued for a new opponent
+# ============================================================================
+    with REGISTRY_LOCK:
+        game = find_game(game_id)
+        with game.lock:
+            player_index = find_player(game.players, player_id)
+            if player_index == -1:
+                return
+            clock = game.players[player_index].clock
+            if clock.synced():
+                logging.info("Player %d in game %d had a %.1f ms round trip and a %+.1f ms clock offset", player_id,
+                             game_id, clock.rtt * 1000, clock.offset * 1000)
+            game.players[player_index] = None
+            game.opponent_joined.clear()
+            # Nobody is left to play against a bot
+            if all(player is None or player.bot is not None for player in game.players):
+                game.players = [None, None]
+            # The next opponent starts a fresh game. Its ticks restart from 0, so old baselines are dropped
+            game.simulation = PongSimulation(WIDTH, HEIGHT)
+            for remaining in game.players:
+                if remaining is not None:
+                    remaining.history.clear()
+                    remaining.acked = 0
+            empty = game.players[0] is None and game.players[1] is None
+
+        # If there are no players left in the game, remove it
+        if empty:
+            game.closed = True
+            GAMES.pop(game_id, None)
+            if game.bot_timer is not None:
+                game.bot_timer.cancel()
+                game.bot_timer = None
+            drop_spectators(game)
+        # Otherwise wait for a new opponent. A lockstep game lives on the clients, and the one left can't
+        # restart it, so it just ends for them once they notice the opponent is gone
+        elif NETCODE != NETCODE_LOCKSTEP:
+            OPEN_GAMES.append(game)
+            schedule_bot(game)
+
+def schedule_bot(game: Game) -> None:
+    # Purpose:       Has a bot join a game that was just queued for an opponent, if nobody joins it first
+    # Pre:           Called on the event loop with REGISTRY_LOCK held
+    # Post:          add_bot is due in BOT_DELAY seconds, replacing any earlier timer. Does nothing without bots
 # ============================================================================
-    game = find_game(game_id)
-    player_index = find_player(game.players, player_id)
-    game.players.remove(game.players[player_index])
+    if BOT_DELAY is None:
+        return
+    if game.bot_timer is not None:
+        game.bot_timer.cancel()
+    game.bot_timer = asyncio.get_running_loop().call_later(BOT_DELAY, add_bot, game)
 
-def find_player(players: list[Player], player_id: int) -> int:
+def add_bot(game: Game) -> None:
+    # Purpose:       Fills the empty side of a game with a bot, which run_game plays like a player who sends an
+    #                   input every tick but is never sent anything
+    # Pre:           Called by the bot timer
+    # Post:          The game has a bot and is started, unless it was removed or filled in the meantime. The game
+    #                   stays in OPEN_GAMES, where join_game skips it since it is full
+# ============================================================================
+    with REGISTRY_LOCK:
+        game.bot_timer = None
+        with game.lock:
+            if game.closed or game.players.count(None) != 1:
+                return
+            side = game.players.index(None)
+            bot = Player(side)
+            bot.bot = PongBot(side)
+            game.players[side] = bot
+            game.opponent_joined.set()
+    METRICS.count("bots_added")
+    logging.info("A bot joined game %d", game.id)
+    start_game(game)
+
+def drop_spectators(game: Game) -> None:
+    # Purpose:       Disconnects everyone watching a game that is being removed
+    # Pre:           The game is closed
+    # Post:          Every spectator's outbox is dropped, which wakes their spectate coroutine to close them
+# ============================================================================
+    with game.lock:
+        spectators = list(game.spectators)
+    for spectator in spectators:
+        spectator.drop("game_closed")
+
+def find_player(players: list[Player | None], player_id: int) -> int:
     # Author:        Jacob Hanks
     # Purpose:       Finds a player in a game with a given player ID
     # Pre:           Assumes the list of players passed in and the player ID are valid
     # Post:          Returns the index of the player in the players list of the game
 # ============================================================================
-    for index, player in enumerate(players):
-        if player_id == player.id:
-            return index # Index of player found
+    # Players are stored in the slot matching their ID
+    if 0 <= player_id < len(players) and players[player_id] is not None:
+        return player_id
+    # Player not found. Should never occur, unless a player leaves the game.
+    logging.error("Player with id %d not found.", player_id)
+    return -1
+
+async def relay_lockstep(game: Game, player_index: int, data: bytes) -> None:
+    # Purpose:       Forwards a lockstep input message to the sender's opponent as is
+    # Pre:           data is a MSG_LOCKSTEP message from the player on side player_index
+    # Post:          The opponent's link has sent it as state, which over UDP may be lost and over TCP replaced by a
+    #                   newer message, since every message repeats the inputs that were not acknowledged yet.
+    #                   Dropped if the opponent is gone or not ready
+# ============================================================================
+    with game.lock:
+        opponent = game.players[1 - player_index]
+        link = opponent.link if opponent is not None else None
+    if link is not None:
+        await link.send(data)
+
+def start_game(game: Game) -> None:
+    # Purpose:       Starts the game loop once a player has been sent the handshake
+    # Pre:           The game has 2 players
+    # Post:          run_game is running for the game, unless it already was or the clients run the game
+    #                   themselves in lockstep
+# ============================================================================
+    if NETCODE == NETCODE_SERVER and game.task is None:
+        game.task = asyncio.create_task(run_game(game))
+
+def start_recording(game: Game, match: int) -> GameRecorder | None:
+    # Purpose:       Opens a new recording file for a game
+    # Pre:           RECORD_DIR is set. match counts the recordings already started for the game by its run_game
+    # Post:          Returns the recorder, or None if the file could not be opened
+# ============================================================================
+    # Worker processes number their games separately, so the process ID keeps file names apart
+    path = os.path.join(RECORD_DIR, f"game-{int(time.time())}-{os.getpid()}-{game.id}-{match}.pongrec")
+    try:
+        return GameRecorder(path, RECORDINGS, WIDTH, HEIGHT, TICK_RATE)
+    except OSError as e:
+        logging.error("Could not record game %d: %s", game.id, e)
+        return None
+
+async def run_game(game: Game) -> None:
+    # Purpose:       Authoritative game loop. Steps the game's simulation TICK_RATE times a second with the
+    #                   latest input from each player, each step covering the frames since the last, and sends
+    #                   both players a snapshot after every step
+    # Pre:           The game has 2 players
+    # Post:          Returns once a player leaves the game
+# ============================================================================
+    loop = asyncio.get_running_loop()
+    interval = 1 / TICK_RATE
+    frames = FRAME_RATE / TICK_RATE     # Collisions are swept, so fewer, longer steps play the same game
+    next_tick = loop.time()
+
+    METRICS.count("games_started")
+    recorder = None
+    recorded = None     # The simulation being recorded
+    matches = 0         # Recordings started by this loop
+
+    # The recording is closed however the loop ends, including the server shutting down mid-game, so what was
+    # recorded reaches the disk
+    try:
+        while game.opponent_joined.is_set():
+            tick_start = time.perf_counter()
+            now = loop.time()
+            clock_now = server_clock()
+            server_time = int(clock_now * 1000) & 0xFFFFFFFF
+            with game.lock:
+                simulation = game.simulation
+                players = [player for player in game.players if player is not None]
+                if RECORD_DIR is not None and simulation is not recorded:
+                    # A new opponent joined while this loop ran, and the game started over from tick 0. A recording's
+                    # ticks must keep increasing, so each of these matches gets its own file
+                    if recorder is not None:
+                        recorder.close()
+                    recorder = start_recording(game, matches)
+                    recorded = simulation
+                    matches += 1
+
+                # Apply the latest input from each player, then step. A bot decides its input now
+                for player in players:
+                    if player.bot is not None:
+                        player.moving = player.bot.steer(simulation, frames)
+                    simulation.paddles[player.id].moving = player.moving
+                events = simulation.step(frames)
+
+                ball = simulation.ball.rect
+                left, right = simulation.paddles
+                if recorder is not None:
+                    recorder.add(simulation.tick, ball.x, ball.y, left.rect.y, right.rect.y,
+                                 simulation.lScore, simulation.rScore, events)
+                keyframe = simulation.tick % KEYFRAME_INTERVAL == 0
+                # Points and the end of the game are also sent as reliable events, so a UDP client can't miss them
+                event = None
+                if events & (EVENT_POINT | EVENT_GAME_OVER):
+                    event = encodeEvent(simulation.tick, events & (EVENT_POINT | EVENT_GAME_OVER),
+                                        simulation.lScore, simulation.rScore)
+                outgoing = []
+                # Spectators all get the same full snapshot, serialized and framed once no matter how many there are
+                spectators = list(game.spectators)
+                if spectators:
+                    watched = frame(encodeSnapshot(Snapshot(simulation.tick, ball.x, ball.y, left.rect.y, right.rect.y,
+                                                            simulation.lScore, simulation.rScore, events, 0,
+                                                            server_time)))
+                    watched_event = frame(event) if event is not None else None
+                for player in players:
+                    if player.link is None:
+                        continue
+                    snapshot = Snapshot(simulation.tick, ball.x, ball.y, left.rect.y, right.rect.y,
+                                        simulation.lScore, simulation.rScore, events, player.last_input, server_time)
+
+                    # Send only what changed since the snapshot the client acknowledged. If that baseline is too old
+                    # or was never sent, or a keyframe is due, send the whole snapshot. encodeDelta also sends it whole
+                    # when a delta would hardly be smaller
+                    baseline = None if keyframe else player.history.get(player.acked)
+                    sampled = METRICS.sample()
+                    if sampled:
+                        encode_start = time.perf_counter()
+                    if baseline is not None and 0 < snapshot.tick - baseline.tick <= MAX_DELTA_DISTANCE:
+                        data = encodeDelta(snapshot, baseline)
+                    else:
+                        data = encodeSnapshot(snapshot)
+                    if sampled:
+                        METRICS.observe("encode_seconds", time.perf_counter() - encode_start)
+                    player.history.add(snapshot)
+
+                    # How long the newest input waited to make it into a snapshot
+                    if player.input_time:
+                        METRICS.observe("input_to_snapshot_seconds", now - player.input_time)
+                        player.input_time = 0.0
+                    # Clock sync rides along with the snapshot: the answer to the client's last ping, and our own
+                    # ping when one is due
+                    sync = []
+                    pong = player.clock.reply(clock_now)
+                    if pong is not None:
+                        sync.append(pong)
+                    if player.clock.pingDue(clock_now):
+                        sync.append(player.clock.ping(clock_now))
+                    outgoing.append((player.link, data, sync))
+
+            # Nothing here waits on a client. TCP connections are written by their outbox's own coroutine, so a slow
+            # one is only sent fewer ticks, and never holds up its opponent, the spectators or other games
+            for link, data, sync in outgoing:
+                if event is not None:
+                    await link.send_reliable(event)
+                await link.send(data, *sync)
+            for spectator in spectators:
+                if watched_event is not None:
+                    spectator.offer_reliable(watched_event)
+                spectator.offer(watched)
+            METRICS.count("ticks")
+            METRICS.observe("tick_seconds", time.perf_counter() - tick_start)
+
+            # Sleep until the next tick. If the loop fell behind, skip ahead instead of running a burst of ticks
+            next_tick += interval
+            delay = next_tick - loop.time()
+            if delay < 0:
+                METRICS.count("ticks_late")
+                next_tick = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    finally:
+        if recorder is not None:
+            recorder.close()
+    game.task = None
+
+def handle_clock_sync(player: Player, data: bytes) -> bool:
+    # Purpose:       Handles a ping or pong from a player. A ping is answered with the player's next snapshot
+    # Pre:           data is a message received from the player
+    # Post:          Returns True if it was a ping or pong, False if it is something else to handle
+# ============================================================================
+    message_type = messageType(data)
+    if message_type == MSG_PING:
+        player.clock.answer(data, server_clock())
+    elif message_type == MSG_PONG:
+        rtt = player.clock.handlePong(data, server_clock())
+        if rtt is not None:
+            METRICS.observe("rtt_seconds", rtt)
     else:
-        # Player not found. Should never occur, unless a player leaves the game.
-        logging.error("Player with id %d not found.", player_id)
-        return -1
+        return False
+    return True
+
+def hung_up(conn: socket.socket) -> bool | None:
+    # Purpose:       Checks whether a TCP client closed its connection, without taking anything out of it
+    # Pre:           conn is non-blocking, or the check is made with MSG_DONTWAIT
+    # Post:          Returns True if the connection was closed or failed, False if the client has sent data, and
+    #                   None if nothing has happened on it
+# ============================================================================
+    try:
+        return not conn.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+    except BlockingIOError:
+        return None
+    except OSError:
+        return True
 
-def client_thread_start(conn: socket.socket, game_id: int, player_id: int) -> None:
+async def watch_hangup(conn: socket.socket) -> None:
+    # Purpose:       Watches the connection of a player who is waiting for an opponent, and hasn't been sent
+    #                   anything yet, so nothing else would notice if they left
+    # Pre:           conn is a non-blocking TCP connection nothing else is reading
+    # Post:          Returns once the client closed the connection or it failed. Never returns if the client sends
+    #                   data first, which is left in the connection for client_start to read
+# ============================================================================
+    loop = asyncio.get_running_loop()
+    while True:
+        readable = loop.create_future()
+        loop.add_reader(conn.fileno(), lambda: readable.done() or readable.set_result(None))
+        try:
+            await readable
+        finally:
+            loop.remove_reader(conn.fileno())
+        state = hung_up(conn)
+        if state:
+            return
+        if state is False:
+            # It stays readable until client_start reads it, so there is nothing more to watch for
+            await loop.create_future()
+
+async def wait_for_opponent(conn: socket.socket, game: Game, player_index: int) -> bool | None:
+    # Purpose:       Waits for a 2nd player to join the game. When this is one of several workers and nobody
+    #                   joins within HANDOFF_DELAY, the connection is handed to the lobby instead, which pairs it
+    #                   with a player waiting on another worker. With bots on, the player waits here for a bot instead
+    # Pre:           conn is the TCP connection of the player on side player_index, who hasn't been sent anything
+    # Post:          Returns True once the game has 2 players, False if the player was removed from the game
+    #                   and their connection sent to the lobby, or None if the player closed the connection first
+# ============================================================================
+    # Nothing is read from a waiting player, so a player who leaves is only noticed by watching for it
+    joined = asyncio.ensure_future(game.opponent_joined.wait())
+    hangup = asyncio.ensure_future(watch_hangup(conn))
+    timeout = None if LOBBY is None or BOT_DELAY is not None else HANDOFF_DELAY
+    try:
+        await asyncio.wait((joined, hangup), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # Wait for the watch to stop reading conn, as it may be closed or handed off next
+        joined.cancel()
+        hangup.cancel()
+        await asyncio.gather(joined, hangup, return_exceptions=True)
+    if hangup.done() and not hangup.cancelled():
+        return None
+    if joined.done() and not joined.cancelled():
+        return True
+
+    # Take the game out of the registry, unless an opponent joined at the last moment
+    with REGISTRY_LOCK:
+        with game.lock:
+            if game.opponent_joined.is_set():
+                return True
+            game.players[player_index] = None
+            game.closed = True
+            GAMES.pop(game.id, None)
+    drop_spectators(game)
+    socket.send_fds(LOBBY, [b"H"], [conn.fileno()])
+    logging.debug("Handed a waiting player in game %d to the lobby", game.id)
+    return False
+
+async def client_start(conn: socket.socket, game_id: int, player_id: int, reader: FrameReader | None = None) -> None:
     # Author:        Jacob Hanks
-    # Purpose:       Thread entry point. Runs the find_game method to find a game for the client to join,
-    #                   waits on a 2nd client to join the game, then sends Initializing data to each client.
-    #                   then, it transfers data back and forth between clients such that they know where to position
-    #                   elements, score, etc.
-    # Pre:           Takes a socket, game ID, and player ID as input. It expects the socket to have a valid connection
-    # Post:             After this method is finished, the client will disconnect and the player associated with it will be removed from the list.
+    # Purpose:       Connection coroutine. Finds the game and player for the client, waits on a 2nd client to
+    #                   join the game, then sends Initializing data to each client and starts the game loop.
+    #                   After that it reads the client's inputs and hands them to the game loop.
+    #                   All socket operations are awaited on the event loop, so a waiting or idle client costs no CPU.
+    # Pre:           Takes a non-blocking socket, game ID, and player ID as input. It expects the socket to have a valid connection.
+    #                   reader holds anything already received from the connection, if it has been read from
+    # Post:             After this coroutine is finished, the client will disconnect and the player associated with it will be removed from the game.
 # ============================================================================
+    loop = asyncio.get_running_loop()
+
     # Find the game associated with the passed in ID
     game: Game = find_game(game_id)
 
     # Find the player associated with the passed in ID
     player_index: int = find_player(game.players, player_id)
-    logging.info("Player %d's index is %d in game %d", player_id, player_index, game_id)
+    logging.debug("Player %d's index is %d in game %d", player_id, player_index, game_id)
 
     # Send height/width and side to client
-    logging.info("Client %d on side %d", player_id, player_index)
+    logging.debug("Client %d on side %d", player_id, player_index)
 
-    # Don't start game until there are 2 players
-    while len(game.players) < 2:
-        continue
+    handed_off = False
+    outbox = None
+    try:
+        # Don't start game until there are 2 players. Other workers' players count too, through the lobby
+        wait_start = loop.time()
+        waited = await wait_for_opponent(conn, game, player_index)
+        if waited is None:
+            logging.info("Client %d in game %d left while waiting for an opponent", player_id, game_id)
+            METRICS.disconnect("closed")
+            return
+        if not waited:
+            handed_off = True
+            return
+        METRICS.observe("matchmaking_wait_seconds", loop.time() - wait_start)
+
+        # Everything sent from here on goes through the outbox, starting with width/height data and player index
+        outbox = Outbox(conn)
+        outbox.start()
+        link = TcpLink(outbox)
+        await link.send_reliable(encodeHello(WIDTH, HEIGHT, player_index, TICK_RATE, NETCODE, game_id))
+        logging.debug("Sent initial info to player %d in game %d", player_id, game_id)
+
+        # Snapshots go out after the handshake. Whichever player gets here first starts the game loop
+        with game.lock:
+            player = game.players[player_index]
+            player.link = link
+        start_game(game)
+
+        # Messages are length prefixed frames, received straight into this connection's ring buffer
+        if reader is None:
+            reader = FrameReader()
+
+        # Main logic loop
+        while True:
+            # Get data from client
+            free = reader.freeSpace()
+            if not free:
+                raise FramingError("Receive buffer is full without a complete frame")
+            async with asyncio.timeout(READ_TIMEOUT):
+                received = await loop.sock_recv_into(conn, free)
+            if not received: # If data was not received
+                if outbox.reason is not None: # We dropped them, which shut the socket down
+                    logging.warning("Dropped client %d in game %d: %s", player_id, game_id, outbox.reason)
+                    METRICS.disconnect(outbox.reason)
+                else:
+                    logging.info("Lost connection to client %d in game %d", player_id, game_id)
+                    METRICS.disconnect("closed")
+                break
+            reader.commit(received)
+            METRICS.count("bytes_in", received)
 
-    # Send players width/height data and player index
-    conn.sendall(pickle.dumps((WIDTH, HEIGHT, player_index)))
+            # Apply every input that arrived with this read. Only the latest one matters for the next tick
+            for received_data in reader.frames():
+                METRICS.count("messages_in")
+                if NETCODE == NETCODE_LOCKSTEP:
+                    if messageType(received_data) != MSG_LOCKSTEP:
+                        raise ProtocolError("Expected a lockstep input message")
+                    await relay_lockstep(game, player_index, bytes(received_data))
+                    continue
+                if handle_clock_sync(player, received_data):
+                    continue
+                sampled = METRICS.sample()
+                if sampled:
+                    decode_start = time.perf_counter()
+                moving, sequence, ack = decodeInput(received_data)
+                if sampled:
+                    METRICS.observe("decode_seconds", time.perf_counter() - decode_start)
+                with game.lock:
+                    player.moving = moving
+                    player.last_input = sequence
+                    player.input_time = loop.time()
+                    player.acked = ack
+    except (ProtocolError, FramingError) as e: # The client sent something we can't read
+        logging.error("Bad data from client %d in game %d: %s", player_id, game_id, e)
+        METRICS.disconnect("bad_data")
+    except TimeoutError: # Clients send every frame, so this one is gone without having closed the connection
+        logging.warning("Client %d in game %d sent nothing for %.0f seconds", player_id, game_id, READ_TIMEOUT)
+        METRICS.disconnect("read_timeout")
+    except OSError as e: # The client went away while we were waiting on it or sending to it
+        logging.error("Connection error with client %d in game %d: %s", player_id, game_id, e)
+        METRICS.disconnect("error")
+    finally:
+        if outbox is not None:
+            outbox.drop("closed")
+        # Remove the player from the game. Empty games are removed, otherwise the game waits for a new opponent.
+        # A player handed to the lobby was already removed
+        if not handed_off:
+            remove_player(game_id, player_id)
+        # Close the connection with the client. After a handoff this only closes our copy of it
+        conn.close()
+
+class UdpSession:
+    # Purpose:       Server side state of one UDP client, from CONNECT until it disconnects or times out
+    # Pre:           Created when a CONNECT arrives from a new address
+    # Post:          Removed from UdpServer.sessions when udp_client_start finishes
+# ============================================================================
+    __slots__ = ("address", "game_id", "player_id", "link", "last_seen", "closed")
+    def __init__(self, address: tuple, game_id: int, player_id: int, link: UdpLink, now: float) -> None:
+        self.address = address
+        self.game_id = game_id
+        self.player_id = player_id
+        self.link = link
+        self.last_seen = now            # Event loop time of the last datagram from the client
+        self.closed = asyncio.Event()   # Set when the client sends DISCONNECT
+
+class UdpServer(asyncio.DatagramProtocol):
+    # Purpose:       Receives every UDP datagram for the server and routes it to the session for its address
+    # Pre:           Created by loop.create_datagram_endpoint
+    # Post:          Each new client gets a udp_client_start coroutine, just like a TCP connection
+# ============================================================================
+    def __init__(self, loss_rate: float = 0.0) -> None:
+        self.loss_rate = loss_rate
+        self.transport: asyncio.DatagramTransport | None = None
+        self.sessions: dict[tuple, UdpSession] = {}
+        self.tasks: set[asyncio.Task] = set()
 
-    # Send client initialized player data
-    conn.sendall(pickle.dumps(game.players[player_index]))
-    logging.info("Sent initial info to player %d in game %d", player_id, game_id)
+    def connection_made(self, transport: asyncio.DatagramTransport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, datagram: bytes, address: tuple) -> None:
+        METRICS.count("bytes_in", len(datagram))
+        session = self.sessions.get(address)
+        if session is not None and session.link.channel.lost(): # Simulated loss on the way in
+            return
+        try:
+            kind = packetKind(datagram)
+            if kind == PACKET_CONNECT:
+                # CONNECT is resent until ACCEPT arrives, so only the first one from an address joins a game
+                if session is None:
+                    self.start_session(address)
+                self.transport.sendto(controlPacket(PACKET_ACCEPT), address)
+                return
+            if session is None: # Not connected, ignore it
+                return
+            now = asyncio.get_running_loop().time()
+            session.last_seen = now
+            if kind == PACKET_DISCONNECT:
+                session.closed.set()
+            elif kind == PACKET_DATA:
+                _, messages = session.link.channel.unpackData(datagram)
+                if not messages:
+                    # A keepalive, or state that came too late. Nothing else is sent to a player waiting for an
+                    # opponent, so the answer is how their client knows we are still here
+                    session.link.send_now()
+                for message in messages:
+                    self.handle_message(session, message, now)
+        except ProtocolError as e: # Someone sent something we can't read
+            logging.debug("Bad datagram from %s: %s", address, e)
+
+    def handle_message(self, session: UdpSession, data: bytes, now: float) -> None:
+        # Handles one message from a session's DATA packet, the way client_start handles a TCP frame
+        METRICS.count("messages_in")
+        if NETCODE == NETCODE_LOCKSTEP:
+            if messageType(data) != MSG_LOCKSTEP:
+                raise ProtocolError("Expected a lockstep input message")
+            task = asyncio.create_task(relay_lockstep(find_game(session.game_id), session.player_id, data))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+            return
+        game = find_game(session.game_id)
+        player = game.players[session.player_id]
+        if player is None or handle_clock_sync(player, data):
+            return
+        sampled = METRICS.sample()
+        if sampled:
+            decode_start = time.perf_counter()
+        moving, sequence, ack = decodeInput(data)
+        if sampled:
+            METRICS.observe("decode_seconds", time.perf_counter() - decode_start)
+        with game.lock:
+            player.moving = moving
+            player.last_input = sequence
+            player.input_time = now
+            player.acked = ack
+
+    def start_session(self, address: tuple) -> None:
+        # Make a new player, and have them join a game
+        player_id, game_id = join_game()
+        METRICS.count("connections")
+        logging.info("UDP client %s connected on game %d", address, game_id)
+        link = UdpLink(self.transport, address, UdpChannel(self.loss_rate))
+        session = UdpSession(address, game_id, player_id, link, asyncio.get_running_loop().time())
+        self.sessions[address] = session
+        task = asyncio.create_task(udp_client_start(self, session))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+async def udp_session_alive(session: UdpSession, until: asyncio.Event) -> bool:
+    # Purpose:       Waits for an event while watching a UDP session for a disconnect or timeout
+    # Pre:           n/a
+    # Post:          Returns True once until is set, or False if the client disconnected or went silent first
+# ============================================================================
+    loop = asyncio.get_running_loop()
+    while not until.is_set():
+        if session.closed.is_set():
+            METRICS.disconnect("closed")
+            return False
+        if loop.time() - session.last_seen > SESSION_TIMEOUT:
+            logging.warning("UDP client %s timed out", session.address)
+            METRICS.disconnect("timeout")
+            return False
+        try:
+            await asyncio.wait_for(until.wait(), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+    return True
+
+async def udp_client_start(server: UdpServer, session: UdpSession) -> None:
+    # Purpose:       UDP version of client_start. Waits on a 2nd client to join the game, sends the handshake
+    #                   over the reliable channel and starts the game loop. Inputs arrive through
+    #                   UdpServer.datagram_received, so this only watches for the session ending
+    # Pre:           The session's player has joined a game
+    # Post:          The player is removed from the game and the session is forgotten
+# ============================================================================
+    game = find_game(session.game_id)
+    player_index = find_player(game.players, session.player_id)
+    loop = asyncio.get_running_loop()
+    try:
+        # Don't start game until there are 2 players
+        wait_start = loop.time()
+        if not await udp_session_alive(session, game.opponent_joined):
+            return
+        METRICS.observe("matchmaking_wait_seconds", loop.time() - wait_start)
+
+        # Send players width/height data and player index
+        await session.link.send_reliable(encodeHello(WIDTH, HEIGHT, player_index, TICK_RATE, NETCODE,
+                                                       session.game_id))
+        logging.debug("Sent initial info to player %d in game %d", session.player_id, session.game_id)
+        with game.lock:
+            game.players[player_index].link = session.link
+        start_game(game)
+
+        # Play until the client leaves
+        await udp_session_alive(session, session.closed)
+        logging.info("Lost connection to UDP client %s in game %d", session.address, session.game_id)
+    finally:
+        remove_player(session.game_id, session.player_id)
+        server.sessions.pop(session.address, None)
+
+def configure_connection(conn: socket.socket) -> None:
+    # Purpose:       Sets up a newly accepted TCP connection
+    # Pre:           conn was just accepted
+    # Post:          conn is non-blocking with Nagle off, a SEND_BUFFER send buffer and keepalive probes
+# ============================================================================
+    conn.setblocking(False)
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # Not every platform lets the probe timing be set per socket. Those keep their system wide defaults
+    for option, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                          ("TCP_KEEPCNT", KEEPALIVE_COUNT)):
+        if hasattr(socket, option):
+            conn.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+async def serve(server: socket.socket) -> None:
+    # Purpose:       Accept loop. Accepts incoming connections on the event loop and starts a client_start
+    #                   coroutine for each one, so every connection shares the one thread.
+    # Pre:           Takes a bound, listening, non-blocking socket
+    # Post:          Runs until the event loop is stopped
+# ============================================================================
+    loop = asyncio.get_running_loop()
+
+    # Hold a reference to every running connection task so they are not garbage collected mid-game
+    connections: set[asyncio.Task] = set()
+
+    # Initial number of connections, increments for every player that joins
+    connection_number = 0
 
-    # Main logic loop
     while True:
-        try: # Get data from client
-            received_data: Player = pickle.loads(conn.recv(PACKET_SIZE))
-        except Exception as e: # Some exception occured when receiving data
-            logging.error("Did not receive data from client: %s", e)
-            break
-        if not received_data: # If data was not received
-            logging.warn("Lost connection to client %d in game %d", player_id, game_id )
-            break
-
-        # Update players data with what it has received
-        game.players[player_index] = received_data
-
-        # Send client other player's data.
-        # if player_index is 1, player_index - 1 will be 0, being the opposite player
-        # if player_index is 0, player_index -1 will be -1, which will also be the opposite player, since there are only 2 players.
-        conn.sendall(pickle.dumps(game.players[player_index - 1]))
-
-        # Check and see if clients are synced, pause one until theyre synced again
-        if game.players[player_index].sync <= game.players[player_index - 1].sync:
-            game.players[player_index].pause = False
-        else:
-            game.players[player_index].pause = True
-    # Remove the player from the game
-    game.players.remove(game.players[player_index])
-
-    # If there are no players left in the game, remove it from the list
-    if len(game.players) == 0:
-        GAMES.remove(game)
-    # Otherwise reinit the game with default values
-    else:
-        game.__init__(game_id)
-    # Close the connection with the client
-    conn.close()
+        # Accept incoming connections, and start a coroutine for them
+        conn, address = await loop.sock_accept(server)
+        configure_connection(conn)
+        logging.debug("Incoming connection from %s", address)
+        METRICS.count("connections")
 
+        task = asyncio.create_task(client_join(conn, connection_number))
+        connections.add(task)
+        task.add_done_callback(connections.discard)
+        connection_number += 1
 
-if __name__ == "__main__":
-    # Author:        Jacob Hanks
-    # Purpose:       Main function. Entry point for the server
+async def client_join(conn: socket.socket, connection_number: int) -> None:
+    # Purpose:       Reads a new connection's MSG_JOIN, then has it join a game as a player or watch one
+    # Pre:           conn is a newly accepted, non-blocking TCP connection
+    # Post:          The connection has been handled by client_start or spectate, or closed if it never said
+    #                   what it wanted within JOIN_TIMEOUT
+# ============================================================================
+    loop = asyncio.get_running_loop()
+    reader = FrameReader()
+    try:
+        data = await asyncio.wait_for(recvFrameAsync(loop, conn, reader), JOIN_TIMEOUT)
+        role, game_id = decodeJoin(data)
+    except (ProtocolError, FramingError, OSError, asyncio.TimeoutError) as e:
+        logging.error("Client %d did not join: %r", connection_number, e)
+        METRICS.disconnect("bad_join")
+        conn.close()
+        return
+
+    if role == ROLE_SPECTATOR:
+        logging.info("Client %d is watching game %d", connection_number, game_id)
+        await spectate(conn, game_id)
+        return
+
+    # Make a new player, and have them join a game
+    player_id, game_id = join_game()
+    logging.info("Client %d connected on game %d", connection_number, game_id)
+    await client_start(conn, game_id, player_id, reader)
+
+async def spectator_closed(conn: socket.socket) -> None:
+    # Purpose:       Returns once a spectator closes their connection. Anything they send is ignored
+    # Pre:           conn is a spectator's non-blocking TCP connection
+    # Post:          Raises OSError if the connection fails instead
+# ============================================================================
+    loop = asyncio.get_running_loop()
+    while await loop.sock_recv(conn, 1024):
+        pass
+
+async def spectate(conn: socket.socket, game_id: int) -> None:
+    # Purpose:       Connection coroutine for a spectator. Sends the handshake, then has run_game send them every
+    #                   tick of the game until they leave, the game is removed, or their outbox drops them
+    # Pre:           conn asked to watch game_id
+    # Post:          The spectator is removed from the game and their connection is closed. Connections asking
+    #                   for a game that doesn't exist, or for a lockstep game the server doesn't run, are just closed
+# ============================================================================
+    game = GAMES.get(game_id)
+    if game is None or game.closed or NETCODE != NETCODE_SERVER:
+        logging.info("No game %d to watch", game_id)
+        METRICS.disconnect("no_game")
+        conn.close()
+        return
+
+    # Nothing is awaited between finding the game and joining it, so it can't be removed in between
+    spectator = Outbox(conn)
+    try:
+        spectator.offer_reliable(frame(encodeHello(WIDTH, HEIGHT, SPECTATOR_INDEX, TICK_RATE, NETCODE, game_id)))
+        spectator.start()
+        with game.lock:
+            game.spectators.add(spectator)
+
+        # Dropping the spectator shuts their socket down, so this also returns when they are dropped
+        await spectator_closed(conn)
+        METRICS.disconnect(spectator.reason or "closed")
+    except OSError as e: # The connection failed while we were reading from it
+        logging.debug("Connection error with a spectator of game %d: %s", game_id, e)
+        METRICS.disconnect("error")
+    finally:
+        spectator.drop("closed")
+        with game.lock:
+            game.spectators.discard(spectator)
+        conn.close()
+
+def adopt_handoffs(lobby: socket.socket, connections: set[asyncio.Task]) -> None:
+    # Purpose:       Takes a pair of connections the lobby matched for this worker and starts their game
+    # Pre:           Called by the event loop when lobby is readable
+    # Post:          Both connections are in a new game together, each with a client_start task in connections
+# ============================================================================
+    try:
+        _, fds, _, _ = socket.recv_fds(lobby, 16, 4)
+    except BlockingIOError:
+        return
+    conns = []
+    for fd in fds:
+        conn = socket.socket(fileno=fd)
+        conn.setblocking(False)
+        conns.append(conn)
+    if len(conns) != 2:
+        logging.error("The lobby sent %d connections instead of a pair", len(conns))
+        for conn in conns:
+            conn.close()
+        return
+
+    # They play each other, not whoever is waiting here, or one of them would be left waiting for the lobby again
+    game_id = join_pair()
+    logging.debug("Adopted a pair of players from the lobby into game %d", game_id)
+    for player_id, conn in enumerate(conns):
+        task = asyncio.create_task(client_start(conn, game_id, player_id))
+        connections.add(task)
+        task.add_done_callback(connections.discard)
+
+def count_players() -> int:
+    # Purpose:       Counts the players in every game, for the players_active gauge
     # Pre:           n/a
-    # Post:          This function binds to a socket with host IP and port PORT, then it listens on that IP and port
-    #                   for a client to attempt to connect. When a client connects, it spawns a new thread for it.
-    #                   The new thread has target client_thread_start, which starts the game and data transfer process.
-    #                   After it spawns the thread, the main thread should be open for another connection.
+    # Post:          Returns the count. Bots are not counted
 # ============================================================================
-    # Set up logging to stdout
-    logging.basicConfig(format="%(asctime)s: %(message)s", level=logging.INFO, datefmt="%H:%M:%S")
+    with REGISTRY_LOCK:
+        return sum(player is not None and player.bot is None
+                   for game in GAMES.values() for player in game.players)
+
+async def send_stats(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    # Purpose:       Stats endpoint. Every connection gets the current metrics as plain text, then is closed
+    # Pre:           Called by asyncio.start_server
+    # Post:          The connection is closed
+# ============================================================================
+    try:
+        writer.write(METRICS.render().encode())
+        await writer.drain()
+    except OSError:
+        pass
+    finally:
+        writer.close()
+
+async def dump_stats(interval: float) -> None:
+    # Purpose:       Logs the current metrics every interval seconds
+    # Pre:           interval is positive
+    # Post:          Runs until the event loop is stopped
+# ============================================================================
+    while True:
+        await asyncio.sleep(interval)
+        logging.info("Stats:\n%s", METRICS.render())
+
+async def main(server: socket.socket | None, udp: bool, loss_rate: float, stats_port: int | None = None,
+               stats_interval: float | None = None, lobby: socket.socket | None = None) -> None:
+    # Purpose:       Starts the enabled transports on the event loop, and the stats endpoint and dump if asked for
+    # Pre:           server is a bound, listening, non-blocking TCP socket, or None to only serve UDP.
+    #                   lobby is this worker's channel to the lobby, or None when running as a single process
+    # Post:          Runs until the event loop is stopped
+# ============================================================================
+    global LOBBY
+    loop = asyncio.get_running_loop()
+    handed_in: set[asyncio.Task] = set()
+    if lobby is not None:
+        LOBBY = lobby
+        lobby.setblocking(False)
+        loop.add_reader(lobby.fileno(), adopt_handoffs, lobby, handed_in)
+    METRICS.gauge("games_active", lambda: len(GAMES))
+    METRICS.gauge("games_waiting",
+                  lambda: sum(not game.closed and None in game.players for game in list(OPEN_GAMES)))
+    METRICS.gauge("players_active", count_players)
+    METRICS.gauge("spectators_active", lambda: sum(len(game.spectators) for game in list(GAMES.values())))
+    background = []     # Holds the stats server and dump task so they are not garbage collected
+    if stats_port is not None:
+        logging.info("Serving stats on %s:%d.", IP, stats_port)
+        background.append(await asyncio.start_server(send_stats, IP, stats_port))
+    if stats_interval:
+        background.append(asyncio.create_task(dump_stats(stats_interval)))
+    if udp:
+        logging.info("Serving UDP on %s:%d.", IP, PORT)
+        await loop.create_datagram_endpoint(lambda: UdpServer(loss_rate), local_addr=(IP, PORT),
+                                            reuse_port=lobby is not None)
+    if server is not None:
+        await serve(server)
+    else:
+        await asyncio.Event().wait()
+
+def run_server(args: argparse.Namespace, worker: int | None = None, lobby: socket.socket | None = None) -> None:
+    # Purpose:       Binds the server's sockets and serves clients until interrupted
+    # Pre:           args are the parsed command line options. worker and lobby are set when this is one of
+    #                   several worker processes, in which case the port is shared with SO_REUSEPORT
+    # Post:          Exits the process if a socket can't be bound
+# ============================================================================
+    global IP, PORT, NETCODE, TICK_RATE, RECORD_DIR, RECORDINGS, BOT_DELAY
+    IP, PORT = args.ip, args.port
+    NETCODE = NETCODES[args.netcode]
+    TICK_RATE = args.tick_rate
+    BOT_DELAY = args.bot
+    if args.record is not None:
+        os.makedirs(args.record, exist_ok=True)
+        RECORD_DIR = args.record
+        RECORDINGS = RecordingWriter()
+        RECORDINGS.start()
+
+    server = None
+    if args.transport in ("tcp", "both"):
+        # Init socket
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if worker is not None:
+            # Every worker listens on the same port, and the kernel spreads new connections between them
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        # Bind to socket, with error handling
+        logging.info("Attempting to bind to %s:%d.", IP, PORT)
+        try:
+            server.bind((IP, PORT))
+        except OSError as e:
+            logging.error("Socket error: %s", e)
+            exit(-1)
+        logging.info("Bind successful.")
 
-    # Init socket
-    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Listen for clients. The backlog is large since a single loop can hold thousands of sessions
+        server.listen(socket.SOMAXCONN)
+        server.setblocking(False)
 
-    # Bind to socket, with error handling
-    logging.info("Attempting to bind to %s:%d.", IP, PORT)
+    stats_port = args.stats_port
+    if stats_port is not None and worker is not None:
+        stats_port += worker
+
+    logging.info("Waiting for connections...")
     try:
-        server.bind((IP, PORT))
-    except:
-        logging.error("Socket error: %s", socket.error)
+        asyncio.run(main(server, args.transport in ("udp", "both"), args.loss, stats_port, args.stats_interval,
+                         lobby))
+    except KeyboardInterrupt:
+        logging.info("Shutting down.")
+    except OSError as e: # The UDP socket could not be bound
+        logging.error("Socket error: %s", e)
         exit(-1)
-    logging.info("Bind successful.")
+    finally:
+        if server is not None:
+            server.close()
+        # Every game has closed its recording by now, so this writes them out in full
+        if RECORDINGS is not None:
+            RECORDINGS.close()
 
-    logging.info("Waiting for connections...")
+def fd_hung_up(fd: int) -> bool:
+    # Purpose:       hung_up for a connection the lobby holds as a bare file descriptor
+    # Pre:           fd is a TCP connection
+    # Post:          Returns True if the client closed the connection or it failed. fd is left open
+# ============================================================================
+    conn = socket.socket(fileno=fd)
+    try:
+        return bool(hung_up(conn))
+    finally:
+        conn.detach()
 
+def run_lobby(args: argparse.Namespace) -> None:
+    # Purpose:       Starts args.workers server processes and pairs up TCP players waiting alone on different
+    #                   workers. A worker hands its lonely player's socket here (see wait_for_opponent). Once two
+    #                   are waiting, both sockets are passed to the first one's worker, where they join a game
+    #                   together. UDP players are only paired within their worker, since they share its socket
+    # Pre:           args.workers is more than 1
+    # Post:          Runs until interrupted or a worker dies, then stops every worker
+# ============================================================================
+    selector = selectors.DefaultSelector()
+    channels: list[socket.socket] = []
+    processes: list[multiprocessing.Process] = []
+    for worker in range(args.workers):
+        # SEQPACKET keeps every handoff a separate message, with its file descriptors attached
+        lobby_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        process = multiprocessing.Process(target=run_server, args=(args, worker, worker_end),
+                                          name=f"worker-{worker}", daemon=True)
+        process.start()
+        worker_end.close()
+        channels.append(lobby_end)
+        processes.append(process)
+        selector.register(lobby_end, selectors.EVENT_READ, worker)
 
-    # Initial number of threads, increments for every player that joins
-    thread_number = 0
+    waiting: deque[tuple[int, int]] = deque()   # (worker, file descriptor) of each player waiting in the lobby
+    try:
+        while all(process.is_alive() for process in processes):
+            for key, _ in selector.select(timeout=1.0):
+                _, fds, _, _ = socket.recv_fds(key.fileobj, 16, 4)
+                waiting.extend((key.data, fd) for fd in fds)
 
-    # Listen for clients
-    server.listen(6)
-    while True:
+            # Players who left while waiting here are dropped, so nobody is paired with them
+            if len(waiting) >= 2:
+                for entry in [entry for entry in waiting if fd_hung_up(entry[1])]:
+                    waiting.remove(entry)
+                    os.close(entry[1])
 
-        # Accept incoming connections, and thread them
-        conn, address = server.accept()
-        logging.info("Incoming connection from %s", address)
+            # Send pairs to the worker of whoever waited longest
+            while len(waiting) >= 2:
+                (worker, first), (_, second) = waiting.popleft(), waiting.popleft()
+                socket.send_fds(channels[worker], [b"A"], [first, second])
+                os.close(first)
+                os.close(second)
+        logging.error("A worker stopped, shutting down.")
+    finally:
+        # Interrupt the workers like Ctrl+C does, so they close their recordings, and only kill the ones that hang
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
+        for process in processes:
+            process.join(SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        for _, fd in waiting:
+            os.close(fd)
 
-        # Make a new player, and have them join a game
-        player_id, game_id= join_game()
+if __name__ == "__main__":
+    # Author:        Jacob Hanks
+    # Purpose:       Main function. Entry point for the server
+    # Pre:           n/a
+    # Post:          This function binds to a socket with host IP and port PORT, then it listens on that IP and port
+    #                   for a client to attempt to connect. Connections are accepted and served by coroutines on a
+    #                   single asyncio event loop (see serve), which starts client_start for every client.
+    #                   client_start starts the game and data transfer process. With --transport udp or both,
+    #                   UDP clients are served on the same port by UdpServer. With --workers, that all happens in
+    #                   each worker process and this process becomes the lobby (see run_lobby)
+# ============================================================================
+    parser = argparse.ArgumentParser(description="Network pong server")
+    parser.add_argument("--ip", default=IP, help="IP to bind")
+    parser.add_argument("--port", type=int, default=PORT, help="Port to serve TCP and UDP clients on")
+    parser.add_argument("--transport", choices=("tcp", "udp", "both"), default="tcp",
+                        help="Which transports clients may connect with")
+    parser.add_argument("--loss", type=float, default=0.0,
+                        help="Fraction of UDP datagrams to drop in each direction, to test packet loss")
+    parser.add_argument("--netcode", choices=tuple(NETCODES), default="server",
+                        help="server: simulate every game here and send snapshots. "
+                             "lockstep: clients simulate the game and the server relays their inputs")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE,
+                        help="Simulation steps per second. Lower rates save CPU and play the same game, "
+                             "clients just see it updated less often")
+    parser.add_argument("--stats-port", type=int,
+                        help="Serve the server's metrics as plain text to anyone connecting to this port. "
+                             "With --workers, worker i serves its own metrics on this port + i")
+    parser.add_argument("--stats-interval", type=float,
+                        help="Log the server's metrics every this many seconds")
+    parser.add_argument("--log-level", choices=("debug", "info", "warning", "error"), default="info",
+                        help="debug also logs every connection's handshake")
+    parser.add_argument("--record", metavar="DIR",
+                        help="Record every game to a file in DIR, for pongClient.py --replay")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes sharing the port with SO_REUSEPORT, each running its own games")
+    parser.add_argument("--bot", type=float, nargs="?", const=0.0, metavar="SECONDS",
+                        help="Have a bot play anyone left waiting alone for SECONDS, or right away without SECONDS. "
+                             "With --workers, waiting players get a bot instead of looking on other workers")
+    args = parser.parse_args()
+    if not 1 <= args.tick_rate <= 255:
+        parser.error("--tick-rate must be between 1 and 255")
+    if args.bot is not None and (args.bot < 0 or args.netcode != "server"):
+        parser.error("--bot needs --netcode server and a delay of 0 or more")
 
-        logging.info("Client %d connected on game %d", thread_number, game_id)
+    # Set up logging to stdout
+    log_format = "%(asctime)s: %(processName)s: %(message)s" if args.workers > 1 else "%(asctime)s: %(message)s"
+    logging.basicConfig(format=log_format, level=args.log_level.upper(), datefmt="%H:%M:%S")
 
-        client_thread = threading.Thread(target=client_thread_start, args=(conn, game_id, player_id))
-        client_thread.start()
-        thread_number += 1
+    try:
+        if args.workers > 1:
+            run_lobby(args)
+        else:
+            run_server(args)
+    except KeyboardInterrupt:
+        logging.info("Shutting down.")